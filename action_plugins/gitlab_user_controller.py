@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+"""the gitlab_user_controller action: runs the gitlab_user module in the Ansible worker process on the
+   controller instead of shipping it to the target. Ansible starts a new worker process for every task
+   and host, so the plugin keeps nothing between tasks. Consecutive tasks share their keep-alive
+   connections, rate limit state and recently fetched listings through the gitlab_user broker process
+   on broker_socket, which defaults to default_broker_socket.
+"""
+
+import imp
+import os
+
+from ansible.module_utils.common import validation
+from ansible.module_utils.parsing.convert_bool import boolean
+from ansible.plugins.action import ActionBase
+from ansible.utils.display import Display
+
+display = Display()
+gitlab_user = imp.load_source(
+    'gitlab_user_module',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'library', 'gitlab_user.py')
+)
+
+default_broker_socket = '~/.ansible/tmp/gitlab_user_controller.sock'
+type_checks = {
+    'str': validation.check_type_str,
+    'list': validation.check_type_list,
+    'int': validation.check_type_int,
+    'float': validation.check_type_float,
+    'raw': validation.check_type_raw,
+}
+
+
+class ArgumentError(Exception):
+    pass
+
+
+def module_params(args):
+    """checks the task arguments against the module's argument spec with the validation functions of
+       AnsibleModule, and returns them completed with the defaults
+    """
+    spec = gitlab_user.argument_spec()
+    unsupported_params = sorted(set(args) - set(spec))
+    if unsupported_params:
+        raise ArgumentError('Unsupported parameters for (gitlab_user) module: %s' % ', '.join(unsupported_params))
+
+    given = dict((name, value) for name, value in args.items() if value is not None)
+    try:
+        validation.check_mutually_exclusive(gitlab_user.mutually_exclusive, given)
+        validation.check_required_arguments(spec, given)
+        params = {}
+        for name, option in spec.items():
+            value = given.get(name, option.get('default'))
+            if value is not None:
+                value = type_checks[option.get('type', 'str')](value)
+                if option.get('choices') and value not in option['choices']:
+                    raise TypeError('value of %s must be one of: %s, got: %s'
+                                    % (name, ', '.join(str(choice) for choice in option['choices']), value))
+            params[name] = value
+        validation.check_required_together(gitlab_user.required_together, given)
+        validation.check_required_one_of(gitlab_user.required_one_of, given)
+    except TypeError as e:
+        raise ArgumentError(str(e))
+
+    return gitlab_user.convert_booleans(params, boolean)
+
+
+class ActionModule(ActionBase):
+
+    TRANSFERS_FILES = False
+
+    def run(self, tmp=None, task_vars=None):
+        result = super(ActionModule, self).run(tmp, task_vars)
+
+        try:
+            params = module_params(self._task.args)
+        except ArgumentError as e:
+            result.update(failed=True, msg=str(e))
+            return result
+        params['broker_socket'] = params['broker_socket'] or default_broker_socket
+
+        try:
+            gitlab_user.open_session(params, boolean)
+            try:
+                result.update(gitlab_user.run(params, self._play_context.check_mode, progress=display.v))
+            finally:
+                gitlab_user.save_session()
+        except gitlab_user.GitlabModuleInternalException as e:
+            result.update(failed=True, msg=e.message)
+        finally:
+            gitlab_user.close_session()
+        return result
@@ -8,9 +8,67 @@ short_description: create , update or delete a user account in Gitlab
 options:
   username:
     description: The username to identify the account being altered
-    required: yes
+    required: yes, unless users is given
     default: none
     choices: []
+  users:
+    description:
+      - A list of accounts to reconcile in one module run, instead of the single account identified by username. Every entry is a dictionary
+        with a username and any of the options name, email, password, skype, linkedin, twitter, website_url, projects_limit, extern_uid,
+        provider, bio, admin, can_create_group, ssh_key_title, ssh_key, ssh_keys, ssh_keys_exclusive, state and update_password. Those
+        options given outside of users are defaults for all entries.
+      - The user list is fetched once and shared by all entries. The result contains the changed state of every entry in I(users).
+    required: no
+    default: none
+    choices: []
+  exclusive:
+    description:
+      - Makes I(users) the complete list of accounts. Accounts of the user list that are not declared in I(users), neither present nor
+        absent, are pruned after the declared entries were reconciled, as given in I(prune_action). The accounts to prune are taken
+        from the user list the module fetched anyway and are pruned concurrently, so no account is looked up on its own.
+      - I(exclusive) works with I(users_file) as well. Nothing is pruned if an entry failed, and the module fails if no account is
+        declared at all. The account that owns I(private_token) is never pruned. The result lists the pruned accounts in I(pruned).
+    required: no
+    default: no
+    choices: [yes, no]
+  prune_action:
+    description: Whether I(exclusive) deletes the accounts that are not declared, or blocks them so they keep their projects. Accounts that are blocked already are left alone.
+    required: no
+    default: delete
+    choices: [delete, block]
+  protected_users:
+    description: Usernames or shell patterns, e.g. C(root) or C(*-bot), of accounts that I(exclusive) never prunes.
+    required: no
+    default: []
+    choices: []
+  max_deletions:
+    description: The most accounts I(exclusive) may prune in one run. If more accounts are not declared, the module fails before it changes anything.
+    required: no
+    default: 10
+    choices: []
+  users_file:
+    description:
+      - A file on the host the module runs on with the accounts to reconcile, one account per CSV row, JSON line or LDIF entry, instead of
+        I(username) or I(users). The records take the same options as the entries of I(users), options given outside of the file are
+        defaults for all records.
+      - The file is read record by record and reconciled in chunks of I(chunk_size) against one user list, so memory use does not grow
+        with the size of the file. The result counts the records, changed and failed accounts in I(users_file) and lists the first
+        100 failed records in I(failures). Progress is logged after every chunk.
+      - LDIF entries map uid to username, displayName or cn to name, mail to email and every sshPublicKey to an entry of ssh_keys.
+        Entries with changetype delete are absent.
+    required: no
+    default: none
+    choices: []
+  users_file_format:
+    description: The format of I(users_file). C(auto) tells it from the file extension, .csv, .jsonl, .ndjson or .ldif.
+    required: no
+    default: auto
+    choices: [auto, csv, jsonl, ldif]
+  chunk_size:
+    description: The number of I(users_file) records reconciled together.
+    required: no
+    default: 500
+    choices: []
   private_token:
     description: The private_token used for API authentication, it must belong to an admin user. Login to Gitlab and go to I(profile settings -> account) to find the private token.
     required: yes
@@ -27,15 +85,108 @@ options:
     default: none
     choices: []
   email:
-    description: the user's email. This module only supports one email address per user. See the M(gitlab_email) module if you need more.
+    description: the user's email. This module only supports one email address per user. See the M(gitlab_email) module if you need more. On API v4 a changed email is set in the same request as the other user changes, without reconfirmation.
     required: yes if the account does not exist yet
     default: none
     choices: []
   password:
-    description: the user's password. Be aware that if password is set, the module will always send an update request to Gitlab, regardless of whether something changed or not.
+    description:
+      - the user's password. Gitlab never returns passwords, so with I(update_password=always) the module sends an update request whenever
+        password is set, unless I(password_state_file) shows that this password was set already.
     required: yes if the account does not exist yet
     default: none
     choices: []
+  update_password:
+    description: C(always) sets the password of existing accounts too, C(on_create) only sets it when the account is created.
+    required: no
+    default: always
+    choices: [always, on_create]
+  password_state_file:
+    description:
+      - A local file in which the module keeps a salted hash of every password it set. A password is only sent to Gitlab again if it differs
+        from the one that was set last, so an unchanged password no longer causes an update on every run.
+      - The file is created readable by its owner only. Accounts deleted by the module are removed from it.
+    required: no
+    default: none
+    choices: []
+  journal_file:
+    description:
+      - A local file in which runs with I(users) or I(users_file) record every entry they completed. If such a run is interrupted or
+        some entries fail, running it again with the same journal skips the entries that were completed and reconciles the rest only.
+        Entries are recognized by their options, an entry that was changed since is reconciled again.
+      - The journal is appended to and synced to disk in batches and after every chunk of I(users_file). It is emptied when a run
+        completes without failures, so the next run starts from the beginning. Only one run at a time can use a journal.
+    required: no
+    default: none
+    choices: []
+  plan_file:
+    description:
+      - A local file to which a run in check mode writes the plan of its writes, the users it would create, the fields it would
+        change, the keys it would add and delete, the emails it would switch and the users it would delete or block. The fields a write
+        overwrites are kept with it. The plan can contain passwords, it is readable by its owner only.
+      - Without check mode, I(plan_file) is ignored.
+    required: no
+    default: none
+    choices: []
+  apply_plan:
+    description:
+      - A plan written to I(plan_file) by an earlier run in check mode. The module sends its writes instead of reconciling
+        I(username), I(users) or I(users_file), without fetching the user list and the users' keys again. The plan must have been made
+        for the same I(api_url).
+      - The operations of one user are applied in order, a failed operation skips the following ones of that user.
+    required: no
+    default: none
+    choices: []
+  plan_preconditions:
+    description:
+      - Whether I(apply_plan) first checks that every user is still as the plan saw it, with one request per user. An operation whose user
+        was created, deleted, renamed or changed in a field the plan overwrites since then fails without writing.
+    required: no
+    default: yes
+    choices: [yes, no]
+  user_cache_dir:
+    description:
+      - A local directory, e.g. C(~/.ansible/tmp), in which the module keeps a copy of the user listings and the users' key listings
+        of every I(api_url) between runs. Cached pages older than I(user_cache_max_age) are requested with If-None-Match and
+        If-Modified-Since, so a user list that did not change is answered with 304 Not Modified responses without a body. Users
+        and keys changed by the module are updated in the cache.
+      - The cache is shared by all module processes on the host. Every page is locked, the first process that needs a page
+        fetches it and concurrent processes, e.g. the forks of a play delegated to localhost, wait for it and read its result.
+      - The cache files are created readable by their owner only. Pages that were not fetched or revalidated for a day are removed.
+    required: no
+    default: none, no cache
+    choices: []
+  user_cache_max_age:
+    description: The seconds during which a cached page is used without asking Gitlab whether it changed.
+    required: no
+    default: 10
+    choices: []
+  broker_socket:
+    description:
+      - A Unix socket path, e.g. C(~/.ansible/tmp/gitlab_user.sock), on which a broker process serves the requests of all module runs
+        on the host. The first module run that finds nobody listening on it starts the broker in the background. The broker holds
+        the keep-alive connections to Gitlab, the rate limit state and the user, email and key listings it fetched, for
+        I(user_cache_max_age) seconds or until a module changes them, so many short module runs share one warm client.
+      - The broker keeps the I(rate_limit) and I(user_cache_max_age) of the module run that started it. I(http_engine) does not apply,
+        retries are still done by the module.
+    required: no
+    default: none, every module run connects on its own
+    choices: []
+  broker_idle_timeout:
+    description: The seconds after which the broker exits when no module run is connected to it.
+    required: no
+    default: 60
+    choices: []
+  directory_snapshot:
+    description:
+      - A snapshot of the Gitlab users taken by M(gitlab_user_facts), or the file it was written to. The module then plans the changes
+        from the snapshot instead of looking the user, its emails and its keys up, so a play over many accounts sends no request for
+        the accounts that are unchanged.
+      - An account the plan changes or deletes is looked up once more before it is written to, so a snapshot that is out of date never
+        overwrites a newer change. The snapshot must be taken from the same I(api_url).
+    required: no
+    default: none
+    choices: []
   skype:
     description: The user's skype
     required: no
@@ -87,10 +238,77 @@ options:
     default: none
     choices: []
   ssh_key:
-    description: An SSH public key as a string. This module only supports one SSH key per user. See the M(gitlab_pubkey) module if you need more.
+    description: An SSH public key as a string. Use I(ssh_keys) for more than one key per user. Keys are compared by type and fingerprint, so a different comment or trailing whitespace is not a change. A key the user already has under another title is left as it is.
+    required: no
+    default: none
+    choices: []
+  ssh_keys:
+    description:
+      - A list of SSH public keys, each a dictionary with a title and a key. They are compared like I(ssh_key), which can be given
+        as well. The user's keys are listed once, then only the missing keys are uploaded and the keys they replace deleted,
+        up to I(max_workers) at the same time.
     required: no
     default: none
     choices: []
+  ssh_keys_exclusive:
+    description: whether the user's keys that are neither in I(ssh_keys) nor I(ssh_key) are deleted. Only applies if any of them is given.
+    required: no
+    default: no
+    choices: [yes, no]
+  max_workers:
+    description: The maximum number of concurrent requests when fetching the user list, and of users reconciled concurrently when I(users) is given. The entries of one user are always reconciled in order.
+    required: no
+    default: 4
+    choices: []
+  http_keep_alive:
+    description: whether the requests of a module run reuse their HTTP connection to Gitlab. Requests through a proxy always use a new connection.
+    required: no
+    default: yes
+    choices: [yes, no]
+  http_engine:
+    description:
+      - How concurrent requests are sent. C(threads) sends every request on the thread that needs it. C(event_loop) hands all requests to
+        one event loop thread with non-blocking connections, so large user lists and many users are handled with up to I(max_in_flight)
+        requests on the wire at the same time.
+      - C(event_loop) needs poll() and an ssl module with non-blocking handshakes (python 2.7.9), without them C(threads) is used.
+    required: no
+    default: threads
+    choices: [threads, event_loop]
+  max_in_flight:
+    description: The maximum number of requests on the wire at the same time with I(http_engine=event_loop).
+    required: no
+    default: 100
+    choices: []
+  rate_limit:
+    description:
+      - The maximum number of requests per second. Requests are also spread over the rate limit window Gitlab announces in the
+        RateLimit-Remaining and RateLimit-Reset headers of its responses.
+      - Requests rejected with 429 Too Many Requests are sent again after the time in the Retry-After header of the response.
+    required: no
+    default: none, limited by Gitlab only
+    choices: []
+  retries:
+    description:
+      - How often a request that failed with a connection error or with 502, 503 or 504 is sent again. GET, PUT and DELETE requests
+        are sent again right away, requests that create users, keys or emails only after reading back that the first attempt did not create them.
+    required: no
+    default: 3
+    choices: []
+  retry_backoff:
+    description: The seconds to wait before the first retry, the wait doubles with every further retry.
+    required: no
+    default: 0.5
+    choices: []
+  retry_jitter:
+    description: The fraction of the wait before a retry that is random, so concurrent retries don't hit Gitlab at the same time.
+    required: no
+    default: 1.0
+    choices: []
+  retry_deadline:
+    description: The seconds after the first attempt of a request after which it is not retried anymore.
+    required: no
+    default: 60
+    choices: []
 '''
 
 EXAMPLES = '''
@@ -122,6 +340,45 @@ EXAMPLES = '''
     state: absent
 
 
+# ensure a list of users in one run
+- gitlab_user:
+    users:
+      - username: test
+        name: some name
+        email: someone@something.com
+        password: abc123yz
+      - username: olduser
+        state: absent
+    can_create_group: no
+    api_url: https://gitlab-url-internal.somedomain.com/api/v3
+    private_token: 7389rz478
+
+
+# plan the changes of a list of users in check mode, then apply the reviewed plan
+- gitlab_user:
+    users: "{{ accounts }}"
+    plan_file: /srv/gitlab/users.plan
+    api_url: https://gitlab-url-internal.somedomain.com/api/v3
+    private_token: 7389rz478
+  check_mode: yes
+
+- gitlab_user:
+    apply_plan: /srv/gitlab/users.plan
+    api_url: https://gitlab-url-internal.somedomain.com/api/v3
+    private_token: 7389rz478
+
+
+# make a list of users the only accounts, blocking every other account except root and bots
+- gitlab_user:
+    users: "{{ hr_accounts }}"
+    exclusive: yes
+    prune_action: block
+    protected_users: [root, "*-bot"]
+    max_deletions: 50
+    api_url: https://gitlab-url-internal.somedomain.com/api/v3
+    private_token: 7389rz478
+
+
 # add / update an ssh pubkey
 - gitlab_user:
     username: test
@@ -130,10 +387,49 @@ EXAMPLES = '''
     api_url: https://gitlab-url-internal.somedomain.com/api/v3
     private_token: 7389rz478
     state: present
+
+
+# make a list of ssh pubkeys the only keys of the user
+- gitlab_user:
+    username: test
+    ssh_keys:
+      - title: laptop
+        key: "{{ lookup('file', '/some/path/laptop.pub') }}"
+      - title: workstation
+        key: "{{ lookup('file', '/some/path/workstation.pub') }}"
+    ssh_keys_exclusive: yes
+    api_url: https://gitlab-url-internal.somedomain.com/api/v3
+    private_token: 7389rz478
+    state: present
 '''
 
 import ansible.module_utils.urls as urls
+import base64
+import binascii
+import collections
+import contextlib
+import csv
+import email.utils
+import errno
+import fcntl
+import fnmatch
+import hashlib
+import hmac
+import httplib
+import itertools
+import multiprocessing.pool
+import os
+import random
+import re
+import select
+import socket
+import ssl
+import tempfile
+import threading
+import time
+import urllib
 import urllib2
+import urlparse
 
 allowed_user_params = [
     'password', 'username', 'name', 'skype', 'linkedin', 'twitter', 'website_url', 'projects_limit',
@@ -145,14 +441,917 @@ required_user_create_params = [
 required_user_update_params = [
     'username'
 ]
+user_spec_params = allowed_user_params + [
+    'email', 'admin', 'ssh_key_title', 'ssh_key', 'ssh_keys', 'ssh_keys_exclusive', 'state', 'update_password'
+]
+indexed_user_params = ['id', 'email', 'is_admin', 'state'] + [
+    param_name for param_name in allowed_user_params if param_name != 'password'
+]
+interned_user_params = ['state', 'provider']
+items_per_page = 100
+default_max_workers = 4
+request_timeout = 10
+default_max_in_flight = 100
+max_rate_limited_attempts = 10
+retryable_statuses = (502, 503, 504)
+password_hash_iterations = 10000
+default_user_cache_max_age = 10.0
+user_cache_page_expiry = 86400.0
+user_cache_expiry_interval = 3600.0
+default_broker_idle_timeout = 60.0
+broker_start_timeout = 5.0
+not_modified_status = 304
+default_chunk_size = 500
+max_reported_failures = 100
+journal_sync_every = 100
+default_max_deletions = 10
+users_file_formats = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.ldif': 'ldif'}
+ldif_user_attributes = {
+    'uid': 'username', 'cn': 'name', 'displayname': 'name', 'mail': 'email', 'sshpublickey': 'ssh_keys'
+}
 
 
 class GitlabModuleInternalException(Exception):
     pass
 
 
-def _send_request(method, url, headers, body=None):
+class GitlabHttpError(GitlabModuleInternalException):
+    """an error response of the Gitlab API, with its status code and headers"""
+
+    def __init__(self, status, reason, headers, body):
+        GitlabModuleInternalException.__init__(self, '%d %s\n%s' % (status, reason, body))
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+
+class _ConnectionPool(object):
+    """keeps idle HTTP/1.1 connections per scheme, host and port, so the requests of a module run reuse
+       their TCP connection and TLS session instead of connecting again for every request
+    """
+
+    default_ports = {'http': 80, 'https': 443}
+
+    def __init__(self, timeout=request_timeout):
+        self.timeout = timeout
+        self._idle_connections = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def tls_available():
+        """HTTPS connections verify the server with an SSL context, which Python 2.7.9 introduced"""
+        return hasattr(ssl, 'create_default_context')
+
+    def accepts(self, url):
+        """requests through a proxy are left to open_url, as are HTTPS requests without tls_available()"""
+        scheme = urlparse.urlsplit(url).scheme
+        return scheme in self.default_ports and scheme not in urllib.getproxies() and \
+            (scheme != 'https' or self.tls_available())
+
+    def request(self, method, url, headers, body=None):
+        """returns the response headers and body, or None if the response is a redirect that
+           has to be followed by open_url. 304 Not Modified is returned as a response
+        """
+        url_parts = urlparse.urlsplit(url)
+        key = (url_parts.scheme, url_parts.hostname, url_parts.port or self.default_ports[url_parts.scheme])
+        path = urlparse.urlunsplit(('', '', url_parts.path or '/', url_parts.query, ''))
+
+        connection, reused = self._acquire(key)
+        try:
+            response = self._perform(connection, method, path, headers, body)
+        except (httplib.HTTPException, socket.error) as e:
+            connection.close()
+            if not reused or not self._closed_while_idle(e):
+                raise
+            # the server closed the idle connection in the meantime, the request never reached it
+            connection, reused = self._connect(key), False
+            response = self._perform(connection, method, path, headers, body)
+        try:
+            response_body = response.read()
+        except (httplib.HTTPException, socket.error):
+            connection.close()
+            raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(key, connection)
+
+        if 300 <= response.status < 400 and response.status != not_modified_status:
+            return None
+        if response.status >= 400:
+            raise GitlabHttpError(response.status, response.reason, dict(response.getheaders()), response_body)
+
+        response_headers = dict(response.getheaders())
+        response_headers['status'] = '%d %s' % (response.status, response.reason)
+        return response_headers, response_body
+
+    def close(self):
+        with self._lock:
+            idle_connections, self._idle_connections = self._idle_connections, {}
+        for connections in idle_connections.values():
+            for connection in connections:
+                connection.close()
+
+    def _perform(self, connection, method, path, headers, body):
+        connection.request(method, path, body, headers)
+        return connection.getresponse()
+
+    @staticmethod
+    def _closed_while_idle(error):
+        """whether the request failed because the server had closed the connection before it got the
+           request. A timeout or a response that broke off may come after Gitlab processed the request,
+           which must not be sent again then
+        """
+        if isinstance(error, httplib.BadStatusLine):
+            return error.line in ('', "''") or error.line.startswith('No status line received')
+        return isinstance(error, socket.error) and not isinstance(error, socket.timeout) and \
+            error.errno in (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+
+    def _acquire(self, key):
+        with self._lock:
+            connections = self._idle_connections.get(key)
+            if connections:
+                return connections.pop(), True
+        return self._connect(key), False
+
+    def _release(self, key, connection):
+        with self._lock:
+            self._idle_connections.setdefault(key, []).append(connection)
+
+    def _connect(self, key):
+        scheme, host, port = key
+        if scheme == 'https':
+            return httplib.HTTPSConnection(host, port, timeout=self.timeout, context=ssl.create_default_context())
+        return httplib.HTTPConnection(host, port, timeout=self.timeout)
+
+
+class _PendingResponse(object):
+    """the response of a request handed to the _EventLoopClient, result() blocks until it arrived"""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._response = None
+        self._error = None
+
+    def set_response(self, response):
+        self._response = response
+        self._done.set()
+
+    def set_error(self, error):
+        self._error = error
+        self._done.set()
+
+    def result(self):
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._response
+
+
+class _RetryOnNewConnection(Exception):
+    pass
+
+
+class _HttpExchange(object):
+    """one HTTP/1.1 request and response on a non-blocking socket. The event loop calls advance() whenever
+       the socket is ready for what the exchange waits for, advance() proceeds as far as possible without
+       blocking and returns True once the response is complete
+    """
+
+    def __init__(self, method, url, headers, body, pending):
+        url_parts = urlparse.urlsplit(url)
+        port = url_parts.port or _ConnectionPool.default_ports[url_parts.scheme]
+        self.key = (url_parts.scheme, url_parts.hostname, port)
+        self.method = method
+        self.pending = pending
+        self.connection = None
+        self.deadline = None
+        self.wait_for = 'write'
+
+        host = url_parts.hostname if port == _ConnectionPool.default_ports[url_parts.scheme] \
+            else '%s:%d' % (url_parts.hostname, port)
+        request_lines = ['%s %s HTTP/1.1' % (method, urlparse.urlunsplit(('', '', url_parts.path or '/',
+                                                                         url_parts.query, ''))),
+                         'Host: %s' % host,
+                         'Accept-Encoding: identity']
+        request_lines.extend('%s: %s' % (name, value) for name, value in sorted(headers.items()))
+        if body is not None or method in ('POST', 'PUT'):
+            request_lines.append('Content-Length: %d' % len(body or ''))
+        self.request_data = str('\r\n'.join(request_lines) + '\r\n\r\n' + (body or ''))
+        self.sent = 0
+        self.response_data = ''
+        self.response = None
+
+    def attach(self, connection, timeout):
+        self.connection = connection
+        self.sent = 0
+        self.response_data = ''
+        self.deadline = time.time() + timeout
+        self.wait_for = 'write'
+
+    def advance(self):
+        connection = self.connection
+        try:
+            while True:
+                if connection.state == 'connecting':
+                    error = connection.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    if error:
+                        raise socket.error(error, os.strerror(error))
+                    if connection.tls:
+                        connection.start_tls()
+                    else:
+                        connection.set_open()
+                elif connection.state == 'handshake':
+                    connection.sock.do_handshake()
+                    connection.set_open()
+                elif self.sent < len(self.request_data):
+                    self.sent += connection.sock.send(self.request_data[self.sent:])
+                else:
+                    return self._receive()
+        except ssl.SSLWantReadError:
+            self.wait_for = 'read'
+        except ssl.SSLWantWriteError:
+            self.wait_for = 'write'
+        except socket.error as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+            self.wait_for = 'write' if self.sent < len(self.request_data) else 'read'
+        return False
+
+    def _receive(self):
+        self.wait_for = 'read'
+        while True:
+            data = self.connection.sock.recv(65536)
+            if not data:
+                if not self.response_data and self.connection.reused:
+                    raise _RetryOnNewConnection()
+                self.response = self._parse_response(True)
+                if self.response is None:
+                    raise httplib.IncompleteRead(self.response_data)
+                return True
+            self.response_data += data
+            self.response = self._parse_response(False)
+            if self.response is not None:
+                return True
+
+    def _parse_response(self, eof):
+        """returns status, reason, headers, body and whether the connection can be kept,
+           or None if the response is incomplete
+        """
+        header_end = self.response_data.find('\r\n\r\n')
+        if header_end < 0:
+            return None
+        header_lines = self.response_data[:header_end].split('\r\n')
+        version, status, reason = (header_lines[0].split(' ', 2) + [''])[:3]
+        headers = {}
+        for line in header_lines[1:]:
+            name, value = line.split(':', 1)
+            name = name.strip().lower()
+            headers[name] = ', '.join((headers[name], value.strip())) if name in headers else value.strip()
+
+        body = self.response_data[header_end + 4:]
+        keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+        if self.method == 'HEAD' or status in ('204', '304') or status.startswith('1'):
+            body = ''
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = self._decode_chunked(body)
+            if body is None:
+                return None
+        elif 'content-length' in headers:
+            if len(body) < int(headers['content-length']):
+                return None
+            body = body[:int(headers['content-length'])]
+        elif not eof:
+            return None
+        else:
+            keep_alive = False
+        return int(status), reason, headers, body, keep_alive
+
+    @staticmethod
+    def _decode_chunked(data):
+        chunks = []
+        position = 0
+        while True:
+            line_end = data.find('\r\n', position)
+            if line_end < 0:
+                return None
+            chunk_size = int(data[position:line_end].split(';')[0], 16)
+            if chunk_size == 0:
+                # the last chunk is followed by optional trailers and an empty line
+                return ''.join(chunks) if data.find('\r\n\r\n', line_end) >= 0 else None
+            if len(data) < line_end + 2 + chunk_size + 2:
+                return None
+            chunks.append(data[line_end + 2:line_end + 2 + chunk_size])
+            position = line_end + 2 + chunk_size + 2
+
+
+class _LoopConnection(object):
+    """a non-blocking connection of the _EventLoopClient, kept for reuse while the server allows it"""
+
+    def __init__(self, key, ssl_context):
+        self.key = key
+        self.tls = key[0] == 'https'
+        self.reused = False
+        self._ssl_context = ssl_context
+        family, socktype, proto, canonname, address = socket.getaddrinfo(key[1], key[2], 0, socket.SOCK_STREAM)[0]
+        self.sock = socket.socket(family, socktype, proto)
+        self.sock.setblocking(False)
+        error = self.sock.connect_ex(address)
+        if error not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            self.sock.close()
+            raise socket.error(error, os.strerror(error))
+        self.state = 'connecting'
+
+    def start_tls(self):
+        self.sock = self._ssl_context.wrap_socket(self.sock, server_hostname=self.key[1],
+                                                  do_handshake_on_connect=False)
+        self.state = 'handshake'
+
+    def set_open(self):
+        self.state = 'open'
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.sock.close()
+
+
+class _EventLoopClient(object):
+    """sends requests from any number of threads on one event loop thread. Up to max_in_flight requests
+       are on the wire at the same time, further requests wait in a queue. Idle connections are kept per
+       scheme, host and port like in _ConnectionPool.
+    """
+
+    def __init__(self, max_in_flight=default_max_in_flight, timeout=request_timeout):
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self._queue = collections.deque()
+        self._active = {}
+        self._idle_connections = {}
+        self._lock = threading.Lock()
+        self._wakeup_reader, self._wakeup_writer = os.pipe()
+        self._thread = None
+        self._closed = False
+        self._ssl_context = ssl.create_default_context()
+
+    @staticmethod
+    def available():
+        return hasattr(select, 'poll') and hasattr(ssl, 'SSLWantReadError') and hasattr(ssl, 'create_default_context')
+
+    def accepts(self, url):
+        scheme = urlparse.urlsplit(url).scheme
+        return scheme in _ConnectionPool.default_ports and scheme not in urllib.getproxies()
+
+    def submit(self, method, url, headers, body=None):
+        pending = _PendingResponse()
+        with self._lock:
+            if self._closed:
+                raise GitlabModuleInternalException('the event loop client is closed')
+            self._queue.append(_HttpExchange(method, url, headers, body, pending))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+        os.write(self._wakeup_writer, 'x')
+        return pending
+
+    def request(self, method, url, headers, body=None):
+        """same contract as _ConnectionPool.request"""
+        return self.submit(method, url, headers, body).result()
+
+    def request_all(self, requests):
+        """puts all requests on the wire at once and returns their responses in order"""
+        return [pending.result() for pending in [self.submit(*request) for request in requests]]
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+        os.write(self._wakeup_writer, 'x')
+        if thread is not None:
+            thread.join()
+        for connections in self._idle_connections.values():
+            for connection in connections:
+                connection.close()
+        self._idle_connections = {}
+        os.close(self._wakeup_reader)
+        os.close(self._wakeup_writer)
+
+    def _run(self):
+        poller = select.poll()
+        poller.register(self._wakeup_reader, select.POLLIN)
+        registered = {}
+        while True:
+            with self._lock:
+                if self._closed:
+                    break
+                while self._queue and len(self._active) < self.max_in_flight:
+                    self._start(self._queue.popleft())
+
+            for fileno, exchange in self._active.items():
+                event_mask = select.POLLIN if exchange.wait_for == 'read' else select.POLLOUT
+                if registered.get(fileno) != event_mask:
+                    poller.register(fileno, event_mask)
+                    registered[fileno] = event_mask
+
+            for fileno, event in poller.poll(1000):
+                if fileno == self._wakeup_reader:
+                    os.read(self._wakeup_reader, 4096)
+                elif fileno in self._active:
+                    self._advance(self._active[fileno])
+
+            now = time.time()
+            for exchange in [exchange for exchange in self._active.values() if exchange.deadline < now]:
+                self._finish(exchange, error=GitlabModuleInternalException('timed out'))
+
+            for fileno in [fileno for fileno in registered if fileno not in self._active]:
+                poller.unregister(fileno)
+                del registered[fileno]
+
+        for exchange in list(self._active.values()) + list(self._queue):
+            if exchange.connection is not None:
+                exchange.connection.close()
+            exchange.pending.set_error(GitlabModuleInternalException('the event loop client is closed'))
+
+    def _start(self, exchange, reuse=True):
+        idle_connections = self._idle_connections.get(exchange.key)
+        try:
+            if reuse and idle_connections:
+                connection = idle_connections.pop()
+                connection.reused = True
+            else:
+                connection = _LoopConnection(exchange.key, self._ssl_context)
+        except socket.error as e:
+            exchange.pending.set_error(GitlabModuleInternalException(str(e)))
+            return
+        exchange.attach(connection, self.timeout)
+        self._active[connection.fileno()] = exchange
+        if connection.reused:
+            self._advance(exchange)
+
+    def _advance(self, exchange):
+        try:
+            if exchange.advance():
+                self._finish(exchange)
+        except _RetryOnNewConnection:
+            # the server closed the idle connection in the meantime, the request never reached it
+            self._active.pop(exchange.connection.fileno(), None)
+            exchange.connection.close()
+            self._start(exchange, reuse=False)
+        except (httplib.HTTPException, socket.error, ValueError) as e:
+            self._finish(exchange, error=GitlabModuleInternalException(str(e) or e.__class__.__name__))
+
+    def _finish(self, exchange, error=None):
+        connection = exchange.connection
+        self._active.pop(connection.fileno(), None)
+        if error is not None:
+            connection.close()
+            exchange.pending.set_error(error)
+            return
+
+        status, reason, headers, body, keep_alive = exchange.response
+        if keep_alive:
+            connection.reused = False
+            self._idle_connections.setdefault(exchange.key, []).append(connection)
+        else:
+            connection.close()
+
+        if 300 <= status < 400 and status != not_modified_status:
+            exchange.pending.set_response(None)
+        elif status >= 400:
+            exchange.pending.set_error(GitlabHttpError(status, reason, headers, body))
+        else:
+            headers['status'] = '%d %s' % (status, reason)
+            exchange.pending.set_response((headers, body))
+
+
+class _RateLimiter(object):
+    """token bucket all requests of a module run pass. It starts with 'rate' requests per second (unlimited
+       if None) and adapts to the RateLimit-Remaining and RateLimit-Reset headers of the responses, so
+       requests are spread over the rest of the server's rate limit window instead of exhausting it.
+       A 429 response pauses all requests for the time given in its Retry-After header.
+    """
+
+    def __init__(self, rate=None):
+        self.configured_rate = rate
+        self.rate = rate
+        self.tokens = rate or 1.0
+        self.updated = time.time()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.time()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.rate is None:
+                    return
+                else:
+                    self.tokens = min(max(self.rate, 1.0), self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def observe(self, headers):
+        remaining = _get_header(headers, 'RateLimit-Remaining')
+        reset = _get_header(headers, 'RateLimit-Reset')
+        if remaining is None or reset is None:
+            return
+        try:
+            remaining, reset = int(remaining), float(reset)
+        except ValueError:
+            return
+
+        with self._lock:
+            now = time.time()
+            # Gitlab sends the end of the window as unix timestamp, other servers the seconds until then
+            seconds_to_reset = max(reset - now if reset > 1000000000 else reset, 1.0)
+            server_rate = remaining / seconds_to_reset
+            self.rate = server_rate if self.configured_rate is None else min(self.configured_rate, server_rate)
+            if self.rate <= 0:
+                self.paused_until = max(self.paused_until, now + seconds_to_reset)
+                self.rate = 1 / seconds_to_reset
+            self.tokens = min(self.tokens, remaining)
+            self.updated = now
+
+    def pause(self, seconds):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.time() + seconds)
+
+
+def _retry_after_seconds(headers, attempt):
+    """the seconds given in the Retry-After header, as number or HTTP date, doubling from one second without it"""
+    retry_after = _get_header(headers, 'Retry-After')
+    if retry_after:
+        if retry_after.strip().isdigit():
+            return int(retry_after)
+        retry_date = email.utils.parsedate_tz(retry_after)
+        if retry_date:
+            return max(email.utils.mktime_tz(retry_date) - time.time(), 0)
+    return min(2 ** attempt, 60)
+
+
+class _RetryPolicy(object):
+    """when and how long to wait before sending a request again that failed with a transient error,
+       i.e. a connection error or one of the retryable_statuses
+    """
+
+    def __init__(self, retries=3, backoff=0.5, jitter=1.0, deadline=60.0, max_backoff=30.0):
+        self.retries = retries
+        self.backoff = backoff
+        self.jitter = jitter
+        self.deadline = deadline
+        self.max_backoff = max_backoff
+
+    @staticmethod
+    def is_transient(error):
+        return not isinstance(error, GitlabHttpError) or error.status in retryable_statuses
+
+    def delay(self, attempt):
+        """exponential backoff, of which the 'jitter' fraction is random so concurrent retries spread out"""
+        delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+        return delay * (1 - self.jitter * random.random())
+
+    def should_retry(self, error, attempt, started, delay):
+        """whether to send the request again after waiting delay seconds, which must end before the deadline"""
+        return self.is_transient(error) and attempt < self.retries \
+            and time.time() + delay - started < self.deadline
+
+
+_connection_pool = None
+_event_loop_client = None
+_rate_limiter = None
+_retry_policy = None
+
+
+def _enable_connection_pool():
+    global _connection_pool
+    _connection_pool = _ConnectionPool()
+
+
+def _enable_event_loop_client(max_in_flight=default_max_in_flight):
+    """returns False if the event loop client is not available on this system, the connection pool
+       and open_url are used then
+    """
+    global _event_loop_client
+    if not _EventLoopClient.available():
+        return False
+    _event_loop_client = _EventLoopClient(max_in_flight)
+    return True
+
+
+def _enable_rate_limiter(rate=None):
+    global _rate_limiter
+    _rate_limiter = _RateLimiter(rate)
+
+
+def _enable_retries(retries, backoff, jitter, deadline):
+    global _retry_policy
+    _retry_policy = _RetryPolicy(retries, backoff, jitter, deadline)
+
+
+def _close_connection_pool():
+    global _connection_pool, _event_loop_client
+    if _connection_pool is not None:
+        _connection_pool.close()
+    if _event_loop_client is not None:
+        _event_loop_client.close()
+    _connection_pool = None
+    _event_loop_client = None
+
+
+class _BrokerCache(object):
+    """GET responses of the user, email and key listings, kept by the broker for max_age seconds. Every
+       request that changes something drops the cached listings its URL belongs to
+    """
+
+    listing = re.compile(r'/users(/\d+/(keys|emails))?$')
+
+    def __init__(self, max_age):
+        self.max_age = max_age
+        self._responses = {}
+        self._lock = threading.Lock()
+
+    def accepts(self, url, headers):
+        """conditional requests are left to the module's own user cache"""
+        return self.max_age > 0 and \
+            not any(name.lower() in ('if-none-match', 'if-modified-since') for name in headers) and \
+            self.listing.search(urlparse.urlsplit(url).path.rstrip('/')) is not None
+
+    @staticmethod
+    def _key(url, headers):
+        return url, _get_header(headers, 'PRIVATE-TOKEN')
+
+    def get(self, url, headers):
+        with self._lock:
+            cached = self._responses.get(self._key(url, headers))
+        if cached is None or time.time() - cached[0] >= self.max_age:
+            return None
+        return cached[1]
+
+    def store(self, url, headers, response):
+        with self._lock:
+            self._responses[self._key(url, headers)] = (time.time(), response)
+
+    def invalidate(self, url):
+        path = urlparse.urlsplit(url).path.rstrip('/')
+        with self._lock:
+            for key in list(self._responses):
+                cached_path = urlparse.urlsplit(key[0]).path.rstrip('/')
+                if path == cached_path or path.startswith(cached_path + '/'):
+                    del self._responses[key]
+
+
+def _encode_broker_response(headers, body):
+    return {'headers': dict(headers.items()), 'body': base64.b64encode(body)}
+
+
+class _BrokerServer(object):
+    """serves the requests of module runs on a Unix socket with the broker process's connection pool,
+       rate limiter and listing cache. Every connection is served by a thread of its own, requests and
+       responses are JSON lines. The server stops once no module was connected for idle_timeout seconds
+    """
+
+    poll_interval = 0.5
+
+    def __init__(self, socket_path, idle_timeout=default_broker_idle_timeout,
+                 cache_max_age=default_user_cache_max_age):
+        self.socket_path = socket_path
+        self.idle_timeout = idle_timeout
+        self.cache = _BrokerCache(cache_max_age)
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(socket_path)
+        os.chmod(socket_path, 0o600)
+        self._socket_inode = os.stat(socket_path).st_ino
+        self._listener.listen(128)
+        self._connections = 0
+        self._last_active = time.time()
+        self._lock = threading.Lock()
+
+    def serve(self):
+        try:
+            while True:
+                readable, writable, failed = select.select([self._listener], [], [], self.poll_interval)
+                if readable:
+                    connection, address = self._listener.accept()
+                    with self._lock:
+                        self._connections += 1
+                    connection_thread = threading.Thread(target=self._serve_connection, args=(connection,))
+                    connection_thread.daemon = True
+                    connection_thread.start()
+                    continue
+                with self._lock:
+                    if self._connections == 0 and time.time() - self._last_active >= self.idle_timeout:
+                        return
+        finally:
+            self._listener.close()
+            try:
+                if os.stat(self.socket_path).st_ino == self._socket_inode:
+                    os.remove(self.socket_path)
+            except OSError:
+                pass
+
+    def _serve_connection(self, connection):
+        reader = connection.makefile('rb')
+        try:
+            for line in iter(reader.readline, ''):
+                connection.sendall(json.dumps(self.handle(json.loads(line))) + '\n')
+        except socket.error:
+            pass
+        finally:
+            reader.close()
+            connection.close()
+            with self._lock:
+                self._connections -= 1
+                self._last_active = time.time()
+
+    def handle(self, request):
+        method, url, headers = request['method'], request['url'], request['headers']
+        body = base64.b64decode(request['body']) if request.get('body') is not None else None
+        cacheable = method == 'GET' and self.cache.accepts(url, headers)
+        if cacheable:
+            cached_response = self.cache.get(url, headers)
+            if cached_response is not None:
+                return cached_response
+        elif method != 'GET':
+            self.cache.invalidate(url)
+
+        try:
+            response = _encode_broker_response(*_send_rate_limited_request_directly(method, url, headers, body))
+        except GitlabHttpError as e:
+            return dict(_encode_broker_response(e.headers, e.body), error_status=e.status, reason=e.reason)
+        except GitlabModuleInternalException as e:
+            return {'error': e.message}
+        except Exception as e:  # the module run gets the error, the broker keeps serving
+            return {'error': str(e) or e.__class__.__name__}
+        finally:
+            if method != 'GET':
+                self.cache.invalidate(url)
+
+        if cacheable:
+            self.cache.store(url, headers, response)
+        return response
+
+
+def _run_broker(socket_path, params):
+    """the body of the detached broker process. It drops the state of the module run it was forked
+       from and keeps a connection pool and rate limiter of its own
+    """
+    global _broker_client, _retry_policy, _password_store, _user_cache, _event_loop_client
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for file_descriptor in (0, 1, 2):
+        os.dup2(devnull, file_descriptor)
+    os.closerange(3, os.sysconf('SC_OPEN_MAX'))  # e.g. the lock file and the connections of the module run
+    _broker_client = _retry_policy = _password_store = _user_cache = _event_loop_client = None
+    _enable_connection_pool()
+    _enable_rate_limiter(params.get('rate_limit'))
+    try:
+        server = _BrokerServer(socket_path, params['broker_idle_timeout'], params['user_cache_max_age'])
+    except socket.error:
+        return  # another broker was started at the same time
+    server.serve()
+
+
+class _BrokerClient(object):
+    """sends requests to the broker process on socket_path, with one connection per thread. The broker
+       is started if nobody answers on the socket
+    """
+
+    def __init__(self, socket_path, params):
+        self.socket_path = os.path.expanduser(socket_path)
+        self.params = params
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def accepts(self, url):
+        return True
+
+    def _connect(self):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            connection.connect(self.socket_path)
+        except socket.error:
+            connection.close()
+            raise
+        return connection
+
+    def _start_broker(self):
+        socket_dir = os.path.dirname(os.path.abspath(self.socket_path))
+        if not os.path.isdir(socket_dir):
+            os.makedirs(socket_dir, 0o700)
+        with open(self.socket_path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                return self._connect()  # started by another module run meanwhile
+            except socket.error:
+                pass
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)  # left behind by a broker that died
+
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    os.setsid()
+                    if os.fork() == 0:
+                        _run_broker(self.socket_path, self.params)
+                finally:
+                    os._exit(0)
+            os.waitpid(pid, 0)
+
+            started = time.time()
+            while True:
+                try:
+                    return self._connect()
+                except socket.error:
+                    if time.time() - started > broker_start_timeout:
+                        raise GitlabModuleInternalException('the broker on %s did not start' % self.socket_path)
+                    time.sleep(0.05)
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            try:
+                connection = self._connect()
+            except socket.error:
+                connection = self._start_broker()
+            self._local.connection = connection
+            self._local.reader = connection.makefile('rb')
+            with self._lock:
+                self._connections.append((connection, self._local.reader))
+        return connection
+
+    def request(self, method, url, headers, body=None):
+        request = json.dumps({
+            'method': method,
+            'url': url,
+            'headers': headers,
+            'body': base64.b64encode(body) if body is not None else None
+        }) + '\n'
+        try:
+            self._connection().sendall(request)
+            line = self._local.reader.readline()
+        except socket.error as e:
+            line = None
+            error = str(e)
+        if not line:
+            self._local.connection = None
+            self._local.reader.close()
+            raise GitlabModuleInternalException(error if line is None else 'the broker closed the connection')
+
+        response = json.loads(line)
+        if 'error' in response:
+            raise GitlabModuleInternalException(response['error'])
+        headers, body = response['headers'], base64.b64decode(response['body'])
+        if 'error_status' in response:
+            raise GitlabHttpError(response['error_status'], response['reason'], headers, body)
+        return headers, body
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection, reader in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)  # the reader holds a reference to the socket, too
+            except socket.error:
+                pass
+            reader.close()
+            connection.close()
+        self._local = threading.local()
+
+
+_broker_client = None
+
+
+def _enable_broker(socket_path, params):
+    global _broker_client
+    _broker_client = _BrokerClient(socket_path, params) if socket_path else None
+
+
+def _close_broker():
+    global _broker_client
+    if _broker_client is not None:
+        _broker_client.close()
+    _broker_client = None
+
+
+def _perform_request(method, url, headers, body=None):
     try:
+        for transport in (_event_loop_client, _connection_pool):
+            if transport is not None and transport.accepts(url):
+                response = transport.request(method, url, headers, body)
+                if response is not None:
+                    return response
+                break
+
         response_reader = urls.open_url(
             url,
             method=method,
@@ -165,52 +1364,388 @@ def _send_request(method, url, headers, body=None):
         response_reader.close()
         return response_headers, response_body
 
+    except (httplib.HTTPException, socket.error) as e:
+        raise GitlabModuleInternalException(str(e))
+    except urllib2.HTTPError as e:
+        if e.code == not_modified_status:
+            response_headers = dict(e.headers.items())
+            response_headers['status'] = '%d %s' % (e.code, e.reason)
+            return response_headers, e.read()
+        raise GitlabHttpError(e.code, e.reason, e.headers, e.read())
     except urllib2.URLError as e:
         if 'message' in dir(e.reason):
             raise GitlabModuleInternalException(e.reason.message)
         raise GitlabModuleInternalException('\n'.join([e.reason, e.read()]))
 
 
-def _get_email_id(api_url, private_token, user_id, email):
-    headers, body = _send_request('GET', '%s/users/%d/emails' % (api_url, user_id), {'PRIVATE-TOKEN': private_token})
+def _send_rate_limited_request(method, url, headers, body=None):
+    """sends the request through the broker if there is one, otherwise from this process"""
+    if _broker_client is not None:
+        return _broker_client.request(method, url, headers, body)
+    return _send_rate_limited_request_directly(method, url, headers, body)
 
-    if headers['status'] == '200 OK':
-        for tmp_email in json.loads(body):
-            if tmp_email['email'] == email.lower():  # gitlab converts email addresses to lower case
-                return tmp_email['id']
+
+def _send_rate_limited_request_directly(method, url, headers, body=None):
+    """sends the request when the rate limiter allows it. Requests rejected with 429 Too Many Requests
+       never reached Gitlab, they are sent again once Retry-After passed
+    """
+    attempt = 0
+    while True:
+        if _rate_limiter is not None:
+            _rate_limiter.acquire()
+        try:
+            response_headers, response_body = _perform_request(method, url, headers, body)
+        except GitlabHttpError as e:
+            if _rate_limiter is None:
+                raise
+            _rate_limiter.observe(e.headers)
+            attempt += 1
+            if e.status != 429 or attempt >= max_rate_limited_attempts:
+                raise
+            _rate_limiter.pause(_retry_after_seconds(e.headers, attempt))
+            continue
+
+        if _rate_limiter is not None:
+            _rate_limiter.observe(response_headers)
+        return response_headers, response_body
+
+
+def _send_request(method, url, headers, body=None, created_check=None):
+    """sends the request and, with retries enabled, sends it again after transient errors. GET, PUT and
+       DELETE requests are idempotent and always sent again. A failed POST may still have created its
+       resource, it is only sent again if created_check is given and returns None. If created_check
+       returns the resource instead, it is returned as the response of the POST.
+    """
+    started = time.time()
+    attempt = 0
+    while True:
+        try:
+            return _send_rate_limited_request(method, url, headers, body)
+        except GitlabModuleInternalException as e:
+            if method == 'DELETE' and attempt > 0 and isinstance(e, GitlabHttpError) and e.status == 404:
+                # a previous attempt deleted the resource without its response arriving
+                return {'status': '200 OK'}, ''
+            if _retry_policy is None or method == 'POST' and created_check is None:
+                raise
+            delay = _retry_policy.delay(attempt)
+            if not _retry_policy.should_retry(e, attempt, started, delay):
+                raise
+            time.sleep(delay)
+            attempt += 1
+
+            if method == 'POST':
+                with _reading_back():
+                    created_resource = created_check()
+                if created_resource:
+                    return {'status': '201 Created'}, json.dumps(created_resource)
+
+
+def _send_requests(requests, max_workers=default_max_workers):
+    """sends independent requests concurrently and returns their responses in order. With the event loop
+       client all of them are put on the wire at once, otherwise max_workers threads send them one by one
+    """
+    return list(_iterate_responses(requests, max_workers))
+
+
+def _iterate_responses(requests, max_workers=default_max_workers):
+    """sends independent requests concurrently like _send_requests, but yields every response in order as
+       soon as it has arrived, so callers can process a response while the later ones are still pending
+    """
+    if _event_loop_client is not None and all(_event_loop_client.accepts(request[1]) for request in requests):
+        pending_responses = []
+        for request in requests:
+            if _rate_limiter is not None:
+                _rate_limiter.acquire()
+            pending_responses.append(_event_loop_client.submit(*request))
+
+        for request, pending_response in zip(requests, pending_responses):
+            try:
+                response = pending_response.result()
+            except GitlabHttpError as e:
+                if _rate_limiter is not None and e.status == 429:
+                    _rate_limiter.pause(_retry_after_seconds(e.headers, 1))
+                elif _retry_policy is None or request[0] == 'POST' or not _retry_policy.is_transient(e):
+                    raise
+                response = None
+            except GitlabModuleInternalException:
+                if _retry_policy is None or request[0] == 'POST':
+                    raise
+                response = None
+            if response is None:
+                yield _send_request(*request)
+                continue
+            if _rate_limiter is not None:
+                _rate_limiter.observe(response[0])
+            yield response
+        return
+
+    if len(requests) < 2:
+        for request in requests:
+            yield _send_request(*request)
+        return
+
+    pool = multiprocessing.pool.ThreadPool(min(max_workers, len(requests)))
+    try:
+        for response in pool.imap(lambda request: _send_request(*request), requests):
+            yield response
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _map_concurrently(function, items, max_workers=default_max_workers):
+    """calls function for every item on up to max_workers threads and returns the results in order"""
+    if len(items) < 2:
+        return [function(item) for item in items]
+
+    pool = multiprocessing.pool.ThreadPool(min(max_workers, len(items)))
+    try:
+        return pool.map(function, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _get_header(headers, name):
+    """urllib2 response headers are case insensitive, the plain dicts used instead of them are not"""
+    for key in (name, name.lower()):
+        if key in headers:
+            return headers[key]
+    return None
+
+
+def _set_query_params(url, params):
+    scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+    query_params = [(key, params.get(key, value)) for key, value in urlparse.parse_qsl(query)]
+    present_keys = set(key for key, value in query_params)
+    query_params.extend(sorted((key, value) for key, value in params.items() if key not in present_keys))
+    return urlparse.urlunsplit((scheme, netloc, path, urllib.urlencode(query_params), fragment))
+
+
+def _next_page_url(url, headers):
+    next_page = _get_header(headers, 'X-Next-Page')
+    if next_page:
+        return _set_query_params(url, {'page': next_page})
+
+    link = _get_header(headers, 'Link')
+    if link:
+        for link_part in link.split(','):
+            match = re.match(r'\s*<([^>]+)>\s*;.*\brel="next"', link_part)
+            if match:
+                return match.group(1)
+
+    return None
+
+
+_read_back = threading.local()
+
+
+@contextlib.contextmanager
+def _reading_back():
+    """listings read inside check whether a failed POST created its resource. Fresh pages of the user
+       cache may predate the POST, they are revalidated instead of used as they are
+    """
+    _read_back.active = True
+    try:
+        yield
+    finally:
+        _read_back.active = False
+
+
+@contextlib.contextmanager
+def _listing_lock(url):
+    """with the user cache enabled, only one process at a time fetches a listing"""
+    if _user_cache is None or not _user_cache.accepts(url):
+        yield
+    else:
+        with _user_cache.lock(url):
+            yield
+
+
+def _send_listing_request(url, private_token):
+    """GETs one page of a listing. With the user cache enabled, a fresh cached page is used as it is, an
+       older one is revalidated and a 304 Not Modified response is answered from the cache
+    """
+    with _listing_lock(url):
+        if _user_cache is not None and _user_cache.accepts(url) and not getattr(_read_back, 'active', False):
+            cached_response = _user_cache.fresh_response(url)
+            if cached_response is not None:
+                return cached_response
+        headers, body = _send_request(
+            method='GET',
+            url=url,
+            headers=_conditional_headers(url, {'PRIVATE-TOKEN': private_token})
+        )
+        return _revalidated_response(url, headers, body)
+
+
+def _iterate_listing_responses(urls, private_token, max_workers=default_max_workers):
+    """GETs pages of listings concurrently, like _send_listing_request does for one page. The responses are
+       yielded in order as they arrive
+    """
+    cached_responses = [
+        _user_cache.fresh_response(url) if _user_cache is not None and _user_cache.accepts(url) else None
+        for url in urls
+    ]
+    page_requests = [('GET', url, _conditional_headers(url, {'PRIVATE-TOKEN': private_token}))
+                     for url, cached_response in zip(urls, cached_responses) if cached_response is None]
+    responses = _iterate_responses(page_requests, max_workers)
+    for url, cached_response in zip(urls, cached_responses):
+        if cached_response is not None:
+            yield cached_response
+        else:
+            headers, body = next(responses)
+            yield _revalidated_response(url, headers, body)
+
+
+def _conditional_headers(url, headers):
+    if _user_cache is None or not _user_cache.accepts(url):
+        return headers
+    return dict(headers, **_user_cache.validators(url))
+
+
+def _revalidated_response(url, headers, body):
+    if _user_cache is None or not _user_cache.accepts(url):
+        return headers, body
+    if headers['status'].startswith('%d ' % not_modified_status):
+        cached_response = _user_cache.revalidated_response(url)
+        if cached_response is not None:
+            return cached_response
+    elif headers['status'] == '200 OK':
+        _user_cache.store_page(url, headers, json.loads(body))
+    return headers, body
+
+
+def _iterate_pages(url, private_token):
+    """yields the records of a paginated listing. The next page is only requested once the records of the
+       current page are consumed, so callers that stop iterating early don't request the remaining pages
+    """
+    url = _set_query_params(url, {'per_page': items_per_page})
+    while url:
+        headers, body = _send_listing_request(url, private_token)
+        if headers['status'] != '200 OK':
+            return
+
+        for record in json.loads(body):
+            yield record
+
+        url = _next_page_url(url, headers)
+
+
+def _parse_page(headers, body):
+    if headers['status'] != '200 OK':
+        raise GitlabModuleInternalException('\n'.join((headers['status'], body)))
+    return headers, json.loads(body)
+
+
+def _fetch_page(url, private_token):
+    return _parse_page(*_send_listing_request(url, private_token))
+
+
+def _sweep_pages(url, private_token, max_workers=default_max_workers, record=None):
+    """fetches every page of a listing and returns all records in id order. The first response tells the number
+       of pages in X-Total-Pages, the remaining pages are then fetched concurrently and converted as they arrive.
+       Gitlab omits X-Total-Pages for very large listings, those are walked page by page instead.
+       If record is given, the records of every page are converted by it as soon as the page is parsed.
+       The listing should be in ascending id order, so records created while the pages are fetched only
+       show up on the last pages. A record that still shows up on two pages is returned once
+    """
+    def convert(page_records):
+        return page_records if record is None else [record(page_record) for page_record in page_records]
+
+    url = _set_query_params(url, {'per_page': items_per_page})
+    with _listing_lock(url):  # the first page's lock stands for the whole listing
+        headers, page_records = _fetch_page(url, private_token)
+        records = convert(page_records)
+
+        total_pages = _get_header(headers, 'X-Total-Pages')
+        if total_pages:
+            page_urls = [_set_query_params(url, {'page': page}) for page in range(2, int(total_pages) + 1)]
+            for page_response in _iterate_listing_responses(page_urls, private_token, max_workers):
+                records.extend(convert(_parse_page(*page_response)[1]))
+        else:
+            next_url = _next_page_url(url, headers)
+            while next_url:
+                headers, page_records = _fetch_page(next_url, private_token)
+                records.extend(convert(page_records))
+                next_url = _next_page_url(next_url, headers)
+
+    records.sort(key=lambda listed: listed['id'])
+    unique_records = []
+    for listed in records:
+        if unique_records and unique_records[-1]['id'] == listed['id']:
+            unique_records[-1] = listed  # the later page was fetched last
+        else:
+            unique_records.append(listed)
+    return unique_records
+
+
+def _list_all_users(api_url, private_token, max_workers=default_max_workers, record=None):
+    url = _set_query_params('%s/users' % api_url, {'order_by': 'id', 'sort': 'asc'})
+    return _sweep_pages(url, private_token, max_workers, record=record)
+
+
+def _find_email(api_url, private_token, user_id, email):
+    for tmp_email in _iterate_pages('%s/users/%d/emails' % (api_url, user_id), private_token):
+        if tmp_email['email'] == email.lower():  # gitlab converts email addresses to lower case
+            return tmp_email
 
     return None
 
 
 def _find_user_by_name(api_url, private_token, username):
-    headers, body = _send_request(
-        url=api_url + '/users',
-        method='GET',
-        headers={'PRIVATE-TOKEN': private_token}
-    )
+    """look the user up with the server side 'username' filter, so a lookup costs one small response
+       regardless of the number of accounts. Servers that don't know the filter ignore it and answer
+       with the unfiltered user list, in that case the lookup is repeated with 'search'
+    """
+    headers, body = _send_listing_request('%s/users?%s' % (api_url, urllib.urlencode({'username': username})),
+                                          private_token)
+
+    if headers['status'] != '200 OK':
+        return None
+
+    content = json.loads(body)
+    for user in content:
+        if user['username'] == username:
+            return user
+
+    if all(user['username'].lower() == username.lower() for user in content):
+        # the filter was applied by the server, the user does not exist
+        return None
 
-    if headers['status'] == '200 OK':
-        content = json.loads(body)
-        for user in content:
-            if user['username'] == username:
-                return user
+    for user in _iterate_pages('%s/users?%s' % (api_url, urllib.urlencode({'search': username})), private_token):
+        if user['username'] == username:
+            return user
 
     return None
 
 
-def _get_ssh_key_for_user(api_url, private_token, user_id, ssh_key_title):
-    response_headers, response_body = _send_request(
-        'GET',
-        '%s/users/%d/keys' % (api_url, user_id),
-        {'PRIVATE-TOKEN': private_token}
-    )
+def _ssh_key_fingerprint(ssh_key):
+    """identifies a public key by its type and the md5 fingerprint of its decoded blob, as in
+       ssh-keygen -l -E md5. Comments and whitespace around the key do not change the fingerprint
+    """
+    fields = ssh_key.split()
+    if len(fields) < 2:
+        return ' '.join(fields)
+    try:
+        blob = base64.b64decode(fields[1])
+    except (TypeError, binascii.Error):
+        return ' '.join(fields[:2])
+    digest = hashlib.md5(blob).hexdigest()
+    return '%s %s' % (fields[0], ':'.join(digest[i:i + 2] for i in range(0, len(digest), 2)))
+
 
-    if response_headers['status'] == '200 OK':
-        available_keys = [key for key in json.loads(response_body) if key['title'] == ssh_key_title]
-        if len(available_keys) > 0:
-            return available_keys[0]
+def _key_record_fingerprint(ssh_key):
+    """directory snapshots keep the fingerprints of keys instead of the keys"""
+    return ssh_key.get('fingerprint') or _ssh_key_fingerprint(ssh_key['key'])
 
-    return {}
+
+def _find_ssh_key(api_url, private_token, user_id, fingerprint):
+    for key in _iterate_pages('%s/users/%d/keys' % (api_url, user_id), private_token):
+        if _ssh_key_fingerprint(key['key']) == fingerprint:
+            return key
+
+    return None
 
 
 def _add_non_standard_params(params, raw_data):
@@ -234,43 +1769,70 @@ def _check_required_input_params(raw_data, user):
     return True
 
 
-def _predict_user_change(raw_data, user):
+def _diff_user(raw_data, user):
+    """the request params of raw_data that differ from the fetched user. Everything is a change for new users"""
     if not user:
-        return True
+        return dict(raw_data)
+    changes = {}
     if 'admin' in raw_data and 'is_admin' in user and raw_data['admin'] != user['is_admin']:
-        return True
+        changes['admin'] = raw_data['admin']
     for param_name in allowed_user_params:
-        if param_name not in user and param_name in raw_data:
-            return True
-        if param_name in user and param_name in raw_data and user[param_name] != raw_data[param_name]:
-            return True
-    return False
-
-
-def _update_ssh_key(api_url, private_token, user_id, ssh_key_id, ssh_key_title, ssh_key):
-    if ssh_key_id:
-        _send_request(
-            'DELETE',
-            '%s/users/%d/keys/%d' % (api_url, user_id, ssh_key_id),
-            {'PRIVATE-TOKEN': private_token}
-        )
+        if param_name in raw_data and (param_name not in user or user[param_name] != raw_data[param_name]):
+            changes[param_name] = raw_data[param_name]
+    return changes
+
+
+def _predict_user_change(raw_data, user):
+    if not user:
+        return True
+    return bool(_diff_user(raw_data, user))
+
+
+def _describe_user_changes(changes, user):
+    """before and after of every changed field for the module result, passwords are masked"""
+    description = {}
+    for param_name, value in changes.items():
+        before = None
+        if user:
+            before = user.get('is_admin' if param_name == 'admin' else param_name)
+        if param_name == 'password':
+            value = '********'
+        description[param_name] = {'before': before, 'after': value}
+    return description
+
+
+def _delete_ssh_key(api_url, private_token, user_id, ssh_key_id):
+    ssh_response_headers, ssh_response_body = _send_request(
+        'DELETE',
+        '%s/users/%d/keys/%d' % (api_url, user_id, ssh_key_id),
+        {'PRIVATE-TOKEN': private_token}
+    )
+    if ssh_response_headers['status'] not in ('200 OK', '204 No Content'):
+        raise GitlabModuleInternalException('\n'.join((ssh_response_headers['status'], ssh_response_body)))
+
+
+def _add_ssh_key(api_url, private_token, user_id, ssh_key_title, ssh_key):
     ssh_response_headers, ssh_response_body = _send_request(
         'POST',
         '%s/users/%d/keys' % (api_url, user_id),
         {'PRIVATE-TOKEN': private_token, 'Content-Type': 'application/json'},
-        json.dumps({'id': user_id, 'title': ssh_key_title, 'key': ssh_key})
+        json.dumps({'id': user_id, 'title': ssh_key_title, 'key': ssh_key}),
+        created_check=lambda: _find_ssh_key(api_url, private_token, user_id, _ssh_key_fingerprint(ssh_key))
     )
     if ssh_response_headers['status'] != '201 Created':
         raise GitlabModuleInternalException('\n'.join((ssh_response_headers['status'], ssh_response_body)))
 
+    return json.loads(ssh_response_body) if ssh_response_body else {'title': ssh_key_title, 'key': ssh_key}
+
 
 def _update_user(api_url, private_token, user_id, user_request_input):
     if user_id:  # update user
         url = '%s/users/%d' % (api_url, user_id)
         method = 'PUT'
-        del user_request_input['username']  # usernames cannot change
-        del user_request_input['email']  # email update is handled separately in _update_email
-        # in fact, including email in user update requests has no effect, regardless of what the docs say
+        user_request_input.pop('username', None)  # usernames cannot change
+        if _api_version(api_url) < 4:
+            user_request_input.pop('email', None)  # email update is handled separately in _update_email
+            # in fact, including email in user update requests of API v3 has no effect, regardless of what the docs say
     else:  # create new user
         url = '%s/users' % api_url
         method = 'POST'
@@ -279,7 +1841,8 @@ def _update_user(api_url, private_token, user_id, user_request_input):
         method,
         url,
         {'PRIVATE-TOKEN': private_token, 'Content-Type': 'application/json'},
-        json.dumps(user_request_input)
+        json.dumps(user_request_input),
+        created_check=lambda: _find_user_by_name(api_url, private_token, user_request_input['username'])
     )
     if user_response_headers['status'] in ('201 Created', '200 OK'):
         return json.loads(user_response_body)
@@ -288,54 +1851,969 @@ def _update_user(api_url, private_token, user_id, user_request_input):
 
 
 def _update_email(api_url, private_token, user_id, email_id, email):
+    """adds the new email before the old one is deleted, so the user has an email at all times"""
+    create_response_header, create_response_body = _send_request(
+        'POST',
+        '%s/users/%d/emails' % (api_url, user_id),
+        {'PRIVATE-TOKEN': private_token, 'Content-Type': 'application/json'},
+        json.dumps({'id': user_id, 'email': email}),
+        created_check=lambda: _find_email(api_url, private_token, user_id, email)
+    )
+    if create_response_header['status'] != '201 Created':
+        raise GitlabModuleInternalException('\n'.join((create_response_header['status'], create_response_body)))
+
+    if email_id:
+        _delete_email(api_url, private_token, user_id, email_id)
+
+    return json.loads(create_response_body) if create_response_body else {'email': email.lower()}
+
+
+def _delete_email(api_url, private_token, user_id, email_id):
     delete_response_headers, delete_response_body = _send_request(
         'DELETE',
         '%s/users/%d/emails/%d' % (api_url, user_id, email_id),
         {'PRIVATE-TOKEN': private_token}
     )
-    if delete_response_headers['status'] != '200 OK':
-        raise GitlabModuleInternalException('\n'.join((delete_response_headers['status'], delete_response_body)))
+    if delete_response_headers['status'] not in ('200 OK', '204 No Content'):
+        raise GitlabModuleInternalException(
+            '\n'.join((delete_response_headers['status'], delete_response_body))
+        )
 
-    create_response_header, create_response_body = _send_request(
-        'POST',
-        '%s/users/%d/emails' % (api_url, user_id),
-        {'PRIVATE-TOKEN': private_token, 'Content-Type': 'application/json'},
-        json.dumps({'id': user_id, 'email': email})
-    )
-    if create_response_header['status'] == '201 Created':
+
+def _api_version(api_url):
+    match = re.search(r'/api/v(\d+)', api_url)
+    return int(match.group(1)) if match else 3
+
+
+class _UserResources(object):
+    """the listings of one user's sub-resources. Each listing is fetched only when it is first needed,
+       at most once per module run, and kept up to date with the module's own writes
+    """
+    listings = ('emails', 'ssh_keys')
+
+    def __init__(self, api_url, private_token, user_id, emails=None, ssh_keys=None):
+        """emails and ssh_keys are listings known already, e.g. from a directory snapshot"""
+        self.api_url = api_url
+        self.private_token = private_token
+        self.user_id = user_id
+        self._emails = emails
+        self._ssh_keys = None
+        if ssh_keys is not None:
+            self._ssh_keys = dict((_key_record_fingerprint(key), key) for key in ssh_keys)
+        self._fetches = 0
+
+    def take_fetches(self):
+        """the number of listings fetched since the last call"""
+        fetches, self._fetches = self._fetches, 0
+        return fetches
+
+    def emails(self):
+        if self._emails is None:
+            self._emails = list(_iterate_pages('%s/users/%d/emails' % (self.api_url, self.user_id), self.private_token))
+            self._fetches += 1
+        return self._emails
+
+    def find_email(self, email):
+        for tmp_email in self.emails():
+            if tmp_email['email'] == email.lower():  # gitlab converts email addresses to lower case
+                return tmp_email
+        return None
+
+    def replace_email(self, old_email, new_email):
+        self._emails = [tmp_email for tmp_email in self.emails() if tmp_email is not old_email] + [new_email]
+
+    def ssh_keys(self):
+        """the user's keys, indexed by fingerprint"""
+        if self._ssh_keys is None:
+            self._ssh_keys = dict(
+                (_key_record_fingerprint(key), key)
+                for key in _iterate_pages('%s/users/%d/keys' % (self.api_url, self.user_id), self.private_token)
+            )
+            self._fetches += 1
+        return self._ssh_keys
+
+    def find_ssh_key(self, ssh_key):
+        return self.ssh_keys().get(_ssh_key_fingerprint(ssh_key))
+
+    def find_ssh_key_by_title(self, ssh_key_title):
+        for key in self.ssh_keys().values():
+            if key['title'] == ssh_key_title:
+                return key
+        return None
+
+    def store_ssh_key(self, ssh_key):
+        self.ssh_keys()[_key_record_fingerprint(ssh_key)] = ssh_key
+
+    def discard_ssh_key(self, ssh_key):
+        self.ssh_keys().pop(_key_record_fingerprint(ssh_key), None)
+
+
+def _reconcile_email(params, user, resources):
+    """switches the user to the email in params through the emails listing, for servers that ignore
+       email in user updates. The listing is fetched once and reused
+    """
+    old_email = resources.find_email(user['email'])
+    new_email = resources.find_email(params['email'])
+    if new_email is None:
+        new_email = _update_email(
+            params['api_url'],
+            params['private_token'],
+            user['id'],
+            old_email['id'] if old_email else None,
+            params['email']
+        )
+    elif old_email is not None and old_email is not new_email:
+        # the new email is listed already, only the old one has to go
+        _delete_email(params['api_url'], params['private_token'], user['id'], old_email['id'])
+    resources.replace_email(old_email, new_email)
+
+
+def _wanted_ssh_keys(params):
+    """the keys of ssh_keys and ssh_key_title/ssh_key together, or None if no key is given at all"""
+    if params.get('ssh_keys') is None and params.get('ssh_key') is None:
+        return None
+    wanted_keys = []
+    for ssh_key in params.get('ssh_keys') or []:
+        if not isinstance(ssh_key, dict) or not ssh_key.get('title') or not ssh_key.get('key'):
+            raise GitlabModuleInternalException(
+                'every entry of ssh_keys needs a title and a key for user %s' % params['username']
+            )
+        wanted_keys.append({'title': ssh_key['title'], 'key': ssh_key['key']})
+    if params.get('ssh_key') is not None:
+        wanted_keys.append({'title': params['ssh_key_title'], 'key': params['ssh_key']})
+    return wanted_keys
+
+
+def _diff_ssh_keys(params, user, resources):
+    """returns the keys that have to be uploaded and the existing keys that have to be deleted. A key
+       that is already there is left alone, even if it was uploaded under another title, since Gitlab
+       refuses to store the same key twice. An existing key is deleted if a new key replaces it under
+       the same title, or with ssh_keys_exclusive if it is not wanted at all
+    """
+    wanted_keys = _wanted_ssh_keys(params)
+    if wanted_keys is None:
+        return [], []
+    if not user:
+        return wanted_keys, []
+
+    wanted_fingerprints = set(_ssh_key_fingerprint(ssh_key['key']) for ssh_key in wanted_keys)
+    new_keys = [ssh_key for ssh_key in wanted_keys if resources.find_ssh_key(ssh_key['key']) is None]
+    new_titles = set(ssh_key['title'] for ssh_key in new_keys)
+    stale_keys = [ssh_key
+                  for fingerprint, ssh_key
+                  in sorted(resources.ssh_keys().items(), key=lambda item: item[1]['id'])
+                  if fingerprint not in wanted_fingerprints and
+                  (params.get('ssh_keys_exclusive') or ssh_key['title'] in new_titles)]
+    return new_keys, stale_keys
+
+
+def _update_ssh_keys(params, user, resources, new_keys, stale_keys):
+    """uploads the new keys before the stale ones are deleted, so a failed upload leaves the user with the
+       key it replaces. Gitlab accepts two keys with the same title. The requests of each step are sent
+       concurrently
+    """
+    max_workers = params.get('max_workers') or default_max_workers
+    try:
+        for ssh_key in _map_concurrently(
+                lambda ssh_key: _add_ssh_key(
+                    params['api_url'], params['private_token'], user['id'], ssh_key['title'], ssh_key['key']
+                ),
+                new_keys,
+                max_workers):
+            resources.store_ssh_key(ssh_key)
+        _map_concurrently(
+            lambda ssh_key: _delete_ssh_key(params['api_url'], params['private_token'], user['id'], ssh_key['id']),
+            stale_keys,
+            max_workers
+        )
+        for ssh_key in stale_keys:
+            resources.discard_ssh_key(ssh_key)
+    finally:
+        if _user_cache is not None:
+            _user_cache.discard_listing('%s/users/%d/keys' % (params['api_url'], user['id']))
+
+
+def _save_state_file(path, state):
+    """replaces the state file atomically, readable by its owner only"""
+    state_dir = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(state_dir):
+        os.makedirs(state_dir, 0o700)
+    file_descriptor, temp_path = tempfile.mkstemp(dir=state_dir)
+    with os.fdopen(file_descriptor, 'w') as state_file:
+        json.dump(state, state_file, sort_keys=True)
+    os.rename(temp_path, path)
+
+
+class _PasswordStore(object):
+    """remembers a salted hash of every password this module set, so a password that did not change
+       since is not sent again. Gitlab never returns passwords, so this is the only way to tell.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self._hashes = {}
+        self._changed = False
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path) as state_file:
+                self._hashes = json.load(state_file)
+
+    @staticmethod
+    def _key(api_url, username):
+        return '%s %s' % (api_url.rstrip('/'), username)
+
+    @staticmethod
+    def _hash(password, salt, iterations):
+        return binascii.hexlify(hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations))
+
+    def matches(self, api_url, username, password):
+        with self._lock:
+            stored_hash = self._hashes.get(self._key(api_url, username))
+        if not stored_hash:
+            return False
+        algorithm, iterations, salt, password_hash = stored_hash.split('$')
+        return hmac.compare_digest(
+            str(password_hash),
+            self._hash(password, binascii.unhexlify(salt), int(iterations))
+        )
+
+    def remember(self, api_url, username, password):
+        salt = os.urandom(16)
+        stored_hash = '$'.join((
+            'pbkdf2_sha256',
+            str(password_hash_iterations),
+            binascii.hexlify(salt),
+            self._hash(password, salt, password_hash_iterations)
+        ))
+        with self._lock:
+            self._hashes[self._key(api_url, username)] = stored_hash
+            self._changed = True
+
+    def forget(self, api_url, username):
+        with self._lock:
+            if self._hashes.pop(self._key(api_url, username), None) is not None:
+                self._changed = True
+
+    def save(self):
+        with self._lock:
+            if not self._changed:
+                return
+            _save_state_file(self.path, self._hashes)
+            self._changed = False
+
+
+_password_store = None
+
+
+def _enable_password_store(path):
+    global _password_store
+    _password_store = _PasswordStore(path) if path else None
+
+
+def _close_password_store():
+    global _password_store
+    if _password_store is not None:
+        _password_store.save()
+    _password_store = None
+
+
+def _drop_unchanged_password(params, user, user_request_input):
+    """an existing user's password is only sent with update_password=always and if it is not known to be set already"""
+    if not user or 'password' not in user_request_input:
+        return
+    if params.get('update_password', 'always') == 'on_create' or (
+            _password_store is not None and
+            _password_store.matches(params['api_url'], params['username'], user_request_input['password'])):
+        del user_request_input['password']
+
+
+class _Journal(object):
+    """append-only log of the entries a bulk run completed, so that a run that was interrupted can be
+       repeated without reconciling them again. Every line holds the keyed hash of one entry's params,
+       the file is synced to disk every journal_sync_every entries and whenever the session is saved.
+       A line cut off by a crash is dropped, its entry is simply reconciled again.
+    """
+
+    def __init__(self, path, sync_every=journal_sync_every):
+        self.path = os.path.expanduser(path)
+        self.sync_every = sync_every
+        self._lock = threading.Lock()
+        self._entries = set()
+        self._unsynced = 0
+        journal_dir = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(journal_dir):
+            os.makedirs(journal_dir, 0o700)
+        self._file = os.fdopen(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600), 'r+')
+        try:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            self._file.close()
+            raise GitlabModuleInternalException('journal_file %s is used by another run' % path)
+        self._load()
+
+    def _load(self):
+        self._salt = None
+        complete_length = 0
+        for line in self._file:
+            if not line.endswith('\n'):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            complete_length += len(line)
+            if self._salt is None:
+                self._salt = binascii.unhexlify(record['salt'])
+            else:
+                self._entries.add(record['entry'])
+        self._file.seek(complete_length)
+        self._file.truncate()
+        if self._salt is None:
+            self._salt = os.urandom(16)
+            self._append({'salt': binascii.hexlify(self._salt)})
+            self.sync()
+
+    def _append(self, record):
+        self._file.write(json.dumps(record, sort_keys=True) + '\n')
+        self._unsynced += 1
+
+    def _key(self, user_params):
+        entry = dict((param_name, value) for param_name, value in user_params.items() if param_name != 'private_token')
+        entry['api_url'] = entry['api_url'].rstrip('/')
+        return hmac.new(self._salt, json.dumps(entry, sort_keys=True), hashlib.sha256).hexdigest()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def contains(self, user_params):
+        with self._lock:
+            return self._key(user_params) in self._entries
+
+    def record(self, user_params, changed):
+        with self._lock:
+            key = self._key(user_params)
+            if key in self._entries:
+                return
+            self._entries.add(key)
+            self._append({'entry': key, 'changed': changed, 'at': int(time.time())})
+            if self._unsynced >= self.sync_every:
+                self._sync()
+
+    def _sync(self):
+        if self._unsynced:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def complete(self):
+        """forgets the entries once a bulk run completed, the next run starts from the beginning"""
+        with self._lock:
+            self._entries.clear()
+            self._file.seek(0)
+            self._file.truncate()
+            self._salt = os.urandom(16)
+            self._append({'salt': binascii.hexlify(self._salt)})
+            self._sync()
+
+    def close(self):
+        with self._lock:
+            self._sync()
+            self._file.close()
+
+
+_journal = None
+
+
+def _enable_journal(path):
+    global _journal
+    _journal = _Journal(path) if path else None
+
+
+def _close_journal():
+    global _journal
+    if _journal is not None:
+        _journal.close()
+    _journal = None
+
+
+class _Plan(object):
+    """the writes a check mode run would send, collected for plan_file. Every operation holds what is
+       written, and the fields it overwrites as 'before' for the preconditions of apply_plan
+    """
+
+    def __init__(self, api_url):
+        self.api_url = api_url
+        self.operations = []
+        self._lock = threading.Lock()
+
+    def add(self, operation):
+        with self._lock:
+            self.operations.append(operation)
+
+    def save(self, path):
+        """the plan may contain passwords, it is readable by its owner only"""
+        with self._lock:
+            _save_state_file(os.path.expanduser(path), {
+                'api_url': self.api_url,
+                'created_at': int(time.time()),
+                'operations': self.operations
+            })
+
+
+_plan = None
+
+
+def _enable_plan(api_url):
+    global _plan
+    _plan = _Plan(api_url)
+
+
+def _close_plan():
+    global _plan
+    _plan = None
+
+
+class _UserCache(object):
+    """on-disk copy of the user and key listings of one Gitlab instance, shared by all module processes
+       and kept between module runs. Every page is a file of its own under an advisory lock: the first
+       process that needs a page fetches it while the others wait for the lock and then read the page
+       instead of requesting it again. Pages younger than max_age seconds are used as they are, older
+       ones are revalidated with If-None-Match and If-Modified-Since, so a page that did not change costs
+       an empty 304 response. The module's own writes update or drop the pages they affect.
+    """
+
+    page_headers = ('X-Next-Page', 'X-Total-Pages', 'X-Total', 'Link')
+
+    def __init__(self, cache_dir, api_url, max_age=default_user_cache_max_age):
+        self.api_path = urlparse.urlsplit(api_url).path.rstrip('/')
+        self.path = os.path.join(
+            os.path.expanduser(cache_dir),
+            'gitlab_users_%s' % hashlib.sha1(api_url.rstrip('/').encode('utf-8')).hexdigest()
+        )
+        self.max_age = max_age
+        self._user_listing = re.compile(r'^%s/users(/\d+/keys)?$' % re.escape(self.api_path))
+        self._known_urls = set()
+        self._lock = threading.Lock()
+        self._held_locks = threading.local()
+
+    def accepts(self, url):
+        return self._user_listing.match(urlparse.urlsplit(url).path.rstrip('/')) is not None
+
+    def _page_path(self, url):
+        return os.path.join(self.path, hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+    def _lock_path(self, url):
+        """pages share a fixed number of lock files by the first two digits of their hash, so the lock
+           files of the username lookups don't pile up
+        """
+        return os.path.join(self.path, 'lock-%s' % hashlib.sha1(url.encode('utf-8')).hexdigest()[:2])
+
+    def _make_dir(self):
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path, 0o700)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    @contextlib.contextmanager
+    def lock(self, url):
+        """holds the page's lock against other processes and threads. A thread can take it again while
+           it holds it already
+        """
+        lock_path = self._lock_path(url)
+        held_locks = self._held_locks.__dict__.setdefault('paths', set())
+        if lock_path in held_locks:
+            yield
+            return
+
+        self._make_dir()
+        with open(lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            held_locks.add(lock_path)
+            try:
+                yield
+            finally:
+                held_locks.discard(lock_path)
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def expire_pages(self, expiry=user_cache_page_expiry):
+        """removes the pages that were neither fetched nor revalidated for expiry seconds, e.g. the
+           username lookups of users that are not looked up any more. Runs at most once per hour
+        """
+        self._make_dir()
+        marker_path = os.path.join(self.path, 'expired')
+        try:
+            if time.time() - os.path.getmtime(marker_path) < user_cache_expiry_interval:
+                return
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        with open(marker_path, 'a'):
+            os.utime(marker_path, None)
+
+        expired_before = time.time() - expiry
+        for file_name in os.listdir(self.path):
+            if file_name == 'expired' or file_name.startswith('lock-'):
+                continue
+            try:
+                if os.path.getmtime(os.path.join(self.path, file_name)) < expired_before:
+                    os.remove(os.path.join(self.path, file_name))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+    def _load(self, url):
+        try:
+            with open(self._page_path(url)) as page_file:
+                page = json.load(page_file)
+        except (IOError, ValueError):
+            return None
+        with self._lock:
+            self._known_urls.add(url)
+        return page
+
+    def _save(self, url, page):
+        with self._lock:
+            self._known_urls.add(url)
+        _save_state_file(self._page_path(url), page)
+
+    def validators(self, url):
+        page = self._load(url)
+        if page is None:
+            return {}
+        validators = {}
+        if page.get('etag'):
+            validators['If-None-Match'] = page['etag']
+        if page.get('last_modified'):
+            validators['If-Modified-Since'] = page['last_modified']
+        return validators
+
+    def fresh_response(self, url):
+        """the cached page if it is younger than max_age, or None"""
+        page = self._load(url)
+        if page is None or time.time() - page['fetched_at'] >= self.max_age:
+            return None
+        return self._response(page)
+
+    def revalidated_response(self, url):
+        """the cached page after Gitlab confirmed it did not change, or None if the page is not cached"""
+        page = self._load(url)
+        if page is None:
+            return None
+        page['fetched_at'] = time.time()
+        self._save(url, page)
+        return self._response(page)
+
+    @staticmethod
+    def _response(page):
+        return dict(page['headers'], status='200 OK'), json.dumps(page['records'])
+
+    def store_page(self, url, headers, records):
+        etag = _get_header(headers, 'ETag')
+        last_modified = _get_header(headers, 'Last-Modified')
+        if not etag and not last_modified and not self.max_age:
+            self.discard_page(url)  # could be neither used nor revalidated
+            return
+        self._save(url, {
+            'fetched_at': time.time(),
+            'etag': etag,
+            'last_modified': last_modified,
+            'headers': dict((name, _get_header(headers, name))
+                            for name in self.page_headers
+                            if _get_header(headers, name) is not None),
+            'records': records
+        })
+
+    def discard_page(self, url):
+        try:
+            os.remove(self._page_path(url))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def _update_user_pages(self, user, update):
+        """applies update to the records of every cached user listing this process read"""
+        with self._lock:
+            urls = [url for url in self._known_urls if urlparse.urlsplit(url).path.rstrip('/').endswith('/users')]
+        for url in urls:
+            with self.lock(url):
+                page = self._load(url)
+                if page is None:
+                    continue
+                query = dict(urlparse.parse_qsl(urlparse.urlsplit(url).query))
+                records = update(page['records'], query.get('username') == user['username'])
+                if records is not None:
+                    page['records'] = records
+                    self._save(url, page)
+
+    def store_user(self, user):
+        user = dict(user)  # the records of a _UserIndex hold only some of the fields of the listing
+
+        def update(records, filtered_by_username):
+            if any(record['id'] == user['id'] for record in records):
+                return [dict(record, **user) if record['id'] == user['id'] else record for record in records]
+            if filtered_by_username:
+                return records + [user]
+            return None
+        self._update_user_pages(user, update)
+
+    def discard_user(self, user):
+        def update(records, filtered_by_username):
+            if any(record['id'] == user['id'] for record in records):
+                return [record for record in records if record['id'] != user['id']]
+            return None
+        self._update_user_pages(user, update)
+
+    def discard_listing(self, url):
+        """drops the cached pages of a listing the module wrote to"""
+        path = urlparse.urlsplit(url).path.rstrip('/')
+        with self._lock:
+            urls = [known_url
+                    for known_url in self._known_urls
+                    if urlparse.urlsplit(known_url).path.rstrip('/') == path]
+        for known_url in urls:
+            with self.lock(known_url):
+                self.discard_page(known_url)
+
+
+_user_cache = None
+
+
+def _enable_user_cache(cache_dir, api_url, max_age=default_user_cache_max_age):
+    global _user_cache
+    _user_cache = _UserCache(cache_dir, api_url, max_age) if cache_dir else None
+    if _user_cache is not None:
+        _user_cache.expire_pages()
+
+
+def _close_user_cache():
+    global _user_cache
+    _user_cache = None
+
+
+_user_strings = {}
+
+
+class _UserRecord(object):
+    """the fields of a Gitlab user the module reads, kept in slots instead of the dict of the listing,
+       which holds every field Gitlab returns. A record reads like the user dict, fields the listing
+       did not contain are missing from the record as well
+    """
+    __slots__ = tuple(indexed_user_params)
+
+    def __init__(self, user):
+        for param_name in indexed_user_params:
+            if param_name in user:
+                self[param_name] = user[param_name]
+
+    def __getitem__(self, param_name):
+        if param_name not in indexed_user_params:
+            raise KeyError(param_name)
+        try:
+            return getattr(self, param_name)
+        except AttributeError:
+            raise KeyError(param_name)
+
+    def __setitem__(self, param_name, value):
+        if param_name not in indexed_user_params:
+            raise KeyError(param_name)
+        if isinstance(value, basestring) and (param_name in interned_user_params or value == ''):
+            # few distinct values shared by most users, e.g. 'active' or 'ldapmain', and the empty fields
+            value = _user_strings.setdefault(value, value)
+        setattr(self, param_name, value)
+
+    def __contains__(self, param_name):
+        return param_name in indexed_user_params and hasattr(self, param_name)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __repr__(self):
+        return '_UserRecord(%r)' % dict(self)
+
+    def get(self, param_name, default=None):
+        try:
+            return self[param_name]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return [param_name for param_name in indexed_user_params if hasattr(self, param_name)]
+
+
+def _index_key(value):
+    if not isinstance(value, basestring):
+        return value
+    key = value.lower()
+    return value if key == value else key  # no second copy of values that are lower case already
+
+
+class _UserIndex(object):
+    """user records by username, id, lower cased email and extern_uid"""
+
+    def __init__(self, users=()):
+        self._by_username = {}
+        self._by_id = {}
+        self._by_email = {}
+        self._by_extern_uid = {}
+        for user in users:
+            self.add(user)
+
+    def __len__(self):
+        return len(self._by_username)
+
+    def __iter__(self):
+        return self._by_username.itervalues()
+
+    def _indexes(self, record):
+        yield self._by_username, record['username']
+        if 'id' in record:
+            yield self._by_id, record['id']
+        if record.get('email'):
+            yield self._by_email, _index_key(record['email'])
+        if record.get('extern_uid'):
+            yield self._by_extern_uid, record['extern_uid']
+
+    def add(self, user):
+        """adds the user, or replaces the record of the same username or id. Returns the record"""
+        record = user if isinstance(user, _UserRecord) else _UserRecord(user)
+        self.remove(record['username'])
+        if 'id' in record and record['id'] in self._by_id:
+            self.remove(self._by_id[record['id']]['username'])  # renamed
+        for index, key in self._indexes(record):
+            index[key] = record
+        return record
+
+    def remove(self, username):
+        record = self._by_username.get(username)
+        if record is not None:
+            for index, key in self._indexes(record):
+                if index.get(key) is record:
+                    del index[key]
+        return record
+
+    def by_username(self, username):
+        return self._by_username.get(username)
+
+    def by_id(self, user_id):
+        return self._by_id.get(user_id)
+
+    def by_email(self, email):
+        return self._by_email.get(_index_key(email))
+
+    def by_extern_uid(self, extern_uid):
+        return self._by_extern_uid.get(extern_uid)
+
+
+class _UserDirectory(object):
+    """in-memory snapshot of the Gitlab user list, shared by all users reconciled in one module run"""
+
+    def __init__(self, users):
+        self._index = _UserIndex(users)
+        self._resources = {}
+        self._lock = threading.Lock()
+
+    def find(self, username):
+        return self._index.by_username(username)
+
+    def store(self, user):
+        with self._lock:
+            self._index.add(user)
+
+    def discard(self, username):
+        with self._lock:
+            self._index.remove(username)
+
+    def users(self):
+        with self._lock:
+            return list(self._index)
+
+    def release_resources(self):
+        """drops the listings fetched so far, e.g. after a chunk of a users_file was reconciled"""
+        with self._lock:
+            self._resources.clear()
+
+    def resources(self, api_url, private_token, user_id, emails=None, ssh_keys=None):
+        with self._lock:
+            if user_id not in self._resources:
+                self._resources[user_id] = _UserResources(api_url, private_token, user_id, emails, ssh_keys)
+            return self._resources[user_id]
+
+    def confirm(self, params):
+        """makes sure the user in params is up to date before it is written to. Returns whether the
+           user was looked up again
+        """
+        return False
+
+
+class _SnapshotDirectory(_UserDirectory):
+    """a user directory loaded from the snapshot of gitlab_user_facts instead of from Gitlab, with the
+       emails and key fingerprints of the users. A user that is about to be written to is looked up
+       again first, since the snapshot may be outdated
+    """
+
+    def __init__(self, snapshot):
+        _UserDirectory.__init__(self, snapshot['users'])
+        self._snapshot_resources = dict(
+            (user['id'], (user.get('emails'), user.get('ssh_keys'))) for user in snapshot['users']
+        )
+        self._confirmed = set()
+
+    def resources(self, api_url, private_token, user_id, emails=None, ssh_keys=None):
+        with self._lock:
+            if user_id not in self._resources:
+                emails, ssh_keys = self._snapshot_resources.get(user_id, (emails, ssh_keys))
+                self._resources[user_id] = _UserResources(api_url, private_token, user_id, emails, ssh_keys)
+            return self._resources[user_id]
+
+    def confirm(self, params):
+        with self._lock:
+            if params['username'] in self._confirmed:
+                return False
+            self._confirmed.add(params['username'])
+        user = _find_user_by_name(params['api_url'], params['private_token'], params['username'])
+        with self._lock:
+            snapshot_user = self._index.remove(params['username'])
+            if snapshot_user is not None:
+                self._snapshot_resources.pop(snapshot_user['id'], None)
+                self._resources.pop(snapshot_user['id'], None)
+            if user is not None:
+                self._snapshot_resources.pop(user['id'], None)
+                self._resources.pop(user['id'], None)
+                self._index.add(user)
         return True
 
-    raise GitlabModuleInternalException('\n'.join((create_response_header['status'], create_response_body)))
 
+def _load_user_directory(api_url, private_token, max_workers=default_max_workers):
+    """sweeps the user list into a directory, every page is turned into compact records as soon as it is parsed"""
+    return _UserDirectory(_list_all_users(api_url, private_token, max_workers, record=_UserRecord))
 
-def remove_user(params, check_mode):
-    user = _find_user_by_name(params['api_url'], params['private_token'], params['username'])
+
+def _load_directory_snapshot(params):
+    """the directory_snapshot param is the snapshot of gitlab_user_facts, or the file it was written to"""
+    snapshot = params['directory_snapshot']
+    if not isinstance(snapshot, dict):
+        try:
+            with open(os.path.expanduser(snapshot)) as snapshot_file:
+                snapshot = json.load(snapshot_file)
+        except (IOError, ValueError) as e:
+            raise GitlabModuleInternalException('cannot read directory_snapshot %s: %s' % (snapshot, e))
+    if snapshot.get('api_url', '').rstrip('/') != params['api_url'].rstrip('/'):
+        raise GitlabModuleInternalException(
+            'directory_snapshot was taken from %s, not from %s' % (snapshot.get('api_url'), params['api_url'])
+        )
+    return _SnapshotDirectory(snapshot)
+
+
+def _user_resources(params, user, directory, created=False):
+    """the lazily fetched listings of the user. A user created by this run has no emails and keys yet,
+       so its listings are known without fetching them
+    """
+    listings = ([], []) if created else (None, None)
+    if directory is not None:
+        return directory.resources(params['api_url'], params['private_token'], user['id'], *listings)
+    return _UserResources(params['api_url'], params['private_token'], user['id'], *listings)
+
+
+def _lookup_user(params, directory):
+    if directory is not None:
+        return directory.find(params['username'])
+    return _find_user_by_name(params['api_url'], params['private_token'], params['username'])
+
+
+def remove_user(params, check_mode, directory=None):
+    user = _lookup_user(params, directory)
+    if user and not check_mode and directory is not None and directory.confirm(params):
+        user = directory.find(params['username'])
 
     change = bool(user)
+    if check_mode and change and _plan is not None:
+        _plan.add({'username': user['username'], 'action': 'delete', 'user_id': user['id']})
     if check_mode or not change:
         return change
 
-    headers, body = _send_request(
-        url='%s/users/%d' % (params['api_url'], user['id']),
-        method='DELETE',
-        headers={'PRIVATE-TOKEN': params['private_token']}
-    )
+    return _delete_user(params['api_url'], params['private_token'], user, directory)
 
-    if headers['status'] == '200 OK':
-        return True
 
-    raise GitlabModuleInternalException('\n'.join((headers['status'], body)))
+def _delete_user(api_url, private_token, user, directory):
+    """deletes the user and forgets it in the directory, the user cache and the password store.
+       Returns False if the user was deleted by someone else in the meantime
+    """
+    try:
+        headers, body = _send_request(
+            url='%s/users/%d' % (api_url, user['id']),
+            method='DELETE',
+            headers={'PRIVATE-TOKEN': private_token}
+        )
+    except GitlabHttpError as e:
+        if e.status != 404:
+            raise
+        deleted = False
+    else:
+        if headers['status'] not in ('200 OK', '204 No Content'):
+            raise GitlabModuleInternalException('\n'.join((headers['status'], body)))
+        deleted = True
+
+    if directory is not None:
+        directory.discard(user['username'])
+    if _user_cache is not None:
+        _user_cache.discard_user(user)
+    if _password_store is not None:
+        _password_store.forget(api_url, user['username'])
+    return deleted
+
+
+def _block_user(api_url, private_token, user, directory):
+    """blocks the user, so it can no longer sign in but keeps its projects. Returns False if the user
+       was deleted in the meantime
+    """
+    if _api_version(api_url) >= 4:
+        method, ok_statuses = 'POST', ('200 OK', '201 Created')
+    else:
+        method, ok_statuses = 'PUT', ('200 OK',)
+    try:
+        headers, body = _send_request(
+            url='%s/users/%d/block' % (api_url, user['id']),
+            method=method,
+            headers={'PRIVATE-TOKEN': private_token}
+        )
+    except GitlabHttpError as e:
+        if e.status != 404:
+            raise
+        if directory is not None:
+            directory.discard(user['username'])
+        return False
+
+    if headers['status'] not in ok_statuses:
+        raise GitlabModuleInternalException('\n'.join((headers['status'], body)))
+
+    blocked_user = dict(user)
+    blocked_user['state'] = 'blocked'
+    if directory is not None:
+        directory.store(blocked_user)
+    if _user_cache is not None:
+        _user_cache.store_user(blocked_user)
+    return True
 
 
-def create_or_update_user(params, check_mode):
-    user = _find_user_by_name(params['api_url'], params['private_token'], params['username'])
-    if user and 'ssh_key_title' in params:
-        ssh_key = _get_ssh_key_for_user(params['api_url'], params['private_token'], user['id'], params['ssh_key_title'])
+def _plan_user_update(params, directory):
+    """looks up the user and everything that has to change to match params. The user's listings are
+       fetched only if the keys or emails of params have to be compared with them
+    """
+    user = _lookup_user(params, directory)
+    if user and _wanted_ssh_keys(params) is not None:
+        resources = _user_resources(params, user, directory)
     else:
-        ssh_key = {}
+        resources = None  # created when an email change needs the emails listing
+    new_ssh_keys, stale_ssh_keys = _diff_ssh_keys(params, user, resources)
 
     email_change = False
-    if 'email' in params and user and user['email'] != params['email']:
+    if params.get('email') is not None and user and user['email'].lower() != params['email'].lower():
         email_change = True
 
     user_request_input = {param_name: params[param_name]
@@ -343,81 +2821,854 @@ def create_or_update_user(params, check_mode):
                           in allowed_user_params
                           if param_name in params and params[param_name] is not None}
     user_request_input = _add_non_standard_params(params, user_request_input)
+    _drop_unchanged_password(params, user, user_request_input)
 
     if not _check_required_input_params(user_request_input, user):
         raise GitlabModuleInternalException(
             ', '.join(required_user_create_params) + ' are required when creating a new user'
         )
 
-    ssh_key_change = 'ssh_key' in params and ('key' not in ssh_key or ssh_key['key'] != params['ssh_key'])
-    user_change = _predict_user_change(user_request_input, user)
+    user_changes = _diff_user(user_request_input, user)
+    if email_change and _api_version(params['api_url']) >= 4:
+        # API v4 changes the primary email with the user update, no separate requests needed
+        user_changes['email'] = params['email']
+    return user, resources, user_changes, new_ssh_keys, stale_ssh_keys, email_change
+
+
+def _planned_update(params, user, user_changes, new_ssh_keys, stale_ssh_keys, email_change):
+    """the writes of create_or_update_user as an operation of the plan"""
+    operation = {'username': params['username'], 'action': 'update' if user else 'create', 'fields': user_changes}
+    if user:
+        operation['user_id'] = user['id']
+        before_names = ['is_admin' if param_name == 'admin' else param_name
+                        for param_name in user_changes
+                        if param_name != 'password']
+        operation['before'] = dict((param_name, user.get(param_name)) for param_name in before_names)
+        if email_change:
+            operation['before']['email'] = user['email']
+    if new_ssh_keys:
+        operation['add_ssh_keys'] = [{'title': ssh_key['title'], 'key': ssh_key['key']} for ssh_key in new_ssh_keys]
+    if stale_ssh_keys:
+        operation['delete_ssh_keys'] = [
+            {'id': ssh_key['id'], 'title': ssh_key['title'], 'fingerprint': _key_record_fingerprint(ssh_key)}
+            for ssh_key in stale_ssh_keys
+        ]
+    if email_change and 'email' not in user_changes:
+        operation['email'] = params['email']  # switched through the emails listing, see _reconcile_email
+    return operation
+
+
+def _report_skipped_fetches(report, resources, fetches):
+    if report is not None:
+        if resources is not None:
+            fetches += resources.take_fetches()
+        report['skipped_fetches'] = len(_UserResources.listings) - fetches
+
+
+def create_or_update_user(params, check_mode, directory=None, report=None):
+    """returns whether the user changed. If a report dict is given, the changed fields are added
+       to it as 'changes', and the number of the user's listings that were not fetched as 'skipped_fetches'
+    """
+    fetches = 0
+    user, resources, user_changes, new_ssh_keys, stale_ssh_keys, email_change = _plan_user_update(params, directory)
+    changed = bool(user_changes or new_ssh_keys or stale_ssh_keys or email_change)
+    if changed and not check_mode and directory is not None and directory.confirm(params):
+        if resources is not None:
+            fetches += resources.take_fetches()
+        user, resources, user_changes, new_ssh_keys, stale_ssh_keys, email_change = \
+            _plan_user_update(params, directory)
+    ssh_key_change = bool(new_ssh_keys or stale_ssh_keys)
+
+    if report is not None:
+        report['changes'] = _describe_user_changes(user_changes, user)
+        if ssh_key_change:
+            report['ssh_keys'] = {
+                'added': [ssh_key['title'] for ssh_key in new_ssh_keys],
+                'removed': [ssh_key['title'] for ssh_key in stale_ssh_keys]
+            }
+    user_change = bool(user_changes)
     if check_mode or (not user_change and not ssh_key_change and not email_change):
-        return user_change or ssh_key_change
+        _report_skipped_fetches(report, resources, fetches)
+        if _plan is not None and (user_change or ssh_key_change or email_change):
+            _plan.add(_planned_update(params, user, user_changes, new_ssh_keys, stale_ssh_keys, email_change))
+        return user_change or ssh_key_change or email_change
 
+    created = user is None
     if user_change:
+        user_update = dict(user_changes)
+        if user and 'email' in user_update:
+            user_update['skip_reconfirmation'] = True
         user = _update_user(
             params['api_url'],
             params['private_token'],
             user['id'] if user else None,
-            user_request_input
+            user_update
         )
-    if user and ssh_key_change:
-        _update_ssh_key(params['api_url'], params['private_token'], user['id'],
-                        ssh_key['id'] if ssh_key and 'id' in ssh_key else None, params['ssh_key_title'],
-                        params['ssh_key'])
-    if email_change:
-        _update_email(
-            params['api_url'],
-            params['private_token'],
-            user['id'],
-            _get_email_id(params['api_url'], params['private_token'], user['id'], user['email']),
-            params['email']
+        if _password_store is not None and 'password' in user_changes:
+            _password_store.remember(params['api_url'], params['username'], user_changes['password'])
+    if resources is None:
+        resources = _user_resources(params, user, directory, created)
+    if ssh_key_change:
+        _update_ssh_keys(params, user, resources, new_ssh_keys, stale_ssh_keys)
+    if email_change and user['email'].lower() != params['email'].lower():
+        _reconcile_email(params, user, resources)
+        user['email'] = params['email']
+
+    if directory is not None:
+        directory.store(user)
+    if _user_cache is not None:
+        _user_cache.store_user(user)
+    _report_skipped_fetches(report, resources, fetches)
+    return True
+
+
+def _check_user_spec(spec):
+    """raises if an entry of 'users' is no valid user entry"""
+    if not isinstance(spec, dict) or 'username' not in spec:
+        raise GitlabModuleInternalException('every entry of users needs a username')
+    unknown_params = sorted(set(spec) - set(user_spec_params))
+    if unknown_params:
+        raise GitlabModuleInternalException(
+            'unsupported parameters for user %s: %s' % (spec['username'], ', '.join(unknown_params))
+        )
+    if (spec.get('ssh_key_title') is None) != (spec.get('ssh_key') is None):
+        raise GitlabModuleInternalException(
+            'ssh_key_title and ssh_key are required together for user %s' % spec['username']
+        )
+
+
+def _user_specs(params):
+    """turns the entries of the 'users' option into the params of single users. Options given
+       outside of 'users' are defaults for all entries
+    """
+    defaults = dict((param_name, params[param_name])
+                    for param_name
+                    in user_spec_params
+                    if param_name != 'username' and params.get(param_name) is not None)
+
+    for spec in params['users']:
+        _check_user_spec(spec)
+        user_params = dict(defaults, api_url=params['api_url'], private_token=params['private_token'])
+        user_params.update((param_name, value) for param_name, value in spec.items() if value is not None)
+        yield user_params
+
+
+def _reconcile_user_specs(user_specs, check_mode, directory):
+    """reconciles the entries of one user one after the other. A failing entry fails the entries
+       of the same user that follow it, but not the entries of other users
+    """
+    results = []
+    failure = None
+    for user_params in user_specs:
+        result = {'username': user_params['username'], 'state': user_params.get('state', 'present'), 'changed': False}
+        results.append(result)
+        if failure is not None:
+            result.update(failed=True, msg='skipped because a previous entry of this user failed')
+            continue
+        if _journal is not None and _journal.contains(user_params):
+            result['journaled'] = True  # completed by an earlier, interrupted run
+            continue
+        try:
+            if result['state'] == 'absent':
+                result['changed'] = remove_user(user_params, check_mode, directory)
+            else:
+                result['changed'] = create_or_update_user(user_params, check_mode, directory, result)
+        except GitlabModuleInternalException as e:
+            failure = e
+            result.update(failed=True, msg=e.message)
+            continue
+        if _journal is not None and not check_mode:
+            _journal.record(user_params, result['changed'])
+    return results
+
+
+def _token_owner(api_url, private_token):
+    """the username of the account that owns private_token"""
+    headers, body = _send_request('GET', '%s/user' % api_url, {'PRIVATE-TOKEN': private_token})
+    return json.loads(body)['username']
+
+
+def _prune_candidates(params, directory, declared_usernames):
+    """the users of the directory that are neither declared in 'users' nor protected, in id order.
+       The owner of private_token is always protected. Users that are blocked already are left alone
+       when pruning blocks
+    """
+    if not declared_usernames:
+        raise GitlabModuleInternalException('exclusive refuses to prune with no declared users')
+    protected_users = params.get('protected_users') or []
+    token_owner = _token_owner(params['api_url'], params['private_token'])
+    candidates = []
+    for user in directory.users():
+        if user['username'] in declared_usernames or user['username'] == token_owner:
+            continue
+        if any(fnmatch.fnmatchcase(user['username'], pattern) for pattern in protected_users):
+            continue
+        if params.get('prune_action') == 'block' and 'blocked' in (user.get('state') or ''):
+            continue
+        candidates.append(user)
+    candidates.sort(key=lambda user: user['id'])
+
+    max_deletions = params.get('max_deletions')
+    if max_deletions is None:
+        max_deletions = default_max_deletions
+    if len(candidates) > max_deletions:
+        raise GitlabModuleInternalException(
+            'exclusive would %s %d users, more than max_deletions %d: %s' % (
+                params.get('prune_action') or 'delete',
+                len(candidates),
+                max_deletions,
+                ', '.join(user['username'] for user in candidates[:10]) + (', ...' if len(candidates) > 10 else '')
+            )
+        )
+    return candidates
+
+
+def _prune_user(params, user, check_mode, directory):
+    action = params.get('prune_action') or 'delete'
+    result = {'username': user['username'], 'action': action, 'changed': True}
+    if check_mode:
+        if _plan is not None:
+            _plan.add({'username': user['username'], 'action': action, 'user_id': user['id'],
+                       'before': {'state': user.get('state')}})
+        return result
+    try:
+        if action == 'block':
+            result['changed'] = _block_user(params['api_url'], params['private_token'], user, directory)
+        else:
+            result['changed'] = _delete_user(params['api_url'], params['private_token'], user, directory)
+    except GitlabModuleInternalException as e:
+        result.update(changed=False, failed=True, msg=e.message)
+    return result
+
+
+def reconcile_users(params, check_mode, directory=None, report=None):
+    """reconciles all entries of the 'users' option against one snapshot of the user list, instead of
+       looking every user up on its own. Up to max_workers users are reconciled concurrently, the entries
+       of one user are reconciled in order. Errors are reported in the results of the failed users.
+       With 'exclusive', the users that are not declared are deleted or blocked afterwards, also concurrently,
+       and added to the report dict as 'pruned'. Nothing is pruned if an entry failed.
+    """
+    max_workers = params.get('max_workers') or default_max_workers
+    user_specs = list(_user_specs(params))
+    if directory is None:
+        directory = _load_user_directory(params['api_url'], params['private_token'], max_workers)
+    prune_candidates = []
+    if params.get('exclusive'):
+        # checked before anything changes, so an exceeded max_deletions leaves Gitlab untouched
+        prune_candidates = _prune_candidates(params, directory, set(spec['username'] for spec in user_specs))
+
+    usernames = []
+    specs_by_username = {}
+    for user_params in user_specs:
+        if user_params['username'] not in specs_by_username:
+            usernames.append(user_params['username'])
+            specs_by_username[user_params['username']] = []
+        specs_by_username[user_params['username']].append(user_params)
+
+    pool = multiprocessing.pool.ThreadPool(max(1, min(max_workers, len(usernames))))
+    try:
+        results_by_username = dict(zip(usernames, pool.map(
+            lambda username: _reconcile_user_specs(specs_by_username[username], check_mode, directory),
+            usernames
+        )))
+    finally:
+        pool.close()
+        pool.join()
+
+    results = [results_by_username[user_params['username']].pop(0) for user_params in user_specs]
+
+    if params.get('exclusive') and report is not None:
+        if any(result.get('failed') for result in results):
+            report['pruned'] = []
+        else:
+            report['pruned'] = _map_concurrently(
+                lambda user: _prune_user(params, user, check_mode, directory),
+                prune_candidates,
+                max_workers
+            )
+    return results
+
+
+def _file_boolean(value):
+    """the yes/no options of users_file records, which are strings in CSV and LDIF files"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, basestring):
+        value = value.lower()
+    if value in BOOLEANS_TRUE:
+        return True
+    if value in BOOLEANS_FALSE:
+        return False
+    raise GitlabModuleInternalException('%s is not a boolean' % value)
+
+
+def _file_value(param_name, value):
+    if param_name == 'projects_limit' and isinstance(value, basestring) and value.isdigit():
+        return int(value)  # Gitlab returns numbers, a string would always differ
+    return value
+
+
+def _users_file_format(params):
+    if params.get('users_file_format') not in (None, 'auto'):
+        return params['users_file_format']
+    extension = os.path.splitext(params['users_file'])[1].lower()
+    if extension not in users_file_formats:
+        raise GitlabModuleInternalException(
+            'cannot tell the format of users_file %s, set users_file_format' % params['users_file']
         )
+    return users_file_formats[extension]
+
+
+def _read_csv_specs(users_file):
+    """one user per row, the header row names the options. Empty cells are options that are not given"""
+    reader = csv.reader(users_file)
+    header = [column.strip().decode('utf-8') for column in next(reader, [])]
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        if len(row) > len(header):
+            yield reader.line_num, GitlabModuleInternalException('more cells than the header')
+            continue
+        yield reader.line_num, dict((param_name, _file_value(param_name, cell.decode('utf-8')))
+                                    for param_name, cell in zip(header, row)
+                                    if cell != '')
+
+
+def _read_jsonl_specs(users_file):
+    """one JSON object per line"""
+    for line_number, line in enumerate(users_file, 1):
+        if not line.strip():
+            continue
+        try:
+            spec = json.loads(line)
+        except ValueError as e:
+            yield line_number, GitlabModuleInternalException('no JSON: %s' % e)
+            continue
+        if not isinstance(spec, dict):
+            spec = GitlabModuleInternalException('no JSON object')
+        yield line_number, spec
+
+
+def _ldif_record(lines):
+    record = []
+    for record_line in lines:
+        attribute, separator, value = record_line.partition(':')
+        if not separator:
+            raise GitlabModuleInternalException('invalid LDIF line: %s' % record_line)
+        if value.startswith(':'):
+            value = base64.b64decode(value[1:].strip())
+        elif value.startswith('<'):
+            raise GitlabModuleInternalException('LDIF URL values are not supported: %s' % record_line)
+        else:
+            value = value.strip()
+        record.append((attribute.strip().lower(), value.decode('utf-8')))
+    return record
+
+
+def _ldif_records(users_file):
+    """the records of an LDIF file as lists of (attribute, value) pairs with the number of their first
+       line, or with the error of a record that cannot be read. Folded lines are joined and base64 values
+       are decoded. The version line may be followed by the first record directly
+    """
+    lines = []
+    first_line_number = None
+    first_record = True
+    for line_number, line in enumerate(itertools.chain(users_file, ['\n']), 1):
+        line = line.rstrip('\r\n')
+        if line.startswith(' ') and lines:
+            lines[-1] += line[1:]
+            continue
+        if line.strip() or not lines:
+            if line.strip() and not line.startswith('#'):
+                if not lines:
+                    first_line_number = line_number
+                lines.append(line)
+            continue
+
+        try:
+            record = _ldif_record(lines)
+        except (GitlabModuleInternalException, TypeError) as e:  # TypeError: invalid base64
+            record = GitlabModuleInternalException(str(e))
+        lines = []
+        if first_record and record and not isinstance(record, Exception) and record[0][0] == 'version':
+            record = record[1:]
+            first_line_number += 1
+        first_record = False
+        if record:
+            yield first_line_number, record
+
+
+def _read_ldif_specs(users_file):
+    """maps uid, cn or displayName, mail and sshPublicKey of every entry to the user options. Attributes
+       named like an option are taken as they are, entries with changetype delete are absent
+    """
+    for line_number, record in _ldif_records(users_file):
+        if isinstance(record, Exception):
+            yield line_number, record
+            continue
+        spec = {}
+        ssh_keys = []
+        for attribute, value in record:
+            if attribute == 'changetype' and value.lower() == 'delete':
+                spec['state'] = 'absent'
+            elif ldif_user_attributes.get(attribute) == 'ssh_keys':
+                ssh_keys.append(value)
+            elif attribute in ldif_user_attributes:
+                if attribute != 'cn' or 'name' not in spec:  # displayName is preferred over cn
+                    spec[ldif_user_attributes[attribute]] = value
+            elif attribute in user_spec_params:
+                spec[attribute] = _file_value(attribute, value)
+        if 'username' not in spec:
+            continue  # not a user entry, e.g. an organizational unit
+        if ssh_keys:
+            spec['ssh_keys'] = [
+                {'title': ssh_key.split()[2] if len(ssh_key.split()) > 2 else '%s-%d' % (spec['username'], number),
+                 'key': ssh_key}
+                for number, ssh_key in enumerate(ssh_keys, 1)
+            ]
+        yield line_number, spec
+
+
+def _read_user_specs(params):
+    """reads the user specs of users_file one by one, the file is never loaded as a whole. Yields the
+       line number of every record with its spec, or with the error if the record cannot be read
+    """
+    reader = {'csv': _read_csv_specs, 'jsonl': _read_jsonl_specs, 'ldif': _read_ldif_specs}[_users_file_format(params)]
+    try:
+        with open(os.path.expanduser(params['users_file']), 'rb') as users_file:
+            for line_number, spec in reader(users_file):
+                yield line_number, spec
+    except IOError as e:
+        raise GitlabModuleInternalException('cannot read users_file %s: %s' % (params['users_file'], e))
+
+
+def _read_valid_user_specs(params, invalid_records):
+    """the line numbers and specs of the records of users_file that are valid user entries, with their
+       yes/no options converted. Records that are not are appended to invalid_records as failed results
+    """
+    for line_number, spec in _read_user_specs(params):
+        try:
+            if isinstance(spec, Exception):
+                raise spec
+            _check_user_spec(spec)
+            spec = convert_booleans({'users': [spec]}, _file_boolean)['users'][0]
+        except GitlabModuleInternalException as e:
+            username = spec.get('username') if isinstance(spec, dict) else None
+            invalid_records.append({'username': username, 'line': line_number, 'changed': False, 'failed': True,
+                                    'msg': 'users_file line %d: %s' % (line_number, e.message)})
+            continue
+        yield line_number, spec
+
+
+def _chunks(items, chunk_size):
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def sync_users_file(params, check_mode, directory=None, progress=None):
+    """reconciles the users of users_file in chunks of chunk_size against one user directory. Only the
+       records of the current chunk are in memory, the result counts the users instead of listing them.
+       progress is called with a message after every chunk. With 'exclusive', the file is read once more
+       beforehand for the declared usernames
+    """
+    max_workers = params.get('max_workers') or default_max_workers
+    chunk_size = params.get('chunk_size') or default_chunk_size
+    if directory is None:
+        directory = _load_user_directory(params['api_url'], params['private_token'], max_workers)
+    prune_candidates = []
+    if params.get('exclusive'):
+        declared_usernames = set(spec['username']
+                                 for line_number, spec in _read_user_specs(params)
+                                 if isinstance(spec, dict) and spec.get('username'))
+        prune_candidates = _prune_candidates(params, directory, declared_usernames)
+
+    summary = {'records': 0, 'changed': 0, 'failed': 0, 'skipped_fetches': 0}
+    failures = []
+    invalid_records = []
+
+    def report_invalid_records():
+        summary['records'] += len(invalid_records)
+        summary['failed'] += len(invalid_records)
+        failures.extend(invalid_records[:max(0, max_reported_failures - len(failures))])
+        del invalid_records[:]
+
+    chunk_params = dict(params, exclusive=False, users_file=None)
+    specs = _read_valid_user_specs(params, invalid_records)
+    for chunk_number, chunk in enumerate(_chunks(specs, chunk_size), 1):
+        report_invalid_records()
+        chunk_params['users'] = [spec for line_number, spec in chunk]
+        results = reconcile_users(chunk_params, check_mode, directory)
+        directory.release_resources()
+        save_session()  # a checkpoint to resume from
+        for (line_number, spec), result in zip(chunk, results):
+            result['line'] = line_number
+        summary['records'] += len(results)
+        summary['changed'] += sum(1 for result in results if result['changed'])
+        summary['failed'] += sum(1 for result in results if result.get('failed'))
+        summary['skipped_fetches'] += sum(result.get('skipped_fetches', 0) for result in results)
+        if _journal is not None:
+            summary['journaled'] = summary.get('journaled', 0) + sum(1 for result in results if result.get('journaled'))
+        failures.extend(itertools.islice((result for result in results if result.get('failed')),
+                                         max(0, max_reported_failures - len(failures))))
+        if progress is not None:
+            progress('users_file chunk %d: %d records, %d changed, %d failed' % (
+                chunk_number, summary['records'], summary['changed'], summary['failed']
+            ))
+    report_invalid_records()
+
+    result = dict(changed=summary['changed'] > 0, users_file=summary, failures=failures)
+    if params.get('exclusive'):
+        result['pruned'] = []
+        if not summary['failed']:
+            result['pruned'] = _map_concurrently(
+                lambda user: _prune_user(params, user, check_mode, directory),
+                prune_candidates,
+                max_workers
+            )
+        result['changed'] = result['changed'] or any(pruned['changed'] for pruned in result['pruned'])
+    failed_prunes = [pruned for pruned in result.get('pruned', []) if pruned.get('failed')]
+    if summary['failed'] or failed_prunes:
+        result['failed'] = True
+        result['msg'] = '%d of %d users failed' % (summary['failed'], summary['records'])
+        if failed_prunes:
+            result['msg'] += ', %d of %d users could not be pruned' % (len(failed_prunes), len(result['pruned']))
+    return result
+
+
+def _get_user(api_url, private_token, user_id):
+    try:
+        headers, body = _send_request('GET', '%s/users/%d' % (api_url, user_id), {'PRIVATE-TOKEN': private_token})
+    except GitlabHttpError as e:
+        if e.status != 404:
+            raise
+        return None
+    if headers['status'] != '200 OK':
+        raise GitlabModuleInternalException('\n'.join((headers['status'], body)))
+    return json.loads(body)
+
+
+def _check_preconditions(params, operation):
+    """makes sure the user is still as the plan saw it, with one request per operation instead of the
+       lookups of a full run. Returns the user
+    """
+    if operation['action'] == 'create':
+        if _find_user_by_name(params['api_url'], params['private_token'], operation['username']) is not None:
+            raise GitlabModuleInternalException('user %s was created since the plan was made' % operation['username'])
+        return None
 
+    user = _get_user(params['api_url'], params['private_token'], operation['user_id'])
+    if user is None or user['username'] != operation['username']:
+        raise GitlabModuleInternalException(
+            'user %s was deleted or renamed since the plan was made' % operation['username']
+        )
+    changed_fields = sorted(param_name
+                            for param_name, value in operation.get('before', {}).items()
+                            if user.get(param_name) != value)
+    if changed_fields:
+        raise GitlabModuleInternalException('%s of user %s changed since the plan was made' % (
+            ', '.join(changed_fields), operation['username']
+        ))
+    return user
+
+
+def _apply_operation(params, operation):
+    """sends the writes of one operation of the plan. Returns whether the user changed"""
+    user = None
+    if params.get('plan_preconditions'):
+        user = _check_preconditions(params, operation)
+    fetched_user = user is not None
+    if user is None and operation.get('user_id') is not None:
+        user = dict(operation.get('before', {}), id=operation['user_id'], username=operation['username'])
+
+    if operation['action'] == 'delete':
+        return _delete_user(params['api_url'], params['private_token'], user, None)
+    if operation['action'] == 'block':
+        return _block_user(params['api_url'], params['private_token'], user, None)
+
+    user_params = dict(params, username=operation['username'])
+    if operation.get('fields'):
+        user_update = dict(operation['fields'])
+        if user and 'email' in user_update:
+            user_update['skip_reconfirmation'] = True
+        user = _update_user(params['api_url'], params['private_token'], user['id'] if user else None, user_update)
+        fetched_user = True
+        if _password_store is not None and 'password' in operation['fields']:
+            _password_store.remember(params['api_url'], operation['username'], operation['fields']['password'])
+    resources = _UserResources(params['api_url'], params['private_token'], user['id'], ssh_keys=[])
+    if operation.get('add_ssh_keys') or operation.get('delete_ssh_keys'):
+        _update_ssh_keys(
+            user_params, user, resources, operation.get('add_ssh_keys', []), operation.get('delete_ssh_keys', [])
+        )
+    if operation.get('email'):
+        _reconcile_email(dict(user_params, email=operation['email']), user, resources)
+        user['email'] = operation['email']
+    if _user_cache is not None and fetched_user:  # the fields of the plan alone are no complete user
+        _user_cache.store_user(user)
     return True
 
 
+def _apply_user_operations(params, operations, check_mode):
+    """applies the operations of one user in order. A failing operation fails the ones that follow"""
+    results = []
+    failure = None
+    for operation in operations:
+        result = {'username': operation['username'], 'action': operation['action'], 'changed': False}
+        results.append(result)
+        if failure is not None:
+            result.update(failed=True, msg='skipped because a previous operation of this user failed')
+            continue
+        if check_mode:
+            result['changed'] = True
+            continue
+        try:
+            result['changed'] = _apply_operation(params, operation)
+        except GitlabModuleInternalException as e:
+            failure = e
+            result.update(failed=True, msg=e.message)
+    return results
+
+
+def apply_plan(params, check_mode):
+    """sends the writes of a plan_file written in check mode, without looking the users up again.
+       The operations of up to max_workers users are applied concurrently
+    """
+    try:
+        with open(os.path.expanduser(params['apply_plan'])) as plan_file:
+            plan = json.load(plan_file)
+    except (IOError, ValueError) as e:
+        raise GitlabModuleInternalException('cannot read apply_plan %s: %s' % (params['apply_plan'], e))
+    if plan.get('api_url', '').rstrip('/') != params['api_url'].rstrip('/'):
+        raise GitlabModuleInternalException(
+            'apply_plan was made for %s, not for %s' % (plan.get('api_url'), params['api_url'])
+        )
+
+    usernames = []
+    operations_by_username = {}
+    for operation in plan['operations']:
+        if operation['username'] not in operations_by_username:
+            usernames.append(operation['username'])
+            operations_by_username[operation['username']] = []
+        operations_by_username[operation['username']].append(operation)
+    results_by_username = dict(zip(usernames, _map_concurrently(
+        lambda username: _apply_user_operations(params, operations_by_username[username], check_mode),
+        usernames,
+        params.get('max_workers') or default_max_workers
+    )))
+    results = [results_by_username[operation['username']].pop(0) for operation in plan['operations']]
+
+    failed_results = [result for result in results if result.get('failed')]
+    plan_result = dict(changed=any(result['changed'] for result in results), operations=results)
+    if failed_results:
+        plan_result.update(failed=True, msg='%d of %d operations failed' % (len(failed_results), len(results)))
+    return plan_result
+
+
+def argument_spec():
+    return dict(
+        username=dict(required=False, default=None),
+        users=dict(required=False, default=None, type='list'),
+        users_file=dict(required=False, default=None),
+        users_file_format=dict(required=False, default='auto', choices=['auto', 'csv', 'jsonl', 'ldif']),
+        chunk_size=dict(required=False, default=default_chunk_size, type='int'),
+        private_token=dict(required=True, no_log=True),
+        api_url=dict(required=True),
+        name=dict(required=False, default=None),
+        email=dict(required=False, default=None),
+        password=dict(required=False, default=None, no_log=True),
+        update_password=dict(required=False, default='always', choices=['always', 'on_create']),
+        password_state_file=dict(required=False, default=None),
+        journal_file=dict(required=False, default=None),
+        plan_file=dict(required=False, default=None),
+        apply_plan=dict(required=False, default=None),
+        plan_preconditions=dict(required=False, default='yes', choices=BOOLEANS),
+        user_cache_dir=dict(required=False, default=None),
+        user_cache_max_age=dict(required=False, default=default_user_cache_max_age, type='float'),
+        skype=dict(required=False, default=None),
+        linkedin=dict(required=False, default=None),
+        twitter=dict(required=False, default=None),
+        website_url=dict(required=False, default=None),
+        projects_limit=dict(required=False, default=None),
+        extern_uid=dict(required=False, default=None),
+        provider=dict(required=False, default=None),
+        bio=dict(required=False, default=None),
+        admin=dict(required=False, default=None, choices=BOOLEANS),
+        can_create_group=dict(required=False, default=None, choices=BOOLEANS),
+        ssh_key_title=dict(required=False, default=None),
+        ssh_key=dict(required=None, default=None),
+        ssh_keys=dict(required=False, default=None, type='list'),
+        ssh_keys_exclusive=dict(required=False, default='no', choices=BOOLEANS),
+        state=dict(required=False, default='present', choices=['present', 'absent']),
+        max_workers=dict(required=False, default=default_max_workers, type='int'),
+        http_keep_alive=dict(required=False, default='yes', choices=BOOLEANS),
+        http_engine=dict(required=False, default='threads', choices=['threads', 'event_loop']),
+        max_in_flight=dict(required=False, default=default_max_in_flight, type='int'),
+        rate_limit=dict(required=False, default=None, type='float'),
+        retries=dict(required=False, default=3, type='int'),
+        retry_backoff=dict(required=False, default=0.5, type='float'),
+        retry_jitter=dict(required=False, default=1.0, type='float'),
+        retry_deadline=dict(required=False, default=60.0, type='float'),
+        broker_socket=dict(required=False, default=None),
+        broker_idle_timeout=dict(required=False, default=default_broker_idle_timeout, type='float'),
+        directory_snapshot=dict(required=False, default=None, type='raw'),
+        exclusive=dict(required=False, default='no', choices=BOOLEANS),
+        prune_action=dict(required=False, default='delete', choices=['delete', 'block']),
+        protected_users=dict(required=False, default=[], type='list'),
+        max_deletions=dict(required=False, default=default_max_deletions, type='int'),
+    )
+
+
+required_together = [['ssh_key_title', 'ssh_key']]
+required_one_of = [['username', 'users', 'users_file', 'apply_plan']]
+mutually_exclusive = [['username', 'users', 'users_file', 'apply_plan']]
+boolean_params = ['admin', 'can_create_group', 'ssh_keys_exclusive', 'exclusive', 'plan_preconditions']
+user_boolean_params = ['admin', 'can_create_group', 'ssh_keys_exclusive']
+
+
+def convert_booleans(params, boolean):
+    """converts the yes/no options of params and of its 'users' entries with the given boolean function"""
+    for param_name in boolean_params:
+        if params.get(param_name) is not None:
+            params[param_name] = boolean(params[param_name])
+    for spec in params.get('users') or []:
+        for param_name in user_boolean_params:
+            if isinstance(spec, dict) and spec.get(param_name) is not None:
+                spec[param_name] = boolean(spec[param_name])
+    return params
+
+
+def open_session(params, boolean):
+    """sets up the HTTP transport, rate limiter, retries and local state files of a module run"""
+    _enable_password_store(params['password_state_file'])
+    _enable_journal(params['journal_file'])
+    _enable_user_cache(params['user_cache_dir'], params['api_url'], params['user_cache_max_age'])
+    _enable_retries(params['retries'], params['retry_backoff'], params['retry_jitter'], params['retry_deadline'])
+    if params['broker_socket']:
+        # the broker holds the connections and the rate limit state
+        _enable_broker(params['broker_socket'], params)
+        return
+    _enable_rate_limiter(params['rate_limit'])
+    if params['http_engine'] == 'event_loop':
+        _enable_event_loop_client(params['max_in_flight'])
+    if boolean(params['http_keep_alive']):
+        _enable_connection_pool()
+
+
+def save_session():
+    """writes the local state files, the session stays usable"""
+    if _password_store is not None:
+        _password_store.save()
+    if _journal is not None:
+        _journal.sync()
+
+
+def close_session():
+    _close_broker()
+    _close_connection_pool()
+    _close_password_store()
+    _close_journal()
+    _close_user_cache()
+
+
+def _complete_journal(check_mode):
+    """a bulk run that completed without failures has nothing left to resume"""
+    if _journal is not None and not check_mode:
+        _journal.complete()
+
+
+def run(params, check_mode, directory=None, progress=None):
+    """reconciles the user or users in params and returns the module result. Failures are returned
+       with failed and msg set instead of being raised. progress is called with messages about the
+       progress of a users_file sync
+    """
+    try:
+        if params.get('apply_plan'):
+            return apply_plan(params, check_mode)
+        if not check_mode or not params.get('plan_file'):
+            return _reconcile(params, check_mode, directory, progress)
+
+        _enable_plan(params['api_url'])
+        try:
+            result = _reconcile(params, check_mode, directory, progress)
+            if not result.get('failed'):
+                _plan.save(params['plan_file'])
+                result['plan'] = {'file': params['plan_file'], 'operations': len(_plan.operations)}
+            return result
+        finally:
+            _close_plan()
+    except GitlabModuleInternalException as e:
+        return dict(failed=True, msg=e.message)
+
+
+def _reconcile(params, check_mode, directory, progress):
+    """the module result of the user, users or users_file in params"""
+    if directory is None and params.get('directory_snapshot'):
+        directory = _load_directory_snapshot(params)
+    if params.get('users_file'):
+        result = sync_users_file(params, check_mode, directory, progress)
+        if not result.get('failed'):
+            _complete_journal(check_mode)
+        return result
+    if params.get('exclusive') and params['users'] is None:
+        raise GitlabModuleInternalException('exclusive requires users or users_file')
+    if params['users'] is not None:
+        report = {}
+        results = reconcile_users(params, check_mode, directory, report)
+        pruned = report.get('pruned', [])
+        changed = any(result['changed'] for result in results + pruned)
+        skipped_fetches = sum(result.get('skipped_fetches', 0) for result in results)
+        failed_results = [result for result in results if result.get('failed')]
+        failed_prunes = [result for result in pruned if result.get('failed')]
+        if failed_results or failed_prunes:
+            msg = '%d of %d users failed' % (len(failed_results), len(results))
+            if failed_prunes:
+                msg += ', %d of %d users could not be pruned' % (len(failed_prunes), len(pruned))
+            return dict(
+                failed=True,
+                msg=msg,
+                changed=changed,
+                skipped_fetches=skipped_fetches,
+                users=results,
+                **report
+            )
+        _complete_journal(check_mode)
+        return dict(changed=changed, skipped_fetches=skipped_fetches, users=results, **report)
+
+    changed = False
+    report = {}
+    if params['state'] == 'absent':
+        changed = remove_user(params, check_mode, directory)
+    elif params['state'] == 'present':
+        changed = create_or_update_user(params, check_mode, directory, report)
+    return dict(changed=changed, **report)
+
+
 def main():
     ansible_module = AnsibleModule(
-        argument_spec=dict(
-            username=dict(required=True),
-            private_token=dict(required=True, no_log=True),
-            api_url=dict(required=True),
-            name=dict(required=False, default=None),
-            email=dict(required=False, default=None),
-            password=dict(required=False, default=None, no_log=True),
-            skype=dict(required=False, default=None),
-            linkedin=dict(required=False, default=None),
-            twitter=dict(required=False, default=None),
-            website_url=dict(required=False, default=None),
-            projects_limit=dict(required=False, default=None),
-            extern_uid=dict(required=False, default=None),
-            provider=dict(required=False, default=None),
-            bio=dict(required=False, default=None),
-            admin=dict(required=False, default=None, choices=BOOLEANS),
-            can_create_group=dict(required=False, default=None, choices=BOOLEANS),
-            ssh_key_title=dict(required=False, default=None),
-            ssh_key=dict(required=None, default=None),
-            state=dict(required=False, default='present', choices=['present', 'absent']),
-        ),
-        required_together=[['ssh_key_title', 'ssh_key']],
+        argument_spec=argument_spec(),
+        required_together=required_together,
+        required_one_of=required_one_of,
+        mutually_exclusive=mutually_exclusive,
         supports_check_mode=True
     )
-
-    if 'admin' in ansible_module.params:
-        ansible_module.params['admin'] = ansible_module.boolean(ansible_module.params['admin'])
-    if 'can_create_group' in ansible_module.params:
-        ansible_module.params['can_create_group'] = ansible_module.boolean(ansible_module.params['can_create_group'])
+    params = convert_booleans(ansible_module.params, ansible_module.boolean)
 
     try:
-        changed = False
-        if ansible_module.params['state'] == 'absent':
-            changed = remove_user(ansible_module.params, ansible_module.check_mode)
-        elif ansible_module.params['state'] == 'present':
-            changed = create_or_update_user(ansible_module.params, ansible_module.check_mode)
-        ansible_module.exit_json(changed=changed)
+        open_session(params, ansible_module.boolean)
     except GitlabModuleInternalException as e:
+        close_session()
         ansible_module.fail_json(msg=e.message)
+    try:
+        result = run(params, ansible_module.check_mode, progress=ansible_module.log)
+    finally:
+        close_session()
+
+    if result.get('failed'):
+        ansible_module.fail_json(**result)
+    ansible_module.exit_json(**result)
 
 
 from ansible.module_utils.basic import *
@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+DOCUMENTATION = '''
+---
+module: gitlab_user_facts
+short_description: takes a snapshot of the user accounts of a Gitlab instance
+description:
+  - Walks the user list of Gitlab once and returns a compact snapshot of all accounts, with their emails and the fingerprints
+    of their SSH keys. Give the snapshot to the directory_snapshot option of M(gitlab_user), which then looks up only the
+    accounts it is about to change instead of every account of the play.
+options:
+  private_token:
+    description: The private_token used for API authentication, it must belong to an admin user.
+    required: yes
+    default: none
+    choices: []
+  api_url:
+    description: the URL of the Gitlab API. e.g. U(http://gitlab.somedomain.com/api/v3)
+    required: yes
+    default: none
+    choices: []
+  dest:
+    description:
+      - A local file the snapshot is written to, readable by its owner only. The snapshot is returned as the fact
+        I(gitlab_user_snapshot) if no dest is given. In check mode the snapshot is taken but not written.
+    required: no
+    default: none
+    choices: []
+  include:
+    description: The listings of every user that are part of the snapshot. Every listing costs one request per user.
+    required: no
+    default: [emails, ssh_keys]
+    choices: [emails, ssh_keys]
+  max_workers:
+    description: The maximum number of concurrent requests.
+    required: no
+    default: 4
+    choices: []
+  retries:
+    description:
+      - How often a request that failed with a connection error or with 502, 503 or 504 is sent again, after an exponential
+        backoff from I(retry_backoff) seconds. Requests rejected with 429 Too Many Requests are sent again once the
+        Retry-After of the response passed, regardless of I(retries).
+    required: no
+    default: 3
+    choices: []
+  retry_backoff:
+    description: The seconds to wait before the first retry, doubled with every further retry.
+    required: no
+    default: 0.5
+    choices: []
+  retry_jitter:
+    description: The fraction of the wait before a retry that is random, so concurrent retries don't hit Gitlab at the same time.
+    required: no
+    default: 1.0
+    choices: []
+  retry_deadline:
+    description: The seconds after the first attempt of a request after which it is not retried anymore.
+    required: no
+    default: 60
+    choices: []
+'''
+
+EXAMPLES = '''
+# take a snapshot once per play and hand it to gitlab_user
+- gitlab_user_facts:
+    api_url: https://gitlab-url-internal.somedomain.com/api/v3
+    private_token: 7389rz478
+    dest: /tmp/gitlab_users.json
+  run_once: yes
+
+- gitlab_user:
+    username: "{{ item.username }}"
+    name: "{{ item.name }}"
+    email: "{{ item.email }}"
+    directory_snapshot: /tmp/gitlab_users.json
+    api_url: https://gitlab-url-internal.somedomain.com/api/v3
+    private_token: 7389rz478
+  with_items: "{{ accounts }}"
+'''
+
+import ansible.module_utils.urls as urls
+import base64
+import binascii
+import email.utils
+import hashlib
+import httplib
+import multiprocessing.pool
+import os
+import random
+import re
+import socket
+import tempfile
+import time
+import urllib
+import urllib2
+import urlparse
+
+items_per_page = 100
+default_max_workers = 4
+default_retries = 3
+default_retry_backoff = 0.5
+default_retry_jitter = 1.0
+default_retry_deadline = 60.0
+max_retry_backoff = 30.0
+max_rate_limited_attempts = 10
+retryable_statuses = (502, 503, 504)
+snapshot_user_params = [
+    'id', 'username', 'name', 'email', 'state', 'is_admin', 'can_create_group', 'skype', 'linkedin', 'twitter',
+    'website_url', 'projects_limit', 'extern_uid', 'provider', 'bio'
+]
+
+
+class GitlabModuleInternalException(Exception):
+    pass
+
+
+class GitlabHttpError(GitlabModuleInternalException):
+    """an error response of the Gitlab API, with its status code and headers"""
+
+    def __init__(self, status, reason, headers, body):
+        GitlabModuleInternalException.__init__(self, '%d %s\n%s' % (status, reason, body))
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+
+class _RetryPolicy(object):
+    """when and how long to wait before sending a request again, as the _RetryPolicy of gitlab_user"""
+
+    def __init__(self, retries=default_retries, backoff=default_retry_backoff, jitter=default_retry_jitter,
+                 deadline=default_retry_deadline, max_backoff=max_retry_backoff):
+        self.retries = retries
+        self.backoff = backoff
+        self.jitter = jitter
+        self.deadline = deadline
+        self.max_backoff = max_backoff
+
+    @staticmethod
+    def is_transient(error):
+        return not isinstance(error, GitlabHttpError) or error.status in retryable_statuses
+
+    def delay(self, attempt):
+        """exponential backoff, of which the 'jitter' fraction is random so concurrent retries spread out"""
+        delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+        return delay * (1 - self.jitter * random.random())
+
+    def should_retry(self, error, attempt, started, delay):
+        """whether to send the request again after waiting delay seconds, which must end before the deadline"""
+        return self.is_transient(error) and attempt < self.retries \
+            and time.time() + delay - started < self.deadline
+
+
+_retry_policy = _RetryPolicy()
+
+
+def _enable_retries(retries, backoff, jitter, deadline):
+    global _retry_policy
+    _retry_policy = _RetryPolicy(retries, backoff, jitter, deadline)
+
+
+def _retry_after_seconds(headers, attempt):
+    """the seconds given in the Retry-After header, as number or HTTP date, doubling from one second without it"""
+    retry_after = headers.get('Retry-After') if headers else None
+    if retry_after:
+        if retry_after.strip().isdigit():
+            return int(retry_after)
+        retry_date = email.utils.parsedate_tz(retry_after)
+        if retry_date:
+            return max(email.utils.mktime_tz(retry_date) - time.time(), 0)
+    return min(2 ** attempt, 60)
+
+
+def _send_request_once(url, private_token):
+    try:
+        response_reader = urls.open_url(url, method='GET', headers={'PRIVATE-TOKEN': private_token})
+        response_headers = response_reader.headers
+        response_body = response_reader.read()
+        response_reader.close()
+        return response_headers, response_body
+    except urllib2.HTTPError as e:
+        raise GitlabHttpError(e.code, e.reason, e.headers, e.read())
+    except urllib2.URLError as e:
+        raise GitlabModuleInternalException(str(e.reason))
+    except (httplib.HTTPException, socket.error) as e:
+        raise GitlabModuleInternalException(str(e))
+
+
+def _send_request(url, private_token):
+    """GETs url. Requests rejected with 429 Too Many Requests are sent again once Retry-After passed,
+       connection errors and retryable_statuses as long as the _retry_policy allows
+    """
+    started = time.time()
+    attempt = 0
+    rate_limited_attempts = 0
+    while True:
+        try:
+            return _send_request_once(url, private_token)
+        except GitlabModuleInternalException as e:
+            if isinstance(e, GitlabHttpError) and e.status == 429 \
+                    and rate_limited_attempts + 1 < max_rate_limited_attempts:
+                rate_limited_attempts += 1
+                time.sleep(_retry_after_seconds(e.headers, rate_limited_attempts))
+                continue
+            delay = _retry_policy.delay(attempt)
+            if not _retry_policy.should_retry(e, attempt, started, delay):
+                raise
+            time.sleep(delay)
+            attempt += 1
+
+
+def _set_query_params(url, params):
+    scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+    query_params = [(key, params.get(key, value)) for key, value in urlparse.parse_qsl(query)]
+    present_keys = set(key for key, value in query_params)
+    query_params.extend(sorted((key, value) for key, value in params.items() if key not in present_keys))
+    return urlparse.urlunsplit((scheme, netloc, path, urllib.urlencode(query_params), fragment))
+
+
+def _next_page_url(url, headers):
+    next_page = headers.get('X-Next-Page')
+    if next_page:
+        return _set_query_params(url, {'page': next_page})
+
+    link = headers.get('Link')
+    if link:
+        for link_part in link.split(','):
+            match = re.match(r'\s*<([^>]+)>\s*;.*\brel="next"', link_part)
+            if match:
+                return match.group(1)
+
+    return None
+
+
+def _map_concurrently(function, items, max_workers):
+    if len(items) < 2:
+        return [function(item) for item in items]
+
+    pool = multiprocessing.pool.ThreadPool(min(max_workers, len(items)))
+    try:
+        return pool.map(function, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _list_all(url, private_token, max_workers=default_max_workers):
+    """fetches every page of a listing. The remaining pages are fetched concurrently once the first
+       response tells their number in X-Total-Pages, otherwise they are walked page by page. A record
+       that moved to another page in the meantime may be listed twice
+    """
+    url = _set_query_params(url, {'per_page': items_per_page})
+    headers, body = _send_request(url, private_token)
+    records = json.loads(body)
+
+    total_pages = headers.get('X-Total-Pages')
+    if total_pages:
+        page_urls = [_set_query_params(url, {'page': page}) for page in range(2, int(total_pages) + 1)]
+        for page_headers, page_body in _map_concurrently(
+                lambda page_url: _send_request(page_url, private_token), page_urls, max_workers):
+            records.extend(json.loads(page_body))
+    else:
+        next_url = _next_page_url(url, headers)
+        while next_url:
+            headers, body = _send_request(next_url, private_token)
+            records.extend(json.loads(body))
+            next_url = _next_page_url(next_url, headers)
+
+    return records
+
+
+def _ssh_key_fingerprint(ssh_key):
+    """the same fingerprint gitlab_user compares keys by: the key type and the md5 of the decoded blob"""
+    fields = ssh_key.split()
+    if len(fields) < 2:
+        return ' '.join(fields)
+    try:
+        blob = base64.b64decode(fields[1])
+    except (TypeError, binascii.Error):
+        return ' '.join(fields[:2])
+    digest = hashlib.md5(blob).hexdigest()
+    return '%s %s' % (fields[0], ':'.join(digest[i:i + 2] for i in range(0, len(digest), 2)))
+
+
+def _snapshot_user(api_url, private_token, user, include):
+    snapshot_user = dict((param_name, user[param_name]) for param_name in snapshot_user_params if param_name in user)
+    if 'emails' in include:
+        snapshot_user['emails'] = [
+            {'id': email['id'], 'email': email['email']}
+            for email in _list_all('%s/users/%d/emails' % (api_url, user['id']), private_token)
+        ]
+    if 'ssh_keys' in include:
+        snapshot_user['ssh_keys'] = [
+            {'id': key['id'], 'title': key['title'], 'fingerprint': _ssh_key_fingerprint(key['key'])}
+            for key in _list_all('%s/users/%d/keys' % (api_url, user['id']), private_token)
+        ]
+    return snapshot_user
+
+
+def take_snapshot(api_url, private_token, include, max_workers=default_max_workers):
+    # in ascending id order, users created during the sweep only show up on the last pages
+    users_url = _set_query_params('%s/users' % api_url, {'order_by': 'id', 'sort': 'asc'})
+    users = dict((user['id'], user) for user in _list_all(users_url, private_token, max_workers))
+    return {
+        'api_url': api_url,
+        'taken_at': time.time(),
+        'users': _map_concurrently(
+            lambda user: _snapshot_user(api_url, private_token, user, include),
+            [users[user_id] for user_id in sorted(users)],
+            max_workers
+        )
+    }
+
+
+def write_snapshot(path, snapshot):
+    """replaces the file atomically, readable by its owner only"""
+    path = os.path.expanduser(path)
+    snapshot_dir = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(snapshot_dir):
+        os.makedirs(snapshot_dir, 0o700)
+    file_descriptor, temp_path = tempfile.mkstemp(dir=snapshot_dir)
+    with os.fdopen(file_descriptor, 'w') as snapshot_file:
+        json.dump(snapshot, snapshot_file, separators=(',', ':'), sort_keys=True)
+    os.rename(temp_path, path)
+
+
+def main():
+    ansible_module = AnsibleModule(
+        argument_spec=dict(
+            private_token=dict(required=True, no_log=True),
+            api_url=dict(required=True),
+            dest=dict(required=False, default=None),
+            include=dict(required=False, default=['emails', 'ssh_keys'], type='list'),
+            max_workers=dict(required=False, default=default_max_workers, type='int'),
+            retries=dict(required=False, default=default_retries, type='int'),
+            retry_backoff=dict(required=False, default=default_retry_backoff, type='float'),
+            retry_jitter=dict(required=False, default=default_retry_jitter, type='float'),
+            retry_deadline=dict(required=False, default=default_retry_deadline, type='float'),
+        ),
+        supports_check_mode=True
+    )
+
+    unknown_listings = sorted(set(ansible_module.params['include']) - set(['emails', 'ssh_keys']))
+    if unknown_listings:
+        ansible_module.fail_json(msg='include supports emails and ssh_keys, not %s' % ', '.join(unknown_listings))
+
+    _enable_retries(
+        ansible_module.params['retries'],
+        ansible_module.params['retry_backoff'],
+        ansible_module.params['retry_jitter'],
+        ansible_module.params['retry_deadline']
+    )
+    try:
+        snapshot = take_snapshot(
+            ansible_module.params['api_url'],
+            ansible_module.params['private_token'],
+            ansible_module.params['include'],
+            ansible_module.params['max_workers']
+        )
+    except GitlabModuleInternalException as e:
+        ansible_module.fail_json(msg=e.message)
+
+    if ansible_module.params['dest']:
+        if not ansible_module.check_mode:
+            write_snapshot(ansible_module.params['dest'], snapshot)
+        ansible_module.exit_json(changed=False, dest=ansible_module.params['dest'], users=len(snapshot['users']))
+    ansible_module.exit_json(changed=False, ansible_facts={'gitlab_user_snapshot': snapshot})
+
+
+from ansible.module_utils.basic import *
+if __name__ == '__main__':
+    main()
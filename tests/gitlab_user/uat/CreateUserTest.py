@@ -12,7 +12,7 @@ class CreateUserTest(unittest.TestCase):
     @mock.patch('library.gitlab_user._send_request')
     def testCreateOrUpdateUser_ifNoneExists_sendCreateRequest(self, send_request_mock):
         send_request_mock.side_effect = (
-            ({'status': '200 OK'}, '[{"username":"someuser"}]'),
+            ({'status': '200 OK'}, '[]'),
             ({'status': '201 Created'}, '{"username":"testusername","id":12}')
         )
         result = library.gitlab_user.create_or_update_user(
@@ -30,7 +30,7 @@ class CreateUserTest(unittest.TestCase):
 
     @mock.patch('library.gitlab_user._send_request')
     def testCreateOrUpdateUser_ifNoneExistsAndCheckMode_dontSendRequest(self, send_request_mock):
-        send_request_mock.return_value = {'status': '200 OK'}, '[{"username":"someuser"}]'
+        send_request_mock.return_value = {'status': '200 OK'}, '[]'
         result = library.gitlab_user.create_or_update_user(
             {
                 'username': 'testusername',
@@ -47,7 +47,7 @@ class CreateUserTest(unittest.TestCase):
     @mock.patch('library.gitlab_user._send_request')
     def testCreateOrUpdateUser_ifNoneExistsAndSshKeyGiven_sendCreateUserAndAddSshKeyRequests(self, send_request_mock):
         send_request_mock.side_effect = (
-            ({'status': '200 OK'}, '[{"username":"someuser"}]'),
+            ({'status': '200 OK'}, '[]'),
             ({'status': '201 Created'}, '{"username":"testusername","id":12}'),
             ({'status': '201 Created'}, '{"id":1,"key":"ghkjfasdkjadh","title":"sometitle"}')
         )
@@ -71,7 +71,7 @@ class CreateUserTest(unittest.TestCase):
             self,
             send_request_mock):
 
-        send_request_mock.return_value = {'status': '200 OK'}, '[{"username":"someuser"}]'
+        send_request_mock.return_value = {'status': '200 OK'}, '[]'
         result = library.gitlab_user.create_or_update_user(
             {
                 'username': 'testusername',
@@ -94,7 +94,7 @@ class CreateUserTest(unittest.TestCase):
     )
     def testCreateOrUpdateUser_ifRequiredArgumentIsMissing_throwExceptionDontSendRequest(self, input_arguments):
         with mock.patch('library.gitlab_user._send_request') as send_request_mock:
-            send_request_mock.return_value = {'status': '200 OK'}, '[{"username":"someuser"}]'
+            send_request_mock.return_value = {'status': '200 OK'}, '[]'
             arguments = {'api_url': 'http://something.com/api/v3', 'private_token': 'abc123'}
             arguments.update(input_arguments)
             with self.assertRaises(library.gitlab_user.GitlabModuleInternalException):
@@ -109,7 +109,7 @@ class CreateUserTest(unittest.TestCase):
             self, input_arguments):
 
         with mock.patch('library.gitlab_user._send_request') as send_request_mock:
-            send_request_mock.return_value = {'status': '200 OK'}, '[{"username":"someuser"}]'
+            send_request_mock.return_value = {'status': '200 OK'}, '[]'
             arguments = {'api_url': 'http://something.com/api/v3', 'private_token': 'abc123'}
             arguments.update(input_arguments)
             with self.assertRaises(library.gitlab_user.GitlabModuleInternalException):
@@ -118,7 +118,7 @@ class CreateUserTest(unittest.TestCase):
     @mock.patch('library.gitlab_user._send_request')
     def testCreateOrUpdateUser_ifNoneExistsAndAdminGiven_sendCreateUserRequests(self, send_request_mock):
         send_request_mock.side_effect = (
-            ({'status': '200 OK'}, '[{"username":"someuser"}]'),
+            ({'status': '200 OK'}, '[]'),
             ({'status': '201 Created'}, '{"username":"testusername","id":12,"is_admin":true}')
         )
         result = library.gitlab_user.create_or_update_user(
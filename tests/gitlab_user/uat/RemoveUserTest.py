@@ -9,7 +9,7 @@ class RemoveUserTest(unittest.TestCase):
 
     @mock.patch('library.gitlab_user._send_request')
     def testDeleteUser_ifNoneExists_dontSendDeleteRequest(self, send_request_mock):
-        send_request_mock.return_value = {'status': '200 OK'}, '[{"username":"someuser"}]'
+        send_request_mock.return_value = {'status': '200 OK'}, '[]'
         result = library.gitlab_user.remove_user(
             {
                 'username': 'testusername',
@@ -38,7 +38,7 @@ class RemoveUserTest(unittest.TestCase):
 
     @mock.patch('library.gitlab_user._send_request')
     def testDeleteUser_ifNoneExistsAndCheckMode_dontSendDeleteRequest(self, send_request_mock):
-        send_request_mock.return_value = {'status': '200 OK'}, '[{"username":"someuser"}]'
+        send_request_mock.return_value = {'status': '200 OK'}, '[]'
         result = library.gitlab_user.remove_user(
             {
                 'username': 'testusername',
@@ -1,5 +1,9 @@
 # -*- coding: utf-8 -*-
 
+import json
+import os
+import shutil
+import tempfile
 import unittest
 import mock
 import library.gitlab_user
@@ -90,7 +94,8 @@ class UpdateUserTest(unittest.TestCase):
     def testCreateOrUpdateUser_ifUserIsChangedOtherThanPassword_sendUpdateRequest(self, send_request_mock):
         send_request_mock.side_effect = (
             ({'status': '200 OK'},
-             '[{"username":"testusername","id":12,"name":"Test","email":"someone@something.com"}]'),
+             '[{"username":"testusername","id":12,"name":"Test","email":"someone@something.com",'
+             '"skype":"someskype"}]'),
             ({'status': '200 OK'},
              '{"username":"testusername","id":12,"name":"someOtherName","email":"someone@something.com"}')
         )
@@ -100,12 +105,18 @@ class UpdateUserTest(unittest.TestCase):
                 'name': 'someOtherName',
                 'email': 'someone@something.com',
                 'password': '9876abc123',
+                'skype': 'someskype',
                 'api_url': 'http://something.com/api/v3',
                 'private_token': 'abc123'
             },
             False
         )
         self.assertTrue(result)
+        self.assertEqual('PUT', send_request_mock.call_args_list[1][0][0])
+        self.assertEqual(
+            {'name': 'someOtherName', 'password': '9876abc123'},
+            json.loads(send_request_mock.call_args_list[1][0][3])
+        )
 
     @mock.patch('library.gitlab_user._send_request')
     def testCreateOrUpdateUser_ifUserIsChangedOtherThanPasswordAndCheckMode_dontSendUpdateRequest(
@@ -170,14 +181,61 @@ class UpdateUserTest(unittest.TestCase):
         )
         self.assertFalse(result)
 
+    @mock.patch('library.gitlab_user._send_request')
+    def testCreateOrUpdateUser_ifSshKeyOnlyDiffersInCommentAndWhitespace_dontSendAnyUpdateRequest(
+            self,
+            send_request_mock):
+
+        send_request_mock.side_effect = (
+            ({'status': '200 OK'},
+             '[{"username":"testusername","id":12,"name":"Test","email":"someone@something.com"}]'),
+            ({'status': '200 OK'}, '[{"id":1,"title":"key1","key":"ssh-rsa AAAAB3NzaC1yc2EAAAADAQABAAAAgQC9"}]')
+        )
+        result = library.gitlab_user.create_or_update_user(
+            {
+                'username': 'testusername',
+                'name': 'Test',
+                'email': 'someone@something.com',
+                'ssh_key_title': 'key1',
+                'ssh_key': 'ssh-rsa AAAAB3NzaC1yc2EAAAADAQABAAAAgQC9 someone@somehost\n',
+                'api_url': 'http://something.com/api/v3',
+                'private_token': 'abc123'
+            },
+            False
+        )
+        self.assertFalse(result)
+        self.assertEqual(2, send_request_mock.call_count)
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testCreateOrUpdateUser_ifSshKeyExistsUnderOtherTitle_dontUploadItAgain(self, send_request_mock):
+        send_request_mock.side_effect = (
+            ({'status': '200 OK'},
+             '[{"username":"testusername","id":12,"name":"Test","email":"someone@something.com"}]'),
+            ({'status': '200 OK'}, '[{"id":1,"title":"key1","key":"nvireqvtgzoufigru"}]')
+        )
+        result = library.gitlab_user.create_or_update_user(
+            {
+                'username': 'testusername',
+                'name': 'Test',
+                'email': 'someone@something.com',
+                'ssh_key_title': 'key2',
+                'ssh_key': 'nvireqvtgzoufigru',
+                'api_url': 'http://something.com/api/v3',
+                'private_token': 'abc123'
+            },
+            False
+        )
+        self.assertFalse(result)
+        self.assertEqual(2, send_request_mock.call_count)
+
     @mock.patch('library.gitlab_user._send_request')
     def testCreateOrUpdateUser_ifSshKeyGivenAndKeyChanged_deleteKeyAndCreateNew(self, send_request_mock):
         send_request_mock.side_effect = (
             ({'status': '200 OK'},
              '[{"username":"testusername","id":12,"name":"Test","email":"someone@something.com"}]'),
             ({'status': '200 OK'}, '[{"id":1,"title":"key1","key":"nvireqvtgzoufigru"}]'),
-            ({'status': '200 OK'}, ''),
-            ({'status': '201 Created'}, '')
+            ({'status': '201 Created'}, ''),
+            ({'status': '200 OK'}, '')
         )
         result = library.gitlab_user.create_or_update_user(
             {
@@ -216,13 +274,13 @@ class UpdateUserTest(unittest.TestCase):
         self.assertTrue(result)
 
     @mock.patch('library.gitlab_user._send_request')
-    def testCreateOrUpdateUser_ifEmailGivenAndChanged_deleteEmailFromUserResponseAndSendNew(self, send_request_mock):
+    def testCreateOrUpdateUser_ifEmailGivenAndChanged_sendNewEmailAndDeleteOldOne(self, send_request_mock):
         send_request_mock.side_effect = (
             ({'status': '200 OK'},
              '[{"username":"testusername","id":12,"name":"Test","email":"someone@something.com"}]'),
             ({'status': '200 OK'}, '[{"id":1,"email":"someone@something.com"}]'),
-            ({'status': '200 OK'}, ''),
-            ({'status': '201 Created'}, '')
+            ({'status': '201 Created'}, '{"id":2,"email":"someoneelse@somethingelse.net"}'),
+            ({'status': '200 OK'}, '')
         )
         result = library.gitlab_user.create_or_update_user(
             {
@@ -235,3 +293,129 @@ class UpdateUserTest(unittest.TestCase):
             False
         )
         self.assertTrue(result)
+        self.assertEqual(4, send_request_mock.call_count)
+        self.assertEqual('POST', send_request_mock.call_args_list[2][0][0])
+        self.assertEqual('http://something.com/api/v3/users/12/emails/1', send_request_mock.call_args_list[3][0][1])
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testCreateOrUpdateUser_ifPasswordGivenAndUpdatePasswordOnCreate_dontSendUpdateRequest(self, send_request_mock):
+        send_request_mock.return_value = \
+            {'status': '200 OK'}, \
+            '[{"username":"testusername","id":12,"name":"Test","email":"someone@something.com"}]'
+        result = library.gitlab_user.create_or_update_user(
+            {
+                'username': 'testusername',
+                'name': 'Test',
+                'email': 'someone@something.com',
+                'password': '9876abc123',
+                'update_password': 'on_create',
+                'api_url': 'http://something.com/api/v3',
+                'private_token': 'abc123'
+            },
+            False
+        )
+        self.assertFalse(result)
+        self.assertEqual(1, send_request_mock.call_count)
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testCreateOrUpdateUser_ifPasswordGivenAndStateFileKnowsIt_sendUpdateRequestOnlyOnce(self, send_request_mock):
+        state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, state_dir)
+        send_request_mock.side_effect = (
+            ({'status': '200 OK'},
+             '[{"username":"testusername","id":12,"name":"Test","email":"someone@something.com"}]'),
+            ({'status': '200 OK'}, '{"username":"testusername","id":12,"name":"Test","email":"someone@something.com"}'),
+            ({'status': '200 OK'},
+             '[{"username":"testusername","id":12,"name":"Test","email":"someone@something.com"}]')
+        )
+        params = {
+            'username': 'testusername',
+            'name': 'Test',
+            'email': 'someone@something.com',
+            'password': '9876abc123',
+            'api_url': 'http://something.com/api/v3',
+            'private_token': 'abc123'
+        }
+
+        for expected_result in (True, False):
+            library.gitlab_user._enable_password_store(os.path.join(state_dir, 'passwords.json'))
+            try:
+                self.assertEqual(expected_result, library.gitlab_user.create_or_update_user(params, False))
+            finally:
+                library.gitlab_user._close_password_store()
+
+        self.assertEqual(3, send_request_mock.call_count)
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testCreateOrUpdateUser_ifReportGiven_addChangedFields(self, send_request_mock):
+        send_request_mock.return_value = \
+            {'status': '200 OK'}, \
+            '[{"username":"testusername","id":12,"name":"Test","email":"someone@something.com","is_admin":true}]'
+        report = {}
+        result = library.gitlab_user.create_or_update_user(
+            {
+                'username': 'testusername',
+                'name': 'someOtherName',
+                'admin': False,
+                'password': '9876abc123',
+                'api_url': 'http://something.com/api/v3',
+                'private_token': 'abc123'
+            },
+            True,
+            report=report
+        )
+        self.assertTrue(result)
+        self.assertEqual(
+            {
+                'changes': {
+                    'name': {'before': 'Test', 'after': 'someOtherName'},
+                    'admin': {'before': True, 'after': False},
+                    'password': {'before': None, 'after': '********'}
+                },
+                'skipped_fetches': 2
+            },
+            report
+        )
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testCreateOrUpdateUser_ifEmailChangedAndApiV4_changeEmailWithUserUpdate(self, send_request_mock):
+        send_request_mock.side_effect = (
+            ({'status': '200 OK'},
+             '[{"username":"testusername","id":12,"name":"Test","email":"someone@something.com"}]'),
+            ({'status': '200 OK'},
+             '{"username":"testusername","id":12,"name":"Test","email":"someoneelse@somethingelse.net"}')
+        )
+        result = library.gitlab_user.create_or_update_user(
+            {
+                'username': 'testusername',
+                'name': 'Test',
+                'email': 'someoneelse@somethingelse.net',
+                'api_url': 'http://something.com/api/v4',
+                'private_token': 'abc123'
+            },
+            False
+        )
+        self.assertTrue(result)
+        self.assertEqual(2, send_request_mock.call_count)
+        self.assertEqual('PUT', send_request_mock.call_args_list[1][0][0])
+        self.assertEqual(
+            {'email': 'someoneelse@somethingelse.net', 'skip_reconfirmation': True},
+            json.loads(send_request_mock.call_args_list[1][0][3])
+        )
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testCreateOrUpdateUser_ifEmailChangedAndCheckMode_dontSendUpdateRequest(self, send_request_mock):
+        send_request_mock.return_value = \
+            {'status': '200 OK'}, \
+            '[{"username":"testusername","id":12,"name":"Test","email":"someone@something.com"}]'
+        result = library.gitlab_user.create_or_update_user(
+            {
+                'username': 'testusername',
+                'email': 'someoneelse@somethingelse.net',
+                'api_url': 'http://something.com/api/v3',
+                'private_token': 'abc123'
+            },
+            True
+        )
+        self.assertTrue(result)
+        self.assertEqual(1, send_request_mock.call_count)
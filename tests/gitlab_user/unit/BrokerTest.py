@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import mock
+import library.gitlab_user
+
+
+class BrokerTest(unittest.TestCase):
+
+    users_url = 'http://somedomain.com/api/v3/users?per_page=100'
+
+    def setUp(self):
+        self.socket_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.socket_dir, 'broker.sock')
+        self.server = library.gitlab_user._BrokerServer(self.socket_path, idle_timeout=0.2, cache_max_age=60)
+        self.server.poll_interval = 0.05
+        self.server_thread = threading.Thread(target=self.server.serve)
+        self.server_thread.start()
+        self.client = library.gitlab_user._BrokerClient(self.socket_path, {})
+
+    def tearDown(self):
+        self.client.close()
+        self.server_thread.join()
+        shutil.rmtree(self.socket_dir)
+
+    @mock.patch('library.gitlab_user._send_rate_limited_request_directly')
+    def testListingsCachedUntilChanged(self, send_mock):
+        send_mock.return_value = {'status': '200 OK', 'x-total-pages': '1'}, '[{"id":1}]'
+
+        first = self.client.request('GET', self.users_url, {'PRIVATE-TOKEN': '576932'})
+        second = self.client.request('GET', self.users_url, {'PRIVATE-TOKEN': '576932'})
+        self.client.request('GET', self.users_url, {'PRIVATE-TOKEN': 'other'})
+        self.client.request('PUT', 'http://somedomain.com/api/v3/users/1', {'PRIVATE-TOKEN': '576932'}, '{}')
+        self.client.request('GET', self.users_url, {'PRIVATE-TOKEN': '576932'})
+
+        self.assertEqual(({'status': '200 OK', 'x-total-pages': '1'}, '[{"id":1}]'), first)
+        self.assertEqual(first, second)
+        self.assertEqual(
+            ['GET', 'GET', 'PUT', 'GET'],
+            [call[0][0] for call in send_mock.call_args_list]
+        )
+        self.assertEqual('{}', send_mock.call_args_list[2][0][3])
+
+    @mock.patch('library.gitlab_user._send_rate_limited_request_directly')
+    def testConditionalRequestsAndOtherResourcesNotCached(self, send_mock):
+        send_mock.return_value = {'status': '200 OK'}, '[]'
+
+        for url, headers in (
+                (self.users_url, {'PRIVATE-TOKEN': '576932', 'If-None-Match': 'W/"abc"'}),
+                ('http://somedomain.com/api/v3/projects', {'PRIVATE-TOKEN': '576932'})):
+            self.client.request('GET', url, headers)
+            self.client.request('GET', url, headers)
+
+        self.assertEqual(4, send_mock.call_count)
+
+    @mock.patch('library.gitlab_user._send_rate_limited_request_directly')
+    def testErrorsArePassedOn(self, send_mock):
+        send_mock.side_effect = (
+            library.gitlab_user.GitlabHttpError(404, 'Not Found', {'content-type': 'application/json'}, 'no user'),
+            library.gitlab_user.GitlabModuleInternalException('connection refused')
+        )
+
+        with self.assertRaises(library.gitlab_user.GitlabHttpError) as ex:
+            self.client.request('DELETE', 'http://somedomain.com/api/v3/users/1', {'PRIVATE-TOKEN': '576932'})
+        self.assertEqual(404, ex.exception.status)
+        self.assertEqual('no user', ex.exception.body)
+        with self.assertRaises(library.gitlab_user.GitlabModuleInternalException) as ex:
+            self.client.request('GET', self.users_url, {'PRIVATE-TOKEN': '576932'})
+        self.assertEqual('connection refused', ex.exception.message)
+
+    @mock.patch('library.gitlab_user._send_rate_limited_request_directly')
+    def testStopAfterIdleTimeout(self, send_mock):
+        send_mock.return_value = {'status': '200 OK'}, '[]'
+        self.client.request('GET', self.users_url, {'PRIVATE-TOKEN': '576932'})
+        time.sleep(0.3)
+        self.assertTrue(self.server_thread.is_alive())  # the client is still connected
+
+        self.client.close()
+        self.server_thread.join(2)
+
+        self.assertFalse(self.server_thread.is_alive())
+        self.assertFalse(os.path.exists(self.socket_path))
+
+    @mock.patch('library.gitlab_user._broker_client')
+    def testSendRequestGoesThroughBroker(self, broker_client_mock):
+        broker_client_mock.request.return_value = {'status': '200 OK'}, '[]'
+
+        self.assertEqual(
+            ({'status': '200 OK'}, '[]'),
+            library.gitlab_user._send_request('GET', self.users_url, {'PRIVATE-TOKEN': '576932'})
+        )
+        broker_client_mock.request.assert_called_once_with('GET', self.users_url, {'PRIVATE-TOKEN': '576932'}, None)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+import errno
+import socket
+import unittest
+import httplib
+import mock
+import library.gitlab_user
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = library.gitlab_user._ConnectionPool()
+
+    @staticmethod
+    def create_response(status, reason, body, will_close=False, headers=()):
+        response = mock.MagicMock()
+        response.status = status
+        response.reason = reason
+        response.will_close = will_close
+        response.read.return_value = body
+        response.getheaders.return_value = list(headers)
+        return response
+
+    @mock.patch('httplib.HTTPSConnection')
+    def testReuseConnectionForSameHost(self, connection_mock):
+        connection_mock.return_value.getresponse.side_effect = (
+            self.create_response(200, 'OK', '[]', headers=[('x-total-pages', '1')]),
+            self.create_response(201, 'Created', '{}')
+        )
+
+        first = self.pool.request('GET', 'https://somedomain.com/api/v3/users?page=1', {'PRIVATE-TOKEN': '576932'})
+        second = self.pool.request('POST', 'https://somedomain.com/api/v3/users', {'PRIVATE-TOKEN': '576932'}, '{}')
+
+        self.assertEqual(({'x-total-pages': '1', 'status': '200 OK'}, '[]'), first)
+        self.assertEqual(({'status': '201 Created'}, '{}'), second)
+        self.assertEqual(1, connection_mock.call_count)
+        self.assertEqual(('somedomain.com', 443), connection_mock.call_args_list[0][0])
+        self.assertEqual(
+            ('GET', '/api/v3/users?page=1', None, {'PRIVATE-TOKEN': '576932'}),
+            connection_mock.return_value.request.call_args_list[0][0]
+        )
+        self.assertEqual(
+            ('POST', '/api/v3/users', '{}', {'PRIVATE-TOKEN': '576932'}),
+            connection_mock.return_value.request.call_args_list[1][0]
+        )
+
+    @mock.patch('httplib.HTTPConnection')
+    def testServerClosesConnection_dontReuseIt(self, connection_mock):
+        connection_mock.return_value.getresponse.return_value = self.create_response(200, 'OK', '[]', True)
+
+        self.pool.request('GET', 'http://somedomain.com:8080/api/v3/users', {})
+        self.pool.request('GET', 'http://somedomain.com:8080/api/v3/users', {})
+
+        self.assertEqual(2, connection_mock.call_count)
+        self.assertEqual(('somedomain.com', 8080), connection_mock.call_args_list[0][0])
+
+    @mock.patch('httplib.HTTPConnection')
+    def testStaleIdleConnection_retryOnNewConnection(self, connection_mock):
+        stale_connection = mock.MagicMock()
+        stale_connection.getresponse.side_effect = httplib.BadStatusLine('')
+        fresh_connection = mock.MagicMock()
+        fresh_connection.getresponse.return_value = self.create_response(200, 'OK', '[]')
+        connection_mock.return_value = fresh_connection
+        self.pool._release(('http', 'somedomain.com', 80), stale_connection)
+
+        result = self.pool.request('GET', 'http://somedomain.com/api/v3/users', {})
+
+        self.assertEqual(({'status': '200 OK'}, '[]'), result)
+        self.assertEqual(1, stale_connection.close.call_count)
+
+    @mock.patch('httplib.HTTPConnection')
+    def testResetIdleConnection_retryOnNewConnection(self, connection_mock):
+        stale_connection = mock.MagicMock()
+        stale_connection.request.side_effect = socket.error(errno.EPIPE, 'Broken pipe')
+        connection_mock.return_value.getresponse.return_value = self.create_response(201, 'Created', '{}')
+        self.pool._release(('http', 'somedomain.com', 80), stale_connection)
+
+        result = self.pool.request('POST', 'http://somedomain.com/api/v3/users', {}, '{}')
+
+        self.assertEqual(({'status': '201 Created'}, '{}'), result)
+        self.assertEqual(1, connection_mock.return_value.request.call_count)
+
+    @mock.patch('httplib.HTTPConnection')
+    def testTimeoutOnReusedConnection_dontSendAgain(self, connection_mock):
+        slow_connection = mock.MagicMock()
+        slow_connection.getresponse.side_effect = socket.timeout('timed out')
+        self.pool._release(('http', 'somedomain.com', 80), slow_connection)
+
+        with self.assertRaises(socket.timeout):
+            self.pool.request('POST', 'http://somedomain.com/api/v3/users', {}, '{}')
+
+        self.assertEqual(0, connection_mock.call_count)
+        self.assertEqual(1, slow_connection.close.call_count)
+
+    @mock.patch('httplib.HTTPConnection')
+    def testResponseBrokeOffOnReusedConnection_dontSendAgain(self, connection_mock):
+        broken_connection = mock.MagicMock()
+        broken_connection.getresponse.return_value.read.side_effect = socket.error(errno.ECONNRESET, 'reset')
+        self.pool._release(('http', 'somedomain.com', 80), broken_connection)
+
+        with self.assertRaises(socket.error):
+            self.pool.request('POST', 'http://somedomain.com/api/v3/users', {}, '{}')
+
+        self.assertEqual(0, connection_mock.call_count)
+        self.assertEqual(1, broken_connection.close.call_count)
+
+    @mock.patch('httplib.HTTPConnection')
+    def testErrorResponse(self, connection_mock):
+        connection_mock.return_value.getresponse.return_value = \
+            self.create_response(500, 'Internal Server Error', 'some message')
+
+        with self.assertRaises(library.gitlab_user.GitlabModuleInternalException) as ex:
+            self.pool.request('GET', 'http://somedomain.com/api/v3/users', {})
+        self.assertEqual('500 Internal Server Error\nsome message', ex.exception.message)
+
+    @mock.patch('httplib.HTTPConnection')
+    def testRedirect_leaveToOpenUrl(self, connection_mock):
+        connection_mock.return_value.getresponse.return_value = self.create_response(301, 'Moved Permanently', '')
+
+        self.assertIsNone(self.pool.request('GET', 'http://somedomain.com/api/v3/users', {}))
+
+    @mock.patch('httplib.HTTPConnection')
+    def testNotModified_returnResponse(self, connection_mock):
+        connection_mock.return_value.getresponse.return_value = \
+            self.create_response(304, 'Not Modified', '', headers=[('etag', 'W/"abc"')])
+
+        self.assertEqual(
+            ({'etag': 'W/"abc"', 'status': '304 Not Modified'}, ''),
+            self.pool.request('GET', 'http://somedomain.com/api/v3/users', {'If-None-Match': 'W/"abc"'})
+        )
+
+    @mock.patch('urllib.getproxies')
+    def testAcceptsOnlyUnproxiedHttpUrls(self, getproxies_mock):
+        getproxies_mock.return_value = {'http': 'http://proxy:3128'}
+
+        self.assertTrue(self.pool.accepts('https://somedomain.com/api/v3'))
+        self.assertFalse(self.pool.accepts('http://somedomain.com/api/v3'))
+        self.assertFalse(self.pool.accepts('ftp://somedomain.com/api/v3'))
+
+    @mock.patch('urllib.getproxies')
+    @mock.patch('library.gitlab_user.ssl')
+    def testNoSslContext_leaveHttpsToOpenUrl(self, ssl_mock, getproxies_mock):
+        del ssl_mock.create_default_context
+        getproxies_mock.return_value = {}
+
+        self.assertFalse(self.pool.accepts('https://somedomain.com/api/v3'))
+        self.assertTrue(self.pool.accepts('http://somedomain.com/api/v3'))
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+import imp
+import os
+import unittest
+import mock
+
+action_plugin = imp.load_source(
+    'gitlab_user_controller_action_plugin',
+    os.path.join(os.path.dirname(__file__), '..', '..', '..', 'action_plugins', 'gitlab_user_controller.py')
+)
+
+
+class ControllerActionPluginTest(unittest.TestCase):
+
+    def setUp(self):
+        self.args = {
+            'username': 'testusername',
+            'name': 'Test',
+            'email': 'someone@something.com',
+            'api_url': 'http://something.com/api/v3',
+            'private_token': 'abc123'
+        }
+
+    @staticmethod
+    def create_action(args, check_mode=False):
+        task = mock.MagicMock()
+        task.args = args
+        task.async_val = 0
+        play_context = mock.MagicMock()
+        play_context.check_mode = check_mode
+        connection = mock.MagicMock()
+        connection._shell.tmpdir = None
+        return action_plugin.ActionModule(task, connection, play_context, None, None, None)
+
+    def testModuleParams_fillInDefaultsAndConvert(self):
+        params = action_plugin.module_params(dict(self.args, admin='yes', max_workers='8', ssh_keys_exclusive='no'))
+
+        self.assertEqual(True, params['admin'])
+        self.assertEqual(8, params['max_workers'])
+        self.assertEqual(False, params['ssh_keys_exclusive'])
+        self.assertEqual('present', params['state'])
+        self.assertIsNone(params['users'])
+
+    def testModuleParams_invalidArguments(self):
+        for args, message in (
+                (dict(self.args, unknown='x'), 'Unsupported parameters for (gitlab_user) module: unknown'),
+                (dict(self.args, api_url=None), 'missing required arguments: api_url'),
+                (dict(self.args, state='gone'), 'value of state must be one of: present, absent, got: gone'),
+                (dict(self.args, ssh_key='abc'), 'parameters are required together: ssh_key_title, ssh_key'),
+                (dict(self.args, users=[]), 'parameters are mutually exclusive: username|users|users_file|apply_plan')):
+            with self.assertRaises(action_plugin.ArgumentError) as ex:
+                action_plugin.module_params(args)
+            self.assertEqual(message, str(ex.exception))
+
+    @mock.patch.object(action_plugin.gitlab_user, 'close_session')
+    @mock.patch.object(action_plugin.gitlab_user, 'open_session')
+    @mock.patch.object(action_plugin.gitlab_user, '_send_request')
+    def testEveryTask_ownSessionThroughDefaultBroker(self, send_request_mock, open_session_mock, close_session_mock):
+        send_request_mock.return_value = \
+            {'status': '200 OK'}, '[{"username":"testusername","id":12,"name":"Test","email":"someone@something.com"}]'
+
+        first = self.create_action(self.args).run(task_vars={})
+        second = self.create_action(self.args).run(task_vars={})
+
+        self.assertEqual({'changed': False, 'changes': {}, 'skipped_fetches': 2}, first)
+        self.assertEqual(first, second)
+        self.assertEqual(2, open_session_mock.call_count)
+        self.assertEqual(2, close_session_mock.call_count)
+        self.assertEqual(
+            action_plugin.default_broker_socket,
+            open_session_mock.call_args_list[0][0][0]['broker_socket']
+        )
+
+    @mock.patch.object(action_plugin.gitlab_user, 'close_session')
+    @mock.patch.object(action_plugin.gitlab_user, 'open_session')
+    def testBrokerSocketGiven_useIt(self, open_session_mock, close_session_mock):
+        open_session_mock.side_effect = action_plugin.gitlab_user.GitlabModuleInternalException('cannot start')
+
+        result = self.create_action(dict(self.args, broker_socket='/tmp/other.sock')).run(task_vars={})
+
+        self.assertEqual({'failed': True, 'msg': 'cannot start'}, result)
+        self.assertEqual('/tmp/other.sock', open_session_mock.call_args[0][0]['broker_socket'])
+        self.assertEqual(1, close_session_mock.call_count)
+
+    def testInvalidArguments_fail(self):
+        result = self.create_action(dict(self.args, state='gone')).run(task_vars={})
+
+        self.assertTrue(result['failed'])
+        self.assertIn('value of state must be one of', result['msg'])
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import library.gitlab_user
+
+
+class DiffUserTest(unittest.TestCase):
+
+    def test_returnAllParams_ifUserIsNone(self):
+        raw_data = {"username": "username", "name": "name", "password": "password", "email": "email"}
+        result = library.gitlab_user._diff_user(raw_data, None)
+        self.assertEqual(raw_data, result)
+
+    def test_returnChangedParamsOnly(self):
+        user = {"username": "username", "name": "somename", "bio": "somebio", "skype": "someskype", "is_admin": True}
+        raw_data = {
+            "username": "username",
+            "name": "othername",
+            "bio": "somebio",
+            "skype": "someskype",
+            "twitter": "sometwitter",
+            "password": "password",
+            "admin": True
+        }
+        result = library.gitlab_user._diff_user(raw_data, user)
+        self.assertEqual({"name": "othername", "twitter": "sometwitter", "password": "password"}, result)
+
+    def test_returnAdminAsRequestParam_ifIsAdminChanged(self):
+        result = library.gitlab_user._diff_user({"admin": False}, {"is_admin": True})
+        self.assertEqual({"admin": False}, result)
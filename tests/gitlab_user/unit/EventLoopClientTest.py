@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import BaseHTTPServer
+import SocketServer
+import socket
+import threading
+import library.gitlab_user
+
+
+class _RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        if self.path.startswith('/chunked'):
+            self.send_response(200)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            self.wfile.write('4\r\n[{"i\r\n8\r\nd": 12}]\r\n0\r\n\r\n')
+        elif self.path.startswith('/error'):
+            self.send_response(500, 'Internal Server Error')
+            self.send_header('Content-Length', '12')
+            self.end_headers()
+            self.wfile.write('some message')
+        else:
+            body = '{"path": "%s"}' % self.path
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('X-Total-Pages', '3')
+            self.end_headers()
+            self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(201, 'Created')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class EventLoopClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = _Server(('127.0.0.1', 0), _RequestHandler)
+        self.server.connections = set()
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.client = library.gitlab_user._EventLoopClient(max_in_flight=4)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def testRequest(self):
+        headers, body = self.client.request('GET', self.url + '/users?page=2', {'PRIVATE-TOKEN': '576932'})
+
+        self.assertEqual('200 OK', headers['status'])
+        self.assertEqual('3', headers['x-total-pages'])
+        self.assertEqual('{"path": "/users?page=2"}', body)
+
+    def testRequestAll_reuseConnections(self):
+        requests = [('GET', '%s/users?page=%d' % (self.url, page), {}) for page in range(1, 21)]
+
+        responses = self.client.request_all(requests)
+
+        self.assertEqual(['{"path": "/users?page=%d"}' % page for page in range(1, 21)],
+                         [body for headers, body in responses])
+        self.assertLessEqual(len(self.server.connections), 4)
+
+    def testChunkedResponse(self):
+        headers, body = self.client.request('GET', self.url + '/chunked', {})
+
+        self.assertEqual('[{"id": 12}]', body)
+
+    def testPostBody(self):
+        headers, body = self.client.request('POST', self.url + '/users', {'Content-Type': 'application/json'}, '{}')
+
+        self.assertEqual('201 Created', headers['status'])
+        self.assertEqual('{}', body)
+
+    def testErrorResponse(self):
+        with self.assertRaises(library.gitlab_user.GitlabModuleInternalException) as ex:
+            self.client.request('GET', self.url + '/error', {})
+        self.assertEqual('500 Internal Server Error\nsome message', ex.exception.message)
+
+    def testConnectionRefused(self):
+        unused_socket = socket.socket()
+        unused_socket.bind(('127.0.0.1', 0))
+        unused_port = unused_socket.getsockname()[1]
+        unused_socket.close()
+
+        with self.assertRaises(library.gitlab_user.GitlabModuleInternalException):
+            self.client.request('GET', 'http://127.0.0.1:%d/users' % unused_port, {})
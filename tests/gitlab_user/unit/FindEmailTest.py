@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import mock
+import library.gitlab_user
+
+
+class FindEmailTest(unittest.TestCase):
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testAllOK(self, send_request_mock):
+        send_request_mock.return_value = \
+            {'status': '200 OK'}, '[{"id":1,"email":"anything@tada.com"},{"id":2,"email":"someone@something.com"}]'
+        result = library.gitlab_user._find_email('http://somedomain.com/api/v3', '576932', 1, 'someone@something.com')
+        self.assertEqual({'id': 2, 'email': 'someone@something.com'}, result)
+        self.assert_send_request_call(send_request_mock)
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testRequestFailed(self, send_request_mock):
+        send_request_mock.return_value = {'status': '500 Internal Server Error'}, ''
+        result = library.gitlab_user._find_email('http://somedomain.com/api/v3', '576932', 1, 'someone@something.com')
+        self.assertIsNone(result)
+        self.assert_send_request_call(send_request_mock)
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testEmailNotFound(self, send_request_mock):
+        send_request_mock.return_value = \
+            {'status': '200 OK'}, '[{"id":1,"email":"anything@tada.com"}]'
+        result = library.gitlab_user._find_email('http://somedomain.com/api/v3', '576932', 1, 'someone@something.com')
+        self.assertIsNone(result)
+        self.assert_send_request_call(send_request_mock)
+
+    def assert_send_request_call(self, send_request_mock):
+        self.assertEqual(
+            'http://somedomain.com/api/v3/users/1/emails?per_page=100',
+            send_request_mock.call_args_list[0][1]['url']
+        )
+        self.assertEqual({'PRIVATE-TOKEN': '576932'}, send_request_mock.call_args_list[0][1]['headers'])
+        self.assertEqual('GET', send_request_mock.call_args_list[0][1]['method'])
+
+
+
+class UserResourcesTest(unittest.TestCase):
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testFetchEmailsOnce(self, send_request_mock):
+        send_request_mock.return_value = \
+            {'status': '200 OK'}, '[{"id":1,"email":"anything@tada.com"},{"id":2,"email":"someone@something.com"}]'
+        resources = library.gitlab_user._UserResources('http://somedomain.com/api/v3', '576932', 1)
+
+        self.assertEqual({'id': 2, 'email': 'someone@something.com'}, resources.find_email('Someone@something.com'))
+        self.assertIsNone(resources.find_email('someone@else.com'))
+        self.assertEqual(1, send_request_mock.call_count)
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testReplaceEmail(self, send_request_mock):
+        send_request_mock.return_value = {'status': '200 OK'}, '[{"id":1,"email":"anything@tada.com"}]'
+        resources = library.gitlab_user._UserResources('http://somedomain.com/api/v3', '576932', 1)
+
+        resources.replace_email(resources.find_email('anything@tada.com'), {'id': 3, 'email': 'someone@else.com'})
+
+        self.assertEqual([{'id': 3, 'email': 'someone@else.com'}], resources.emails())
+        self.assertEqual(1, send_request_mock.call_count)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import mock
+import library.gitlab_user
+
+RSA_KEY = 'ssh-rsa AAAAB3NzaC1yc2EAAAADAQABAAAAgQC9'
+RSA_KEY_FINGERPRINT = library.gitlab_user._ssh_key_fingerprint(RSA_KEY)
+
+
+class SshKeyFingerprintTest(unittest.TestCase):
+
+    def testMd5OfDecodedBlob(self):
+        self.assertEqual(
+            'ssh-rsa 0d:37:84:48:5f:91:07:7a:4d:8c:59:23:e6:a6:9b:06',
+            library.gitlab_user._ssh_key_fingerprint(RSA_KEY)
+        )
+
+    def testCommentAndWhitespaceIgnored(self):
+        self.assertEqual(
+            RSA_KEY_FINGERPRINT,
+            library.gitlab_user._ssh_key_fingerprint('  %s someone@somehost\n' % RSA_KEY)
+        )
+
+    def testKeyTypeMatters(self):
+        self.assertNotEqual(
+            RSA_KEY_FINGERPRINT,
+            library.gitlab_user._ssh_key_fingerprint(RSA_KEY.replace('ssh-rsa', 'ssh-dss'))
+        )
+
+    def testUndecodableKey(self):
+        self.assertEqual('nvireqvtgzoufigru', library.gitlab_user._ssh_key_fingerprint('nvireqvtgzoufigru\n'))
+        self.assertEqual('ssh-rsa abc', library.gitlab_user._ssh_key_fingerprint('ssh-rsa abc comment'))
+
+
+class FindSshKeyTest(unittest.TestCase):
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testAllOK(self, send_request_mock):
+        send_request_mock.return_value = \
+            {'status': '200 OK'}, \
+            '[{"id":1,"title":"key4","key":"vireaofhudsagfrio"},{"id":14,"title":"key1","key":"%s comment"}]' % RSA_KEY
+        result = library.gitlab_user._find_ssh_key('http://somedomain.com/api/v3', '576932', 12, RSA_KEY_FINGERPRINT)
+        self.assertEqual({"id": 14, "title": "key1", "key": RSA_KEY + " comment"}, result)
+        self.assert_send_request_call(send_request_mock)
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testRequestFailed(self, send_request_mock):
+        send_request_mock.return_value = {'status': '500 Internal Server Error'}, ''
+        result = library.gitlab_user._find_ssh_key('http://somedomain.com/api/v3', '576932', 12, RSA_KEY_FINGERPRINT)
+        self.assertIsNone(result)
+        self.assert_send_request_call(send_request_mock)
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testKeyNotFound(self, send_request_mock):
+        send_request_mock.return_value = \
+            {'status': '200 OK'}, \
+            '[{"id":1,"title":"key4","key":"vireaofhudsagfrio"}]'
+        result = library.gitlab_user._find_ssh_key('http://somedomain.com/api/v3', '576932', 12, RSA_KEY_FINGERPRINT)
+        self.assertIsNone(result)
+        self.assert_send_request_call(send_request_mock)
+
+    def assert_send_request_call(self, send_request_mock):
+        self.assertEquals('GET', send_request_mock.call_args_list[0][1]['method'])
+        self.assertEquals(
+            'http://somedomain.com/api/v3/users/12/keys?per_page=100',
+            send_request_mock.call_args_list[0][1]['url']
+        )
+        self.assertEquals({'PRIVATE-TOKEN': '576932'}, send_request_mock.call_args_list[0][1]['headers'])
@@ -28,14 +28,43 @@ class FindUserByNameTest(unittest.TestCase):
 
     @mock.patch('library.gitlab_user._send_request')
     def testUserNotFound(self, send_request_mock):
+        send_request_mock.return_value = {'status': '200 OK'}, '[]'
+        result = library.gitlab_user._find_user_by_name('http://somedomain.com/api/v3', '576932', 'testusername')
+        self.assertIsNone(result)
+        self.assertEquals(1, send_request_mock.call_count)
+        self.assert_send_request_call(send_request_mock)
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testUsernameFilterIgnored_fallBackToSearch(self, send_request_mock):
+        send_request_mock.side_effect = (
+            ({'status': '200 OK'}, '[{"username":"someone","id":3,"name":"Test","email":"anyone@something.com"}]'),
+            ({'status': '200 OK'}, '[{"username":"testusername","id":12,"name":"Test","email":"someone@something.com"}]')
+        )
+        result = library.gitlab_user._find_user_by_name('http://somedomain.com/api/v3', '576932', 'testusername')
+        self.assertEqual(
+            {"username": "testusername", "id": 12, "name": "Test", "email": "someone@something.com"},
+            result
+        )
+        self.assert_send_request_call(send_request_mock)
+        self.assertEquals(
+            'http://somedomain.com/api/v3/users?search=testusername&per_page=100',
+            send_request_mock.call_args_list[1][1]['url']
+        )
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testUsernameFilterIgnoredAndUserNotFound(self, send_request_mock):
         send_request_mock.return_value = \
             {'status': '200 OK'}, \
             '[{"username":"someone","id":3,"name":"Test","email":"anyone@something.com"}]'
         result = library.gitlab_user._find_user_by_name('http://somedomain.com/api/v3', '576932', 'testusername')
         self.assertIsNone(result)
+        self.assertEquals(2, send_request_mock.call_count)
         self.assert_send_request_call(send_request_mock)
 
     def assert_send_request_call(self, send_request_mock):
         self.assertEquals('GET', send_request_mock.call_args_list[0][1]['method'])
-        self.assertEquals('http://somedomain.com/api/v3/users', send_request_mock.call_args_list[0][1]['url'])
+        self.assertEquals(
+            'http://somedomain.com/api/v3/users?username=testusername',
+            send_request_mock.call_args_list[0][1]['url']
+        )
         self.assertEquals({'PRIVATE-TOKEN': '576932'}, send_request_mock.call_args_list[0][1]['headers'])
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import mock
+import library.gitlab_user
+
+
+class IteratePagesTest(unittest.TestCase):
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testFollowNextPageHeader(self, send_request_mock):
+        send_request_mock.side_effect = (
+            ({'status': '200 OK', 'X-Next-Page': '2'}, '[{"id":1},{"id":2}]'),
+            ({'status': '200 OK', 'X-Next-Page': ''}, '[{"id":3}]')
+        )
+        result = list(library.gitlab_user._iterate_pages('http://somedomain.com/api/v3/users', '576932'))
+
+        self.assertEqual([{'id': 1}, {'id': 2}, {'id': 3}], result)
+        self.assertEqual(
+            'http://somedomain.com/api/v3/users?per_page=100',
+            send_request_mock.call_args_list[0][1]['url']
+        )
+        self.assertEqual(
+            'http://somedomain.com/api/v3/users?per_page=100&page=2',
+            send_request_mock.call_args_list[1][1]['url']
+        )
+        self.assertEqual({'PRIVATE-TOKEN': '576932'}, send_request_mock.call_args_list[1][1]['headers'])
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testFollowLinkHeader(self, send_request_mock):
+        send_request_mock.side_effect = (
+            ({'status': '200 OK',
+              'link': '<http://somedomain.com/api/v3/users?page=2&per_page=100>; rel="next", '
+                      '<http://somedomain.com/api/v3/users?page=1&per_page=100>; rel="first"'},
+             '[{"id":1}]'),
+            ({'status': '200 OK'}, '[{"id":2}]')
+        )
+        result = list(library.gitlab_user._iterate_pages('http://somedomain.com/api/v3/users', '576932'))
+
+        self.assertEqual([{'id': 1}, {'id': 2}], result)
+        self.assertEqual(
+            'http://somedomain.com/api/v3/users?page=2&per_page=100',
+            send_request_mock.call_args_list[1][1]['url']
+        )
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testStopIteratingEarly_dontRequestRemainingPages(self, send_request_mock):
+        send_request_mock.return_value = {'status': '200 OK', 'X-Next-Page': '2'}, '[{"id":1},{"id":2}]'
+
+        for record in library.gitlab_user._iterate_pages('http://somedomain.com/api/v3/users', '576932'):
+            if record['id'] == 2:
+                break
+
+        self.assertEqual(1, send_request_mock.call_count)
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testRequestFailed(self, send_request_mock):
+        send_request_mock.return_value = {'status': '500 Internal Server Error'}, ''
+        result = list(library.gitlab_user._iterate_pages('http://somedomain.com/api/v3/users?search=abc', '576932'))
+
+        self.assertEqual([], result)
+        self.assertEqual(
+            'http://somedomain.com/api/v3/users?search=abc&per_page=100',
+            send_request_mock.call_args_list[0][1]['url']
+        )
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import mock
+import library.gitlab_user
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'state', 'journal')
+        self.params = {'username': 'first', 'name': 'First', 'api_url': 'http://somedomain.com/api/v3/',
+                       'private_token': '576932'}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def testRecordedEntries_containedAfterReopening(self):
+        journal = library.gitlab_user._Journal(self.path)
+        journal.record(self.params, True)
+        journal.close()
+
+        journal = library.gitlab_user._Journal(self.path)
+        try:
+            self.assertTrue(journal.contains(dict(self.params, private_token='other')))
+            self.assertTrue(journal.contains(dict(self.params, api_url='http://somedomain.com/api/v3')))
+            self.assertFalse(journal.contains(dict(self.params, name='Other')))
+            self.assertEqual(0o600, os.stat(self.path).st_mode & 0o777)
+        finally:
+            journal.close()
+
+    def testLineCutOffByCrash_dropLine(self):
+        journal = library.gitlab_user._Journal(self.path)
+        journal.record(self.params, True)
+        journal.close()
+        with open(self.path, 'a') as journal_file:
+            journal_file.write('{"entry": "abc')
+
+        journal = library.gitlab_user._Journal(self.path)
+        journal.record(dict(self.params, username='second'), False)
+        journal.close()
+
+        with open(self.path) as journal_file:
+            lines = [json.loads(line) for line in journal_file]
+        self.assertEqual(3, len(lines))
+        self.assertEqual([True, False], [line['changed'] for line in lines[1:]])
+
+    @mock.patch('os.fsync')
+    def testSyncInBatches(self, fsync_mock):
+        journal = library.gitlab_user._Journal(self.path, sync_every=3)
+        for number in range(7):
+            journal.record(dict(self.params, username='user%d' % number), False)
+        self.assertEqual(3, fsync_mock.call_count)  # the header, then every 3rd entry
+
+        journal.close()
+        self.assertEqual(4, fsync_mock.call_count)
+
+    def testJournalUsedByAnotherRun_raiseError(self):
+        journal = library.gitlab_user._Journal(self.path)
+        try:
+            with self.assertRaises(library.gitlab_user.GitlabModuleInternalException) as ex:
+                library.gitlab_user._Journal(self.path)
+            self.assertEqual('journal_file %s is used by another run' % self.path, ex.exception.message)
+        finally:
+            journal.close()
+
+
+class ResumeBulkRunTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.params = dict((param_name, None) for param_name in library.gitlab_user.argument_spec())
+        self.params.update({
+            'users_file': os.path.join(self.tmp_dir, 'users.jsonl'),
+            'journal_file': os.path.join(self.tmp_dir, 'journal'),
+            'chunk_size': 2,
+            'state': 'present',
+            'max_workers': 1,
+            'api_url': 'http://somedomain.com/api/v3',
+            'private_token': '576932'
+        })
+        with open(self.params['users_file'], 'w') as users_file:
+            for number in range(1, 6):
+                users_file.write('{"username": "user%d", "name": "Renamed"}\n' % number)
+        self.users = [{'username': 'user%d' % number, 'id': number, 'name': 'Old'} for number in range(1, 6)]
+
+    def tearDown(self):
+        library.gitlab_user._close_journal()
+        shutil.rmtree(self.tmp_dir)
+
+    @mock.patch('library.gitlab_user._list_all_users')
+    @mock.patch('library.gitlab_user._send_request')
+    def testRerun_reconcileRemainingUsersOnly(self, send_request_mock, list_all_users_mock):
+        list_all_users_mock.return_value = self.users
+        send_request_mock.side_effect = lambda method, url, headers, body=None, created_check=None: \
+            ({'status': '400 Bad Request'}, '') if url.endswith('/4') else \
+            ({'status': '200 OK'}, '{"id":%s,"username":"user%s","name":"Renamed"}' % (url[-1], url[-1]))
+        library.gitlab_user._enable_journal(self.params['journal_file'])
+
+        first = library.gitlab_user.run(self.params, False)
+        library.gitlab_user._close_journal()
+
+        send_request_mock.reset_mock()
+        send_request_mock.side_effect = None
+        send_request_mock.return_value = {'status': '200 OK'}, '{"id":4,"username":"user4","name":"Renamed"}'
+        library.gitlab_user._enable_journal(self.params['journal_file'])
+
+        second = library.gitlab_user.run(self.params, False)
+
+        self.assertTrue(first['failed'])
+        self.assertFalse(second.get('failed'))
+        self.assertEqual(4, second['users_file']['journaled'])
+        self.assertEqual(1, second['users_file']['changed'])
+        self.assertEqual(['http://somedomain.com/api/v3/users/4'],
+                         [call[0][1] for call in send_request_mock.call_args_list])
+        self.assertEqual(0, len(library.gitlab_user._journal))  # completed, the next run starts over
+
+    @mock.patch('library.gitlab_user._list_all_users')
+    @mock.patch('library.gitlab_user._send_request')
+    def testCheckMode_dontRecord(self, send_request_mock, list_all_users_mock):
+        list_all_users_mock.return_value = self.users
+        library.gitlab_user._enable_journal(self.params['journal_file'])
+
+        result = library.gitlab_user.run(self.params, True)
+
+        self.assertEqual(5, result['users_file']['changed'])
+        self.assertEqual(0, len(library.gitlab_user._journal))
+        self.assertEqual(0, send_request_mock.call_count)
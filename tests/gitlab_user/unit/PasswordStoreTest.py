@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+import library.gitlab_user
+
+
+class PasswordStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+        self.state_file = os.path.join(self.state_dir, 'state', 'passwords.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.state_dir)
+
+    def testRememberedPasswordMatches(self):
+        password_store = library.gitlab_user._PasswordStore(self.state_file)
+        password_store.remember('http://somedomain.com/api/v3/', 'testusername', '9876abc123')
+        password_store.save()
+
+        password_store = library.gitlab_user._PasswordStore(self.state_file)
+        self.assertTrue(password_store.matches('http://somedomain.com/api/v3', 'testusername', '9876abc123'))
+        self.assertFalse(password_store.matches('http://somedomain.com/api/v3', 'testusername', 'other'))
+        self.assertFalse(password_store.matches('http://somedomain.com/api/v3', 'otheruser', '9876abc123'))
+
+    def testStoreSaltedHashOnlyAndReadableByOwner(self):
+        password_store = library.gitlab_user._PasswordStore(self.state_file)
+        password_store.remember('http://somedomain.com/api/v3', 'testusername', '9876abc123')
+        password_store.remember('http://somedomain.com/api/v3', 'otheruser', '9876abc123')
+        password_store.save()
+
+        with open(self.state_file) as state_file:
+            content = state_file.read()
+        stored_hashes = json.loads(content)
+        self.assertNotIn('9876abc123', content)
+        self.assertNotEqual(
+            stored_hashes['http://somedomain.com/api/v3 testusername'],
+            stored_hashes['http://somedomain.com/api/v3 otheruser']
+        )
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(self.state_file).st_mode))
+
+    def testForget(self):
+        password_store = library.gitlab_user._PasswordStore(self.state_file)
+        password_store.remember('http://somedomain.com/api/v3', 'testusername', '9876abc123')
+        password_store.forget('http://somedomain.com/api/v3', 'testusername')
+
+        self.assertFalse(password_store.matches('http://somedomain.com/api/v3', 'testusername', '9876abc123'))
+
+    def testUnchangedStore_dontWriteFile(self):
+        library.gitlab_user._PasswordStore(self.state_file).save()
+
+        self.assertFalse(os.path.exists(self.state_file))
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import mock
+import library.gitlab_user
+
+RSA_KEY = 'ssh-rsa AAAAB3NzaC1yc2EAAAADAQABAAAAgQC9'
+OTHER_KEY = 'ssh-rsa AAAAB3NzaC1yc2EAAAADAQABAAAAgQC8'
+
+
+class PlanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.plan_file = os.path.join(self.tmp_dir, 'plan.json')
+        self.params = dict((param_name, None) for param_name in library.gitlab_user.argument_spec())
+        self.params.update({
+            'state': 'present',
+            'max_workers': 1,
+            'plan_preconditions': True,
+            'api_url': 'http://somedomain.com/api/v3',
+            'private_token': '576932'
+        })
+        self.requests = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def respond(self, responses):
+        def send_request(method, url, headers, body=None, created_check=None):
+            self.requests.append((method, url, json.loads(body) if body else None))
+            return responses[(method, url)]
+        return send_request
+
+    def write_plan(self, operations, api_url='http://somedomain.com/api/v3'):
+        with open(self.plan_file, 'w') as plan_file:
+            json.dump({'api_url': api_url, 'created_at': 0, 'operations': operations}, plan_file)
+
+    @mock.patch('library.gitlab_user._list_all_users')
+    @mock.patch('library.gitlab_user._send_request')
+    def testCheckMode_writePlan(self, send_request_mock, list_all_users_mock):
+        list_all_users_mock.return_value = [
+            {'username': 'existing', 'id': 3, 'name': 'Existing', 'email': 'existing@something.com', 'is_admin': False},
+            {'username': 'obsolete', 'id': 4, 'name': 'Obsolete', 'email': 'obsolete@something.com'}
+        ]
+        send_request_mock.side_effect = self.respond({
+            ('GET', 'http://somedomain.com/api/v3/users/3/keys?per_page=100'):
+                ({'status': '200 OK'}, '[{"id":7,"title":"laptop","key":"%s"}]' % OTHER_KEY)
+        })
+
+        result = library.gitlab_user.run(
+            dict(self.params, plan_file=self.plan_file, users=[
+                {'username': 'existing', 'name': 'Renamed', 'admin': True, 'email': 'new@something.com',
+                 'ssh_keys': [{'title': 'laptop', 'key': RSA_KEY}]},
+                {'username': 'newuser', 'name': 'New', 'email': 'new@something.com', 'password': 'abc123yz'},
+                {'username': 'obsolete', 'state': 'absent'}
+            ]),
+            True
+        )
+
+        self.assertEqual({'file': self.plan_file, 'operations': 3}, result['plan'])
+        with open(self.plan_file) as plan_file:
+            plan = json.load(plan_file)
+        self.assertEqual('http://somedomain.com/api/v3', plan['api_url'])
+        self.assertEqual(
+            [{'username': 'existing', 'action': 'update', 'user_id': 3,
+              'fields': {'name': 'Renamed', 'admin': True},
+              'before': {'name': 'Existing', 'is_admin': False, 'email': 'existing@something.com'},
+              'add_ssh_keys': [{'title': 'laptop', 'key': RSA_KEY}],
+              'delete_ssh_keys': [{'id': 7, 'title': 'laptop',
+                                   'fingerprint': library.gitlab_user._ssh_key_fingerprint(OTHER_KEY)}],
+              'email': 'new@something.com'},
+             {'username': 'newuser', 'action': 'create',
+              'fields': {'username': 'newuser', 'name': 'New', 'email': 'new@something.com', 'password': 'abc123yz'}},
+             {'username': 'obsolete', 'action': 'delete', 'user_id': 4}],
+            plan['operations']
+        )
+        self.assertEqual(0o600, os.stat(self.plan_file).st_mode & 0o777)
+        self.assertEqual(['GET'], [request[0] for request in self.requests])
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testApplyPlan_checkPreconditionsAndWrite(self, send_request_mock):
+        self.write_plan([
+            {'username': 'existing', 'action': 'update', 'user_id': 3, 'fields': {'name': 'Renamed'},
+             'before': {'name': 'Existing'}, 'add_ssh_keys': [{'title': 'laptop', 'key': RSA_KEY}]},
+            {'username': 'newuser', 'action': 'create', 'fields': {'username': 'newuser', 'name': 'New'}},
+            {'username': 'obsolete', 'action': 'delete', 'user_id': 4}
+        ])
+        send_request_mock.side_effect = self.respond({
+            ('GET', 'http://somedomain.com/api/v3/users/3'):
+                ({'status': '200 OK'}, '{"id":3,"username":"existing","name":"Existing"}'),
+            ('PUT', 'http://somedomain.com/api/v3/users/3'):
+                ({'status': '200 OK'}, '{"id":3,"username":"existing","name":"Renamed"}'),
+            ('POST', 'http://somedomain.com/api/v3/users/3/keys'): ({'status': '201 Created'}, ''),
+            ('GET', 'http://somedomain.com/api/v3/users?username=newuser'): ({'status': '200 OK'}, '[]'),
+            ('POST', 'http://somedomain.com/api/v3/users'):
+                ({'status': '201 Created'}, '{"id":5,"username":"newuser","name":"New"}'),
+            ('GET', 'http://somedomain.com/api/v3/users/4'):
+                ({'status': '200 OK'}, '{"id":4,"username":"obsolete"}'),
+            ('DELETE', 'http://somedomain.com/api/v3/users/4'): ({'status': '200 OK'}, '')
+        })
+
+        result = library.gitlab_user.run(dict(self.params, apply_plan=self.plan_file), False)
+
+        self.assertEqual(
+            {'changed': True, 'operations': [
+                {'username': 'existing', 'action': 'update', 'changed': True},
+                {'username': 'newuser', 'action': 'create', 'changed': True},
+                {'username': 'obsolete', 'action': 'delete', 'changed': True}
+            ]},
+            result
+        )
+        self.assertEqual(('PUT', 'http://somedomain.com/api/v3/users/3', {'name': 'Renamed'}), self.requests[1])
+        self.assertEqual(7, len(self.requests))
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testUserChangedSincePlan_failWithoutWriting(self, send_request_mock):
+        self.write_plan([{'username': 'existing', 'action': 'update', 'user_id': 3, 'fields': {'name': 'Renamed'},
+                          'before': {'name': 'Existing'}}])
+        send_request_mock.side_effect = self.respond({
+            ('GET', 'http://somedomain.com/api/v3/users/3'):
+                ({'status': '200 OK'}, '{"id":3,"username":"existing","name":"Changed by someone"}')
+        })
+
+        result = library.gitlab_user.run(dict(self.params, apply_plan=self.plan_file), False)
+
+        self.assertTrue(result['failed'])
+        self.assertEqual('name of user existing changed since the plan was made', result['operations'][0]['msg'])
+        self.assertEqual(1, len(self.requests))
+
+    @mock.patch('library.gitlab_user._perform_request')
+    def testUserDeletedSincePlan_failWithoutWriting(self, perform_request_mock):
+        self.write_plan([{'username': 'existing', 'action': 'update', 'user_id': 3, 'fields': {'name': 'Renamed'},
+                          'before': {'name': 'Existing'}}])
+        perform_request_mock.side_effect = \
+            library.gitlab_user.GitlabHttpError(404, 'Not Found', {}, '{"message":"404 User Not Found"}')
+
+        result = library.gitlab_user.run(dict(self.params, apply_plan=self.plan_file), False)
+
+        self.assertTrue(result['failed'])
+        self.assertEqual(
+            'user existing was deleted or renamed since the plan was made',
+            result['operations'][0]['msg']
+        )
+        self.assertEqual(1, perform_request_mock.call_count)
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testWithoutPreconditions_onlyWrite(self, send_request_mock):
+        self.write_plan([
+            {'username': 'existing', 'action': 'update', 'user_id': 3, 'fields': {},
+             'before': {'email': 'old@something.com'},
+             'delete_ssh_keys': [{'id': 7, 'title': 'laptop', 'fingerprint': 'ssh-rsa 00'}]},
+            {'username': 'obsolete', 'action': 'block', 'user_id': 4, 'before': {'state': 'active'}}
+        ])
+        send_request_mock.side_effect = self.respond({
+            ('DELETE', 'http://somedomain.com/api/v3/users/3/keys/7'): ({'status': '200 OK'}, ''),
+            ('PUT', 'http://somedomain.com/api/v3/users/4/block'): ({'status': '200 OK'}, 'true')
+        })
+
+        result = library.gitlab_user.run(
+            dict(self.params, apply_plan=self.plan_file, plan_preconditions=False), False
+        )
+
+        self.assertFalse(result.get('failed'))
+        self.assertEqual(['DELETE', 'PUT'], [request[0] for request in self.requests])
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testCheckMode_dontApply(self, send_request_mock):
+        self.write_plan([{'username': 'obsolete', 'action': 'delete', 'user_id': 4}])
+
+        result = library.gitlab_user.run(dict(self.params, apply_plan=self.plan_file), True)
+
+        self.assertEqual([{'username': 'obsolete', 'action': 'delete', 'changed': True}], result['operations'])
+        self.assertEqual(0, send_request_mock.call_count)
+
+    def testPlanOfOtherGitlab_fail(self):
+        self.write_plan([], api_url='http://other.com/api/v3')
+
+        result = library.gitlab_user.run(dict(self.params, apply_plan=self.plan_file), False)
+
+        self.assertEqual(
+            {'failed': True,
+             'msg': 'apply_plan was made for http://other.com/api/v3, not for http://somedomain.com/api/v3'},
+            result
+        )
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import mock
+import library.gitlab_user
+
+
+class PruneUsersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.params = dict((param_name, None) for param_name in library.gitlab_user.argument_spec())
+        self.params.update({
+            'users': [{'username': 'declared'}, {'username': 'leaver', 'state': 'absent'}],
+            'exclusive': True,
+            'prune_action': 'delete',
+            'protected_users': ['root', '*-bot'],
+            'state': 'present',
+            'max_workers': 3,
+            'api_url': 'http://somedomain.com/api/v3',
+            'private_token': '576932'
+        })
+        self.users = [
+            {'username': 'root', 'id': 1, 'state': 'active'},
+            {'username': 'declared', 'id': 2, 'state': 'active'},
+            {'username': 'leaver', 'id': 3, 'state': 'active'},
+            {'username': 'stale', 'id': 4, 'state': 'active'},
+            {'username': 'ci-bot', 'id': 5, 'state': 'active'},
+            {'username': 'gone', 'id': 6, 'state': 'blocked'},
+            {'username': 'admin', 'id': 7, 'state': 'active'}
+        ]
+        self.requests = []
+
+    def respond(self, method, url, headers, body=None, created_check=None):
+        if url.endswith('/user'):
+            return {'status': '200 OK'}, '{"username":"admin","id":7}'
+        self.requests.append((method, url))
+        return {'status': '200 OK'}, ''
+
+    @mock.patch('library.gitlab_user._list_all_users')
+    @mock.patch('library.gitlab_user._send_request')
+    def testDeleteUndeclaredUsers(self, send_request_mock, list_all_users_mock):
+        list_all_users_mock.return_value = self.users
+        send_request_mock.side_effect = self.respond
+
+        result = library.gitlab_user.run(self.params, False)
+
+        self.assertTrue(result['changed'])
+        self.assertEqual(
+            [{'username': 'stale', 'action': 'delete', 'changed': True},
+             {'username': 'gone', 'action': 'delete', 'changed': True}],
+            result['pruned']
+        )
+        self.assertEqual(
+            ['DELETE http://somedomain.com/api/v3/users/3',
+             'DELETE http://somedomain.com/api/v3/users/4',
+             'DELETE http://somedomain.com/api/v3/users/6'],
+            sorted('%s %s' % request for request in self.requests)
+        )
+        self.assertEqual(1, list_all_users_mock.call_count)
+
+    @mock.patch('library.gitlab_user._list_all_users')
+    @mock.patch('library.gitlab_user._send_request')
+    def testBlockUndeclaredUsers_skipBlockedUsers(self, send_request_mock, list_all_users_mock):
+        list_all_users_mock.return_value = self.users
+        send_request_mock.side_effect = self.respond
+
+        result = library.gitlab_user.run(dict(self.params, prune_action='block'), False)
+
+        self.assertEqual([{'username': 'stale', 'action': 'block', 'changed': True}], result['pruned'])
+        self.assertTrue(('PUT', 'http://somedomain.com/api/v3/users/4/block') in self.requests)
+
+    @mock.patch('library.gitlab_user._list_all_users')
+    @mock.patch('library.gitlab_user._send_request')
+    def testBlockWithApiV4(self, send_request_mock, list_all_users_mock):
+        list_all_users_mock.return_value = self.users
+        send_request_mock.side_effect = lambda method, url, headers, body=None, created_check=None: \
+            self.respond(method, url, headers) if url.endswith('/user') else \
+            self.requests.append((method, url)) or ({'status': '201 Created'}, 'true')
+
+        result = library.gitlab_user.run(
+            dict(self.params, prune_action='block', api_url='http://somedomain.com/api/v4', users=[
+                {'username': 'declared'}, {'username': 'leaver'}
+            ]),
+            False
+        )
+
+        self.assertEqual([{'username': 'stale', 'action': 'block', 'changed': True}], result['pruned'])
+        self.assertEqual([('POST', 'http://somedomain.com/api/v4/users/4/block')], self.requests)
+
+    @mock.patch('library.gitlab_user._list_all_users')
+    @mock.patch('library.gitlab_user._send_request')
+    def testTooManyUsersToPrune_failBeforeAnyChange(self, send_request_mock, list_all_users_mock):
+        list_all_users_mock.return_value = self.users
+        send_request_mock.side_effect = self.respond
+
+        result = library.gitlab_user.run(dict(self.params, max_deletions=1), False)
+
+        self.assertEqual(
+            {'failed': True, 'msg': 'exclusive would delete 2 users, more than max_deletions 1: stale, gone'},
+            result
+        )
+        self.assertEqual([], self.requests)
+
+    @mock.patch('library.gitlab_user._list_all_users')
+    @mock.patch('library.gitlab_user._send_request')
+    def testMaxDeletionsNotGiven_useDefaultLimit(self, send_request_mock, list_all_users_mock):
+        list_all_users_mock.return_value = self.users + [
+            {'username': 'stale%d' % number, 'id': 100 + number, 'state': 'active'} for number in range(10)
+        ]
+        send_request_mock.side_effect = self.respond
+
+        result = library.gitlab_user.run(self.params, False)
+
+        self.assertTrue(result['failed'])
+        self.assertTrue(result['msg'].startswith('exclusive would delete 12 users, more than max_deletions 10'))
+        self.assertEqual([], self.requests)
+
+    @mock.patch('library.gitlab_user._list_all_users')
+    @mock.patch('library.gitlab_user._send_request')
+    def testNoDeclaredUsers_failBeforeAnyChange(self, send_request_mock, list_all_users_mock):
+        list_all_users_mock.return_value = self.users
+        send_request_mock.side_effect = self.respond
+
+        result = library.gitlab_user.run(dict(self.params, users=[], max_deletions=100), False)
+
+        self.assertEqual({'failed': True, 'msg': 'exclusive refuses to prune with no declared users'}, result)
+        self.assertEqual(0, send_request_mock.call_count)
+
+    @mock.patch('library.gitlab_user._list_all_users')
+    @mock.patch('library.gitlab_user._send_request')
+    def testTokenOwnerNotProtected_neverPrune(self, send_request_mock, list_all_users_mock):
+        list_all_users_mock.return_value = self.users
+        send_request_mock.side_effect = self.respond
+
+        result = library.gitlab_user.run(dict(self.params, protected_users=[]), False)
+
+        self.assertEqual(['root', 'stale', 'ci-bot', 'gone'], [pruned['username'] for pruned in result['pruned']])
+        self.assertFalse(('DELETE', 'http://somedomain.com/api/v3/users/7') in self.requests)
+
+    @mock.patch('library.gitlab_user._list_all_users')
+    @mock.patch('library.gitlab_user._send_request')
+    def testCheckMode_dontSendRequests(self, send_request_mock, list_all_users_mock):
+        list_all_users_mock.return_value = self.users
+        send_request_mock.side_effect = self.respond
+
+        result = library.gitlab_user.run(self.params, True)
+
+        self.assertEqual(['stale', 'gone'], [pruned['username'] for pruned in result['pruned']])
+        self.assertEqual([], self.requests)
+
+    @mock.patch('library.gitlab_user._list_all_users')
+    @mock.patch('library.gitlab_user._send_request')
+    def testFailedEntry_dontPrune(self, send_request_mock, list_all_users_mock):
+        list_all_users_mock.return_value = self.users
+        send_request_mock.side_effect = lambda method, url, headers, body=None, created_check=None: \
+            self.respond(method, url, headers) if url.endswith('/user') else \
+            self.requests.append((method, url)) or ({'status': '500 Internal Server Error'}, 'some message')
+
+        result = library.gitlab_user.run(self.params, False)
+
+        self.assertTrue(result['failed'])
+        self.assertEqual([], result['pruned'])
+        self.assertEqual(1, len(self.requests))
+
+    def perform_request(self, method, url, headers, body=None):
+        if url.endswith('/4') or url.endswith('/4/block'):
+            raise library.gitlab_user.GitlabHttpError(404, 'Not Found', {}, '{"message":"404 User Not Found"}')
+        return self.respond(method, url, headers)
+
+    @mock.patch('library.gitlab_user._list_all_users')
+    @mock.patch('library.gitlab_user._perform_request')
+    def testUserDeletedMeanwhile_reportUnchanged(self, perform_request_mock, list_all_users_mock):
+        list_all_users_mock.return_value = self.users
+        perform_request_mock.side_effect = self.perform_request
+
+        result = library.gitlab_user.run(self.params, False)
+
+        self.assertFalse(result.get('failed'))
+        self.assertEqual([False, True], [pruned['changed'] for pruned in result['pruned']])
+
+    @mock.patch('library.gitlab_user._list_all_users')
+    @mock.patch('library.gitlab_user._perform_request')
+    def testUserDeletedMeanwhile_blockReportsUnchanged(self, perform_request_mock, list_all_users_mock):
+        list_all_users_mock.return_value = self.users
+        perform_request_mock.side_effect = self.perform_request
+
+        result = library.gitlab_user.run(dict(self.params, prune_action='block'), False)
+
+        self.assertFalse(result.get('failed'))
+        self.assertEqual([{'username': 'stale', 'action': 'block', 'changed': False}], result['pruned'])
+
+    def testExclusiveWithoutUsers_fail(self):
+        result = library.gitlab_user.run(dict(self.params, users=None, username='someone'), False)
+
+        self.assertEqual({'failed': True, 'msg': 'exclusive requires users or users_file'}, result)
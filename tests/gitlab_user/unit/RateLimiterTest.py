@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import mock
+import library.gitlab_user
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    @mock.patch('time.sleep')
+    @mock.patch('time.time')
+    def testConfiguredRate_waitForTokens(self, time_mock, sleep_mock):
+        time_mock.return_value = 1000.0
+        sleep_mock.side_effect = lambda seconds: setattr(time_mock, 'return_value', time_mock.return_value + seconds)
+        rate_limiter = library.gitlab_user._RateLimiter(2.0)
+
+        for i in range(4):
+            rate_limiter.acquire()
+
+        self.assertEqual(1001.0, time_mock.return_value)
+
+    @mock.patch('time.sleep')
+    def testUnlimited_dontWait(self, sleep_mock):
+        rate_limiter = library.gitlab_user._RateLimiter()
+
+        for i in range(100):
+            rate_limiter.acquire()
+
+        self.assertEqual(0, sleep_mock.call_count)
+
+    @mock.patch('time.time')
+    def testObserveRateLimitHeaders_spreadRemainingRequestsOverWindow(self, time_mock):
+        time_mock.return_value = 1500000000.0
+        rate_limiter = library.gitlab_user._RateLimiter()
+
+        rate_limiter.observe({'RateLimit-Remaining': '120', 'RateLimit-Reset': '1500000060'})
+        self.assertEqual(2.0, rate_limiter.rate)
+
+        rate_limiter.observe({'ratelimit-remaining': '30', 'ratelimit-reset': '10'})
+        self.assertEqual(3.0, rate_limiter.rate)
+
+    @mock.patch('time.time')
+    def testObserveRateLimitHeaders_keepConfiguredRateAsMaximum(self, time_mock):
+        time_mock.return_value = 1500000000.0
+        rate_limiter = library.gitlab_user._RateLimiter(1.0)
+
+        rate_limiter.observe({'RateLimit-Remaining': '600', 'RateLimit-Reset': '60'})
+
+        self.assertEqual(1.0, rate_limiter.rate)
+
+    @mock.patch('time.time')
+    def testObserveExhaustedLimit_pauseUntilReset(self, time_mock):
+        time_mock.return_value = 1500000000.0
+        rate_limiter = library.gitlab_user._RateLimiter()
+
+        rate_limiter.observe({'RateLimit-Remaining': '0', 'RateLimit-Reset': '1500000030'})
+
+        self.assertEqual(1500000030.0, rate_limiter.paused_until)
+
+    def testRetryAfterSeconds(self):
+        self.assertEqual(7, library.gitlab_user._retry_after_seconds({'Retry-After': '7'}, 1))
+        self.assertEqual(4, library.gitlab_user._retry_after_seconds({}, 2))
+
+
+class SendRequestRateLimitedTest(unittest.TestCase):
+
+    def setUp(self):
+        library.gitlab_user._enable_rate_limiter()
+
+    def tearDown(self):
+        library.gitlab_user._rate_limiter = None
+
+    @mock.patch('time.time')
+    @mock.patch('time.sleep')
+    @mock.patch('library.gitlab_user._perform_request')
+    def testTooManyRequests_sendAgainAfterRetryAfter(self, perform_request_mock, sleep_mock, time_mock):
+        time_mock.return_value = 1000.0
+        sleep_mock.side_effect = lambda seconds: setattr(time_mock, 'return_value', time_mock.return_value + seconds)
+        perform_request_mock.side_effect = (
+            library.gitlab_user.GitlabHttpError(429, 'Too Many Requests', {'Retry-After': '3'}, ''),
+            ({'status': '201 Created'}, '{"id":12}')
+        )
+
+        result = library.gitlab_user._send_request('POST', 'http://somedomain.com/api/v3/users', {}, '{}')
+
+        self.assertEqual(({'status': '201 Created'}, '{"id":12}'), result)
+        self.assertEqual(2, perform_request_mock.call_count)
+        self.assertEqual([mock.call(3.0)], sleep_mock.call_args_list)
+
+    @mock.patch('time.sleep')
+    @mock.patch('library.gitlab_user._perform_request')
+    def testOtherErrors_raise(self, perform_request_mock, sleep_mock):
+        perform_request_mock.side_effect = \
+            library.gitlab_user.GitlabHttpError(500, 'Internal Server Error', {}, 'some message')
+
+        with self.assertRaises(library.gitlab_user.GitlabModuleInternalException) as ex:
+            library.gitlab_user._send_request('GET', 'http://somedomain.com/api/v3/users', {})
+
+        self.assertEqual('500 Internal Server Error\nsome message', ex.exception.message)
+        self.assertEqual(1, perform_request_mock.call_count)
+        self.assertEqual(0, sleep_mock.call_count)
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import mock
+import library.gitlab_user
+
+
+class ReconcileUsersTest(unittest.TestCase):
+
+    def create_params(self, users, **defaults):
+        params = {
+            'api_url': 'http://somedomain.com/api/v3',
+            'private_token': '576932',
+            'state': 'present',
+            'max_workers': 1,
+            'users': users
+        }
+        params.update(defaults)
+        return params
+
+    @mock.patch('library.gitlab_user._list_all_users')
+    @mock.patch('library.gitlab_user._send_request')
+    def testReconcileAgainstOneUserList(self, send_request_mock, list_all_users_mock):
+        list_all_users_mock.return_value = [
+            {'username': 'existing', 'id': 3, 'name': 'Existing', 'email': 'existing@something.com'},
+            {'username': 'obsolete', 'id': 4, 'name': 'Obsolete', 'email': 'obsolete@something.com'}
+        ]
+        send_request_mock.side_effect = (
+            ({'status': '201 Created'}, '{"username":"newuser","id":12,"name":"New","email":"new@something.com"}'),
+            ({'status': '200 OK'}, '')
+        )
+
+        results = library.gitlab_user.reconcile_users(
+            self.create_params([
+                {'username': 'existing', 'name': 'Existing'},
+                {'username': 'newuser', 'name': 'New', 'email': 'new@something.com', 'password': 'abc123yz'},
+                {'username': 'obsolete', 'state': 'absent'},
+                {'username': 'missing', 'state': 'absent'}
+            ]),
+            False
+        )
+
+        self.assertEqual(
+            [
+                {'username': 'existing', 'state': 'present', 'changed': False, 'changes': {}, 'skipped_fetches': 2},
+                {'username': 'newuser', 'state': 'present', 'changed': True, 'changes': {
+                    'username': {'before': None, 'after': 'newuser'},
+                    'name': {'before': None, 'after': 'New'},
+                    'email': {'before': None, 'after': 'new@something.com'},
+                    'password': {'before': None, 'after': '********'}
+                }, 'skipped_fetches': 2},
+                {'username': 'obsolete', 'state': 'absent', 'changed': True},
+                {'username': 'missing', 'state': 'absent', 'changed': False}
+            ],
+            results
+        )
+        self.assertEqual(('http://somedomain.com/api/v3', '576932', 1), list_all_users_mock.call_args_list[0][0])
+        self.assertEqual(2, send_request_mock.call_count)
+        self.assertEqual('POST', send_request_mock.call_args_list[0][0][0])
+        self.assertEqual('DELETE', send_request_mock.call_args_list[1][1]['method'])
+        self.assertEqual('http://somedomain.com/api/v3/users/4', send_request_mock.call_args_list[1][1]['url'])
+
+    @mock.patch('library.gitlab_user._list_all_users')
+    @mock.patch('library.gitlab_user._send_request')
+    def testCheckMode_dontSendRequests(self, send_request_mock, list_all_users_mock):
+        list_all_users_mock.return_value = [{'username': 'existing', 'id': 3, 'name': 'Existing'}]
+
+        results = library.gitlab_user.reconcile_users(
+            self.create_params([
+                {'username': 'existing', 'name': 'Renamed'},
+                {'username': 'existing', 'state': 'absent'}
+            ]),
+            True
+        )
+
+        self.assertEqual([True, True], [result['changed'] for result in results])
+        self.assertEqual(0, send_request_mock.call_count)
+
+    @mock.patch('library.gitlab_user._list_all_users')
+    @mock.patch('library.gitlab_user._send_request')
+    def testReconcileUsersConcurrently_collectErrorsPerUser(self, send_request_mock, list_all_users_mock):
+        list_all_users_mock.return_value = [
+            {'username': 'first', 'id': 3, 'name': 'First'},
+            {'username': 'second', 'id': 4, 'name': 'Second'},
+            {'username': 'third', 'id': 5, 'name': 'Third'}
+        ]
+        responses = {
+            'http://somedomain.com/api/v3/users/3': ({'status': '200 OK'}, '{"username":"first","id":3}'),
+            'http://somedomain.com/api/v3/users/4': ({'status': '500 Internal Server Error'}, 'some message'),
+            'http://somedomain.com/api/v3/users/5': ({'status': '200 OK'}, '')
+        }
+        send_request_mock.side_effect = lambda method, url, headers, body=None, created_check=None: responses[url]
+
+        results = library.gitlab_user.reconcile_users(
+            self.create_params(
+                [
+                    {'username': 'first', 'name': 'Renamed'},
+                    {'username': 'second', 'name': 'Renamed'},
+                    {'username': 'third', 'state': 'absent'},
+                    {'username': 'second', 'state': 'absent'}
+                ],
+                max_workers=3
+            ),
+            False
+        )
+
+        self.assertEqual(
+            [
+                {'username': 'first', 'state': 'present', 'changed': True,
+                 'changes': {'name': {'before': 'First', 'after': 'Renamed'}}, 'skipped_fetches': 2},
+                {'username': 'second', 'state': 'present', 'changed': False, 'failed': True,
+                 'changes': {'name': {'before': 'Second', 'after': 'Renamed'}},
+                 'msg': '500 Internal Server Error\nsome message'},
+                {'username': 'third', 'state': 'absent', 'changed': True},
+                {'username': 'second', 'state': 'absent', 'changed': False, 'failed': True,
+                 'msg': 'skipped because a previous entry of this user failed'}
+            ],
+            results
+        )
+        self.assertEqual(3, send_request_mock.call_count)
+
+    def testOptionsOutsideOfUsersAreDefaults(self):
+        specs = list(library.gitlab_user._user_specs(self.create_params(
+            [{'username': 'first'}, {'username': 'second', 'can_create_group': True, 'bio': None}],
+            can_create_group=False,
+            bio='some bio',
+            username=None,
+            max_workers=None
+        )))
+
+        self.assertEqual(
+            [
+                {'username': 'first', 'can_create_group': False, 'bio': 'some bio', 'state': 'present',
+                 'api_url': 'http://somedomain.com/api/v3', 'private_token': '576932'},
+                {'username': 'second', 'can_create_group': True, 'bio': 'some bio', 'state': 'present',
+                 'api_url': 'http://somedomain.com/api/v3', 'private_token': '576932'}
+            ],
+            specs
+        )
+
+    def testUnknownParam(self):
+        with self.assertRaises(library.gitlab_user.GitlabModuleInternalException) as ex:
+            list(library.gitlab_user._user_specs(self.create_params([{'username': 'first', 'nmae': 'typo'}])))
+        self.assertEqual('unsupported parameters for user first: nmae', ex.exception.message)
+
+    def testUsernameMissing(self):
+        with self.assertRaises(library.gitlab_user.GitlabModuleInternalException) as ex:
+            list(library.gitlab_user._user_specs(self.create_params([{'name': 'first'}])))
+        self.assertEqual('every entry of users needs a username', ex.exception.message)
+
+    def testSshKeyWithoutTitle(self):
+        with self.assertRaises(library.gitlab_user.GitlabModuleInternalException) as ex:
+            list(library.gitlab_user._user_specs(self.create_params([{'username': 'first', 'ssh_key': 'ssh-rsa AAA'}])))
+        self.assertEqual('ssh_key_title and ssh_key are required together for user first', ex.exception.message)
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import mock
+import library.gitlab_user
+
+
+def _http_error(status, reason='Service Unavailable', body='some message'):
+    return library.gitlab_user.GitlabHttpError(status, reason, {}, body)
+
+
+@mock.patch('time.sleep')
+@mock.patch('library.gitlab_user._perform_request')
+class RetryTest(unittest.TestCase):
+
+    def setUp(self):
+        library.gitlab_user._enable_retries(3, 0.5, 0.0, 60.0)
+
+    def tearDown(self):
+        library.gitlab_user._retry_policy = None
+
+    def testIdempotentRequest_retryWithExponentialBackoff(self, perform_request_mock, sleep_mock):
+        perform_request_mock.side_effect = (
+            _http_error(503),
+            library.gitlab_user.GitlabModuleInternalException('connection reset'),
+            ({'status': '200 OK'}, '{}')
+        )
+
+        result = library.gitlab_user._send_request('PUT', 'http://somedomain.com/api/v3/users/12', {}, '{}')
+
+        self.assertEqual(({'status': '200 OK'}, '{}'), result)
+        self.assertEqual([mock.call(0.5), mock.call(1.0)], sleep_mock.call_args_list)
+
+    def testRetriesExhausted(self, perform_request_mock, sleep_mock):
+        perform_request_mock.side_effect = _http_error(502, 'Bad Gateway')
+
+        with self.assertRaises(library.gitlab_user.GitlabHttpError) as ex:
+            library.gitlab_user._send_request('GET', 'http://somedomain.com/api/v3/users', {})
+
+        self.assertEqual('502 Bad Gateway\nsome message', ex.exception.message)
+        self.assertEqual(4, perform_request_mock.call_count)
+
+    def testNonTransientError_dontRetry(self, perform_request_mock, sleep_mock):
+        perform_request_mock.side_effect = _http_error(500, 'Internal Server Error')
+
+        with self.assertRaises(library.gitlab_user.GitlabHttpError):
+            library.gitlab_user._send_request('GET', 'http://somedomain.com/api/v3/users', {})
+
+        self.assertEqual(1, perform_request_mock.call_count)
+
+    @mock.patch('time.time')
+    def testDeadlinePassed_dontRetry(self, time_mock, perform_request_mock, sleep_mock):
+        time_mock.side_effect = (1000.0, 1070.0)
+        perform_request_mock.side_effect = _http_error(503)
+
+        with self.assertRaises(library.gitlab_user.GitlabHttpError):
+            library.gitlab_user._send_request('GET', 'http://somedomain.com/api/v3/users', {})
+
+        self.assertEqual(1, perform_request_mock.call_count)
+
+    @mock.patch('random.random')
+    @mock.patch('time.time')
+    def testDelayWouldPassDeadline_dontRetry(self, time_mock, random_mock, perform_request_mock, sleep_mock):
+        library.gitlab_user._enable_retries(3, 10.0, 1.0, 60.0)
+        time_mock.side_effect = (1000.0, 1045.0, 1045.0)
+        random_mock.side_effect = (0.75, 0.0)  # delays of 2.5 and 20 seconds
+        perform_request_mock.side_effect = (_http_error(503), _http_error(503))
+
+        with self.assertRaises(library.gitlab_user.GitlabHttpError):
+            library.gitlab_user._send_request('GET', 'http://somedomain.com/api/v3/users', {})
+
+        self.assertEqual([mock.call(2.5)], sleep_mock.call_args_list)
+        self.assertEqual(2, perform_request_mock.call_count)
+
+    def testPostWithoutCreatedCheck_dontRetry(self, perform_request_mock, sleep_mock):
+        perform_request_mock.side_effect = _http_error(503)
+
+        with self.assertRaises(library.gitlab_user.GitlabHttpError):
+            library.gitlab_user._send_request('POST', 'http://somedomain.com/api/v3/users', {}, '{}')
+
+        self.assertEqual(1, perform_request_mock.call_count)
+
+    def testPostNotCreated_sendAgain(self, perform_request_mock, sleep_mock):
+        perform_request_mock.side_effect = (
+            _http_error(504, 'Gateway Timeout'),
+            ({'status': '201 Created'}, '{"id":12}')
+        )
+        created_check = mock.MagicMock(return_value=None)
+
+        result = library.gitlab_user._send_request(
+            'POST', 'http://somedomain.com/api/v3/users', {}, '{}', created_check=created_check
+        )
+
+        self.assertEqual(({'status': '201 Created'}, '{"id":12}'), result)
+        self.assertEqual(1, created_check.call_count)
+        self.assertEqual(2, perform_request_mock.call_count)
+
+    def testPostCreatedDespiteError_returnCreatedResource(self, perform_request_mock, sleep_mock):
+        perform_request_mock.side_effect = _http_error(504, 'Gateway Timeout')
+        created_check = mock.MagicMock(return_value={'id': 12, 'username': 'testusername'})
+
+        result = library.gitlab_user._send_request(
+            'POST', 'http://somedomain.com/api/v3/users', {}, '{}', created_check=created_check
+        )
+
+        self.assertEqual(({'status': '201 Created'}, '{"username": "testusername", "id": 12}'), result)
+        self.assertEqual(1, perform_request_mock.call_count)
+
+    def testDeleteAlreadyGoneOnRetry_succeed(self, perform_request_mock, sleep_mock):
+        perform_request_mock.side_effect = (_http_error(503), _http_error(404, 'Not Found'))
+
+        result = library.gitlab_user._send_request('DELETE', 'http://somedomain.com/api/v3/users/12', {})
+
+        self.assertEqual(({'status': '200 OK'}, ''), result)
+
+    def testJitter(self, perform_request_mock, sleep_mock):
+        retry_policy = library.gitlab_user._RetryPolicy(backoff=1.0, jitter=0.5)
+
+        with mock.patch('random.random', return_value=1.0):
+            self.assertEqual(2.0, retry_policy.delay(2))
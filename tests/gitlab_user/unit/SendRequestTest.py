@@ -60,4 +60,24 @@ class GitlabUserSendRequestTest(unittest.TestCase):
                 'something'
             )
 
-        self.assertEqual('GitlabUserSendRequestTest.testRequestFailedWithReasonMessage', ex.exception.message)
\ No newline at end of file
+        self.assertEqual('GitlabUserSendRequestTest.testRequestFailedWithReasonMessage', ex.exception.message)
+
+    @mock.patch('ansible.module_utils.urls.open_url')
+    @mock.patch('library.gitlab_user._connection_pool')
+    def testConnectionPoolEnabled_dontUseOpenUrl(self, connection_pool_mock, open_url_mock):
+        connection_pool_mock.accepts.return_value = True
+        connection_pool_mock.request.return_value = {'status': '200 OK'}, 'some message'
+
+        result = library.gitlab_user._send_request(
+            'GET',
+            'http://something.com',
+            {'Content-Type': 'text/csv'},
+            'something'
+        )
+
+        self.assertEqual(({'status': '200 OK'}, 'some message'), result)
+        self.assertEqual(
+            ('GET', 'http://something.com', {'Content-Type': 'text/csv'}, 'something'),
+            connection_pool_mock.request.call_args_list[0][0]
+        )
+        self.assertEqual(0, open_url_mock.call_count)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import mock
+import library.gitlab_user
+
+RSA_KEY = 'ssh-rsa AAAAB3NzaC1yc2EAAAADAQABAAAAgQC9'
+
+
+class SkippedFetchesTest(unittest.TestCase):
+
+    def setUp(self):
+        # the params of AnsibleModule, with every option that was not given set to None
+        self.params = dict((param_name, None) for param_name in library.gitlab_user.argument_spec())
+        self.params.update({
+            'username': 'testusername',
+            'name': 'Test',
+            'state': 'present',
+            'api_url': 'http://something.com/api/v3',
+            'private_token': 'abc123'
+        })
+        self.responses = {
+            ('GET', 'http://something.com/api/v3/users?username=testusername'):
+                ({'status': '200 OK'}, '[{"username":"testusername","id":12,"name":"Test","email":"a@b.com"}]'),
+            ('GET', 'http://something.com/api/v3/users/12/keys?per_page=100'):
+                ({'status': '200 OK'}, '[{"id":3,"title":"key1","key":"%s"}]' % RSA_KEY),
+            ('POST', 'http://something.com/api/v3/users'):
+                ({'status': '201 Created'}, '{"username":"testusername","id":12,"name":"Test","email":"a@b.com"}'),
+            ('POST', 'http://something.com/api/v3/users/12/keys'):
+                ({'status': '201 Created'}, '{"id":3,"title":"key1","key":"%s"}' % RSA_KEY)
+        }
+        self.requests = []
+
+    def respond(self, method, url, headers, body=None, created_check=None):
+        self.requests.append((method, url))
+        return self.responses[(method, url)]
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testNoKeysGiven_dontFetchListings(self, send_request_mock):
+        send_request_mock.side_effect = self.respond
+
+        result = library.gitlab_user.run(self.params, False)
+
+        self.assertEqual({'changed': False, 'changes': {}, 'skipped_fetches': 2}, result)
+        self.assertEqual([('GET', 'http://something.com/api/v3/users?username=testusername')], self.requests)
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testKeyGiven_fetchKeyListingOnly(self, send_request_mock):
+        send_request_mock.side_effect = self.respond
+
+        result = library.gitlab_user.run(dict(self.params, ssh_key_title='key1', ssh_key=RSA_KEY), False)
+
+        self.assertFalse(result['changed'])
+        self.assertEqual(1, result['skipped_fetches'])
+        self.assertEqual('http://something.com/api/v3/users/12/keys?per_page=100', self.requests[-1][1])
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testNewUser_dontFetchItsEmptyListings(self, send_request_mock):
+        self.responses[('GET', 'http://something.com/api/v3/users?username=testusername')] = {'status': '200 OK'}, '[]'
+        send_request_mock.side_effect = self.respond
+
+        result = library.gitlab_user.run(
+            dict(self.params, email='a@b.com', password='abc123yz', ssh_key_title='key1', ssh_key=RSA_KEY),
+            False
+        )
+
+        self.assertTrue(result['changed'])
+        self.assertEqual(2, result['skipped_fetches'])
+        self.assertEqual(
+            [('GET', 'http://something.com/api/v3/users?username=testusername'),
+             ('POST', 'http://something.com/api/v3/users'),
+             ('POST', 'http://something.com/api/v3/users/12/keys')],
+            self.requests
+        )
+
+    @mock.patch('library.gitlab_user._list_all_users')
+    @mock.patch('library.gitlab_user._send_request')
+    def testEntriesOfOneUser_fetchListingOnce(self, send_request_mock, list_all_users_mock):
+        list_all_users_mock.return_value = [{'username': 'testusername', 'id': 12, 'name': 'Test', 'email': 'a@b.com'}]
+        send_request_mock.side_effect = self.respond
+        key = {'title': 'key1', 'key': RSA_KEY}
+
+        result = library.gitlab_user.run(
+            dict(self.params, username=None, users=[
+                {'username': 'testusername', 'ssh_keys': [key]},
+                {'username': 'testusername', 'ssh_keys': [key]}
+            ]),
+            False
+        )
+
+        self.assertEqual([1, 2], [user_result['skipped_fetches'] for user_result in result['users']])
+        self.assertEqual(3, result['skipped_fetches'])
+        self.assertEqual(1, send_request_mock.call_count)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import mock
+import library.gitlab_user
+
+RSA_KEY = 'ssh-rsa AAAAB3NzaC1yc2EAAAADAQABAAAAgQC9'
+
+
+class SnapshotDirectoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.snapshot = {
+            'api_url': 'http://something.com/api/v3/',
+            'users': [{
+                'id': 12, 'username': 'testusername', 'name': 'Test', 'email': 'someone@something.com',
+                'emails': [],
+                'ssh_keys': [{'id': 3, 'title': 'key1', 'fingerprint': library.gitlab_user._ssh_key_fingerprint(RSA_KEY)}]
+            }]
+        }
+        self.params = {
+            'username': 'testusername',
+            'name': 'Test',
+            'email': 'someone@something.com',
+            'ssh_key_title': 'key1',
+            'ssh_key': RSA_KEY + ' someone@somehost',
+            'api_url': 'http://something.com/api/v3',
+            'private_token': 'abc123',
+            'directory_snapshot': self.snapshot
+        }
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testUnchangedUser_dontSendAnyRequest(self, send_request_mock):
+        directory = library.gitlab_user._load_directory_snapshot(self.params)
+
+        self.assertFalse(library.gitlab_user.create_or_update_user(self.params, False, directory))
+        self.assertEqual(0, send_request_mock.call_count)
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testCheckMode_predictFromSnapshot(self, send_request_mock):
+        directory = library.gitlab_user._load_directory_snapshot(self.params)
+
+        self.assertTrue(library.gitlab_user.create_or_update_user(dict(self.params, name='Other'), True, directory))
+        self.assertEqual(0, send_request_mock.call_count)
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testChangedUser_confirmBeforeWriting(self, send_request_mock):
+        send_request_mock.side_effect = (
+            ({'status': '200 OK'},
+             '[{"username":"testusername","id":12,"name":"Test","email":"someone@something.com"}]'),
+            ({'status': '200 OK'}, '[{"id":3,"title":"key1","key":"%s"}]' % RSA_KEY),
+            ({'status': '200 OK'},
+             '{"username":"testusername","id":12,"name":"Other","email":"someone@something.com"}')
+        )
+        directory = library.gitlab_user._load_directory_snapshot(self.params)
+
+        self.assertTrue(library.gitlab_user.create_or_update_user(dict(self.params, name='Other'), False, directory))
+        self.assertEqual(
+            ['GET', 'GET', 'PUT'],
+            [call[1]['method'] if 'method' in call[1] else call[0][0] for call in send_request_mock.call_args_list]
+        )
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testOutdatedSnapshot_dontWriteWhatChangedAlready(self, send_request_mock):
+        send_request_mock.side_effect = (
+            ({'status': '200 OK'},
+             '[{"username":"testusername","id":12,"name":"Other","email":"someone@something.com"}]'),
+            ({'status': '200 OK'}, '[{"id":3,"title":"key1","key":"%s"}]' % RSA_KEY)
+        )
+        directory = library.gitlab_user._load_directory_snapshot(self.params)
+
+        self.assertFalse(library.gitlab_user.create_or_update_user(dict(self.params, name='Other'), False, directory))
+        self.assertEqual(2, send_request_mock.call_count)
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testRemoveUserDeletedMeanwhile_dontSendDeleteRequest(self, send_request_mock):
+        send_request_mock.return_value = {'status': '200 OK'}, '[]'
+        directory = library.gitlab_user._load_directory_snapshot(self.params)
+
+        self.assertFalse(library.gitlab_user.remove_user(self.params, False, directory))
+        self.assertEqual(1, send_request_mock.call_count)
+
+    def testLoadSnapshotFile(self):
+        snapshot_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(snapshot_dir, 'users.json')
+            with open(path, 'w') as snapshot_file:
+                json.dump(self.snapshot, snapshot_file)
+
+            directory = library.gitlab_user._load_directory_snapshot(dict(self.params, directory_snapshot=path))
+
+            self.assertEqual(12, directory.find('testusername')['id'])
+        finally:
+            shutil.rmtree(snapshot_dir)
+
+    def testSnapshotOfOtherGitlab_raiseError(self):
+        with self.assertRaises(library.gitlab_user.GitlabModuleInternalException) as ex:
+            library.gitlab_user._load_directory_snapshot(dict(self.params, api_url='http://other.com/api/v3'))
+        self.assertEqual(
+            'directory_snapshot was taken from http://something.com/api/v3/, not from http://other.com/api/v3',
+            ex.exception.message
+        )
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import mock
+import library.gitlab_user
+
+
+class SweepPagesTest(unittest.TestCase):
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testFetchRemainingPagesFromTotalPages(self, send_request_mock):
+        responses = {
+            'http://somedomain.com/api/v3/users?order_by=id&sort=asc&per_page=100':
+                ({'status': '200 OK', 'X-Total-Pages': '3', 'X-Next-Page': '2'}, '[{"id":5},{"id":1}]'),
+            'http://somedomain.com/api/v3/users?order_by=id&sort=asc&per_page=100&page=2':
+                ({'status': '200 OK', 'X-Total-Pages': '3', 'X-Next-Page': '3'}, '[{"id":4}]'),
+            'http://somedomain.com/api/v3/users?order_by=id&sort=asc&per_page=100&page=3':
+                ({'status': '200 OK', 'X-Total-Pages': '3'}, '[{"id":2},{"id":3}]'),
+        }
+        send_request_mock.side_effect = lambda method, url, headers: responses[url]
+
+        result = library.gitlab_user._list_all_users('http://somedomain.com/api/v3', '576932', 2)
+
+        self.assertEqual([{'id': 1}, {'id': 2}, {'id': 3}, {'id': 4}, {'id': 5}], result)
+        self.assertEqual(3, send_request_mock.call_count)
+        self.assertEqual({'PRIVATE-TOKEN': '576932'}, send_request_mock.call_args_list[1][0][2])
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testTotalPagesMissing_walkPagesSequentially(self, send_request_mock):
+        send_request_mock.side_effect = (
+            ({'status': '200 OK', 'X-Next-Page': '2'}, '[{"id":2}]'),
+            ({'status': '200 OK', 'X-Next-Page': ''}, '[{"id":1}]')
+        )
+
+        result = library.gitlab_user._list_all_users('http://somedomain.com/api/v3', '576932')
+
+        self.assertEqual([{'id': 1}, {'id': 2}], result)
+        self.assertEqual(
+            'http://somedomain.com/api/v3/users?order_by=id&sort=asc&per_page=100&page=2',
+            send_request_mock.call_args_list[1][1]['url']
+        )
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testUserShiftedToNextPageDuringSweep_returnOnce(self, send_request_mock):
+        send_request_mock.side_effect = (
+            ({'status': '200 OK', 'X-Total-Pages': '2'}, '[{"id":1},{"id":3,"name":"old"}]'),
+            ({'status': '200 OK', 'X-Total-Pages': '2'}, '[{"id":3,"name":"new"},{"id":4}]')
+        )
+
+        result = library.gitlab_user._list_all_users('http://somedomain.com/api/v3', '576932')
+
+        self.assertEqual([{'id': 1}, {'id': 3, 'name': 'new'}, {'id': 4}], result)
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testPageRequestFailed(self, send_request_mock):
+        send_request_mock.side_effect = (
+            ({'status': '200 OK', 'X-Total-Pages': '2'}, '[{"id":2}]'),
+            ({'status': '500 Internal Server Error'}, 'some message')
+        )
+
+        with self.assertRaises(library.gitlab_user.GitlabModuleInternalException) as ex:
+            library.gitlab_user._list_all_users('http://somedomain.com/api/v3', '576932')
+        self.assertEqual('500 Internal Server Error\nsome message', ex.exception.message)
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testIterateResponses_yieldEveryResponseOnArrival(self, send_request_mock):
+        send_request_mock.return_value = ({'status': '200 OK'}, '[]')
+
+        responses = library.gitlab_user._iterate_responses([('GET', 'http://somedomain.com/api/v3/users', {})])
+
+        self.assertEqual(0, send_request_mock.call_count)
+        self.assertEqual([({'status': '200 OK'}, '[]')], list(responses))
+        self.assertEqual(1, send_request_mock.call_count)
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+import mock
+import library.gitlab_user
+
+RSA_KEY = 'ssh-rsa AAAAB3NzaC1yc2EAAAADAQABAAAAgQC9 someone@somehost'
+
+
+class ReadUserSpecsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def read(self, file_name, content, **params):
+        path = os.path.join(self.tmp_dir, file_name)
+        with open(path, 'wb') as users_file:
+            users_file.write(content)
+        return list(library.gitlab_user._read_user_specs(dict(params, users_file=path)))
+
+    def testReadCsv(self):
+        specs = self.read(
+            'users.csv',
+            'username,name,projects_limit,admin\n'
+            'first,First Name,10,no\n'
+            '\n'
+            'second,"Second, Name",,\n'
+        )
+
+        self.assertEqual(
+            [(2, {'username': 'first', 'name': 'First Name', 'projects_limit': 10, 'admin': 'no'}),
+             (4, {'username': 'second', 'name': 'Second, Name'})],
+            specs
+        )
+
+    def testReadJsonl(self):
+        specs = self.read(
+            'users.jsonl',
+            '{"username": "first", "admin": true}\n\n{"username": "second", "state": "absent"}\n'
+        )
+
+        self.assertEqual(
+            [(1, {'username': 'first', 'admin': True}), (3, {'username': 'second', 'state': 'absent'})],
+            specs
+        )
+
+    def testReadLdif(self):
+        specs = self.read(
+            'users.ldif',
+            'version: 1\n'
+            '\n'
+            '# people\n'
+            'dn: ou=people,dc=something,dc=com\n'
+            'objectClass: organizationalUnit\n'
+            '\n'
+            'dn: uid=first,ou=people,dc=something,dc=com\n'
+            'objectClass: inetOrgPerson\n'
+            'uid: first\n'
+            'cn: First\n'
+            'displayName:: Rmlyc3QgTsOkbWU=\n'
+            'mail: first@something.com\n'
+            'sshPublicKey: %s\n'
+            'sshPublicKey: ssh-rsa AAAAB3NzaC1yc2EAAAADAQABAAAAgQC9\n'
+            ' 8\n'
+            '\n'
+            'dn: uid=second,ou=people,dc=something,dc=com\n'
+            'changetype: delete\n'
+            'uid: second\n' % RSA_KEY
+        )
+
+        self.assertEqual(
+            [(7, {'username': 'first', 'name': u'First N\xe4me', 'email': 'first@something.com', 'ssh_keys': [
+                {'title': 'someone@somehost', 'key': RSA_KEY},
+                {'title': 'first-2', 'key': 'ssh-rsa AAAAB3NzaC1yc2EAAAADAQABAAAAgQC98'}
+             ]}),
+             (17, {'username': 'second', 'state': 'absent'})],
+            specs
+        )
+
+    def testReadLdif_versionFollowedByFirstRecord(self):
+        specs = self.read(
+            'users.ldif',
+            'version: 1\n'
+            'dn: uid=alice,ou=people,dc=something,dc=com\n'
+            'uid: alice\n'
+            '\n'
+            'dn: uid=bob,ou=people,dc=something,dc=com\n'
+            'uid: bob\n'
+        )
+
+        self.assertEqual([(2, {'username': 'alice'}), (5, {'username': 'bob'})], specs)
+
+    def testInvalidJsonLine_yieldErrorAndGoOn(self):
+        specs = self.read('users.jsonl', '{"username": "first"}\n{"username": \n["third"]\n{"username": "fourth"}\n')
+
+        self.assertEqual([1, 2, 3, 4], [line_number for line_number, spec in specs])
+        self.assertEqual({'username': 'first'}, specs[0][1])
+        self.assertTrue(specs[1][1].message.startswith('no JSON:'))
+        self.assertEqual('no JSON object', specs[2][1].message)
+        self.assertEqual({'username': 'fourth'}, specs[3][1])
+
+    def testCsvRowWithTooManyCells_yieldErrorAndGoOn(self):
+        specs = self.read('users.csv', 'username\nfirst,extra\nsecond\n')
+
+        self.assertEqual('more cells than the header', specs[0][1].message)
+        self.assertEqual([(3, {'username': 'second'})], specs[1:])
+
+    def testInvalidLdifRecord_yieldErrorAndGoOn(self):
+        specs = self.read(
+            'users.ldif',
+            'dn: uid=alice,ou=people,dc=something,dc=com\n'
+            'uid alice\n'
+            '\n'
+            'dn: uid=bob,ou=people,dc=something,dc=com\n'
+            'uid: bob\n'
+        )
+
+        self.assertEqual(1, specs[0][0])
+        self.assertEqual('invalid LDIF line: uid alice', specs[0][1].message)
+        self.assertEqual([(4, {'username': 'bob'})], specs[1:])
+
+    def testUnknownExtension_raiseError(self):
+        with self.assertRaises(library.gitlab_user.GitlabModuleInternalException) as ex:
+            self.read('users.txt', '')
+        self.assertTrue(ex.exception.message.startswith('cannot tell the format of users_file'))
+
+    def testFormatGiven_ignoreExtension(self):
+        specs = self.read('users.txt', '{"username":"first"}', users_file_format='jsonl')
+
+        self.assertEqual([(1, {'username': 'first'})], specs)
+
+
+class SyncUsersFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.params = dict((param_name, None) for param_name in library.gitlab_user.argument_spec())
+        self.params.update({
+            'users_file': os.path.join(self.tmp_dir, 'users.jsonl'),
+            'chunk_size': 2,
+            'state': 'present',
+            'max_workers': 2,
+            'api_url': 'http://somedomain.com/api/v3',
+            'private_token': '576932'
+        })
+        with open(self.params['users_file'], 'w') as users_file:
+            for number in range(1, 6):
+                users_file.write('{"username": "user%d", "name": "Renamed"}\n' % number)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    @mock.patch('library.gitlab_user._list_all_users')
+    @mock.patch('library.gitlab_user._send_request')
+    def testReconcileInChunks_reportProgress(self, send_request_mock, list_all_users_mock):
+        list_all_users_mock.return_value = [
+            {'username': 'user%d' % number, 'id': number, 'name': 'Renamed' if number % 2 else 'Old'}
+            for number in range(1, 6)
+        ]
+        send_request_mock.side_effect = lambda method, url, headers, body=None, created_check=None: \
+            ({'status': '500 Internal Server Error'}, 'some message') if url.endswith('/4') else \
+            ({'status': '200 OK'}, '{"username":"user2","id":2,"name":"Renamed"}')
+        progress = []
+
+        result = library.gitlab_user.run(self.params, False, progress=progress.append)
+
+        self.assertTrue(result['failed'])
+        self.assertEqual('1 of 5 users failed', result['msg'])
+        self.assertEqual({'records': 5, 'changed': 1, 'failed': 1, 'skipped_fetches': 8}, result['users_file'])
+        self.assertEqual(['user4'], [failure['username'] for failure in result['failures']])
+        self.assertEqual(
+            ['users_file chunk 1: 2 records, 1 changed, 0 failed',
+             'users_file chunk 2: 4 records, 1 changed, 1 failed',
+             'users_file chunk 3: 5 records, 1 changed, 1 failed'],
+            progress
+        )
+        self.assertEqual(1, list_all_users_mock.call_count)
+
+    @mock.patch('library.gitlab_user._list_all_users')
+    @mock.patch('library.gitlab_user._send_request')
+    def testExclusive_pruneUsersMissingFromFile(self, send_request_mock, list_all_users_mock):
+        list_all_users_mock.return_value = [
+            {'username': 'user%d' % number, 'id': number, 'name': 'Renamed'} for number in range(1, 8)
+        ]
+        send_request_mock.side_effect = lambda method, url, headers, body=None, created_check=None: \
+            ({'status': '200 OK'}, '{"username":"root","id":1}') if url.endswith('/user') else ({'status': '200 OK'}, '')
+
+        result = library.gitlab_user.run(dict(self.params, exclusive=True, max_deletions=2), False)
+
+        self.assertTrue(result['changed'])
+        self.assertEqual(['user6', 'user7'], [pruned['username'] for pruned in result['pruned']])
+        self.assertEqual(3, send_request_mock.call_count)
+
+    @mock.patch('library.gitlab_user._list_all_users')
+    @mock.patch('library.gitlab_user._send_request')
+    def testInvalidRecords_reportWithLineNumberAndGoOn(self, send_request_mock, list_all_users_mock):
+        with open(self.params['users_file'], 'w') as users_file:
+            users_file.write('{"name": "Nobody"}\n'
+                             '{"username": "user1", "name": "Renamed"}\n'
+                             '{"username": "user2", "admin": "maybe"}\n'
+                             '{"username": "user3", "colour": "blue"}\n'
+                             '{"username": "user4", "name": "Renamed"}\n')
+        list_all_users_mock.return_value = [
+            {'username': 'user%d' % number, 'id': number, 'name': 'Old'} for number in range(1, 5)
+        ]
+        send_request_mock.return_value = ({'status': '200 OK'}, '{"username":"user1","id":1,"name":"Renamed"}')
+
+        result = library.gitlab_user.run(dict(self.params, exclusive=True), False)
+
+        self.assertTrue(result['failed'])
+        self.assertEqual({'records': 5, 'changed': 2, 'failed': 3, 'skipped_fetches': 4}, result['users_file'])
+        self.assertEqual(
+            [(None, 1, 'users_file line 1: every entry of users needs a username'),
+             ('user2', 3, 'users_file line 3: maybe is not a boolean'),
+             ('user3', 4, 'users_file line 4: unsupported parameters for user user3: colour')],
+            sorted((failure['username'], failure['line'], failure['msg']) for failure in result['failures'])
+        )
+        self.assertEqual([], result['pruned'])
+        self.assertEqual(
+            ['http://somedomain.com/api/v3/user', 'http://somedomain.com/api/v3/users/1',
+             'http://somedomain.com/api/v3/users/4'],
+            sorted(call[0][1] for call in send_request_mock.call_args_list)
+        )
+
+    @mock.patch('library.gitlab_user._list_all_users')
+    def testMissingFile_fail(self, list_all_users_mock):
+        list_all_users_mock.return_value = []
+
+        missing_file = os.path.join(self.tmp_dir, 'missing.jsonl')
+
+        result = library.gitlab_user.run(dict(self.params, users_file=missing_file), False)
+
+        self.assertTrue(result['failed'])
+        self.assertTrue(result['msg'].startswith('cannot read users_file'))
@@ -11,11 +11,11 @@ class UpdateEmailTest(unittest.TestCase):
     @mock.patch('library.gitlab_user._send_request')
     def testUpdateExistingEmail(self, send_request_mock):
         send_request_mock.side_effect = (
-            ({'status': '200 OK'}, ''),
-            ({'status': '201 Created'}, '')
+            ({'status': '201 Created'}, '{"id":2,"email":"someone@something.com"}'),
+            ({'status': '200 OK'}, '')
         )
 
-        library.gitlab_user._update_email(
+        result = library.gitlab_user._update_email(
             'http://somedomain.com/api/v3',
             '576932',
             12,
@@ -23,26 +23,42 @@ class UpdateEmailTest(unittest.TestCase):
             'someone@something.com'
         )
 
-        self.assertEquals('DELETE', send_request_mock.call_args_list[0][0][0])
-        self.assertEquals('http://somedomain.com/api/v3/users/12/emails/1', send_request_mock.call_args_list[0][0][1])
-        self.assertEquals({'PRIVATE-TOKEN': '576932'}, send_request_mock.call_args_list[0][0][2])
+        self.assertEquals({'id': 2, 'email': 'someone@something.com'}, result)
 
-        self.assertEquals('POST', send_request_mock.call_args_list[1][0][0])
+        self.assertEquals('POST', send_request_mock.call_args_list[0][0][0])
         self.assertEquals(
             'http://somedomain.com/api/v3/users/12/emails',
-            send_request_mock.call_args_list[1][0][1]
+            send_request_mock.call_args_list[0][0][1]
         )
         self.assertEquals(
             {'PRIVATE-TOKEN': '576932', 'Content-Type': 'application/json'},
-            send_request_mock.call_args_list[1][0][2]
+            send_request_mock.call_args_list[0][0][2]
         )
         self.assertEquals(
             '{"id": 12, "email": "someone@something.com"}',
-            send_request_mock.call_args_list[1][0][3]
+            send_request_mock.call_args_list[0][0][3]
         )
 
+        self.assertEquals('DELETE', send_request_mock.call_args_list[1][0][0])
+        self.assertEquals('http://somedomain.com/api/v3/users/12/emails/1', send_request_mock.call_args_list[1][0][1])
+        self.assertEquals({'PRIVATE-TOKEN': '576932'}, send_request_mock.call_args_list[1][0][2])
+
     @mock.patch('library.gitlab_user._send_request')
-    def testGitlabApiRespondsWithErrorOnDelete(self, send_request_mock):
+    def testOldEmailNotListed_dontSendDeleteRequest(self, send_request_mock):
+        send_request_mock.return_value = {'status': '201 Created'}, '{"id":2,"email":"someone@something.com"}'
+
+        library.gitlab_user._update_email(
+            'http://somedomain.com/api/v3',
+            '576932',
+            12,
+            None,
+            'someone@something.com'
+        )
+
+        self.assertEquals(1, send_request_mock.call_count)
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testGitlabApiRespondsWithErrorOnCreate(self, send_request_mock):
         send_request_mock.return_value = {'status': '500 Internal Server Error'}, 'some message'
 
         with self.assertRaises(library.gitlab_user.GitlabModuleInternalException) as ex:
@@ -54,11 +70,12 @@ class UpdateEmailTest(unittest.TestCase):
                 'someone@something.com'
             )
         self.assertEquals("500 Internal Server Error\nsome message", ex.exception.message)
+        self.assertEquals(1, send_request_mock.call_count)
 
     @mock.patch('library.gitlab_user._send_request')
-    def testGitlabApiRespondsWithErrorOnCreate(self, send_request_mock):
+    def testGitlabApiRespondsWithErrorOnDelete(self, send_request_mock):
         send_request_mock.side_effect = (
-            ({'status': '200 OK'}, ''),
+            ({'status': '201 Created'}, ''),
             ({'status': '500 Internal Server Error'}, 'some message')
         )
 
@@ -70,4 +87,51 @@ class UpdateEmailTest(unittest.TestCase):
                 1,
                 'someone@something.com'
             )
-        self.assertEquals("500 Internal Server Error\nsome message", ex.exception.message)
\ No newline at end of file
+        self.assertEquals("500 Internal Server Error\nsome message", ex.exception.message)
+
+
+class ReconcileEmailTest(unittest.TestCase):
+
+    def setUp(self):
+        self.params = {
+            'username': 'testusername',
+            'email': 'new@something.com',
+            'api_url': 'http://somedomain.com/api/v3',
+            'private_token': '576932'
+        }
+        self.requests = []
+
+    def respond(self, responses):
+        def send_request(method, url, headers, body=None, created_check=None):
+            self.requests.append((method, url))
+            return responses[(method, url)]
+        return send_request
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testNewEmailListedAlready_deleteOldEmail(self, send_request_mock):
+        send_request_mock.side_effect = self.respond({
+            ('GET', 'http://somedomain.com/api/v3/users?username=testusername'):
+                ({'status': '200 OK'}, '[{"username":"testusername","id":12,"email":"old@something.com"}]'),
+            ('GET', 'http://somedomain.com/api/v3/users/12/emails?per_page=100'):
+                ({'status': '200 OK'}, '[{"id":1,"email":"old@something.com"},{"id":2,"email":"new@something.com"}]'),
+            ('DELETE', 'http://somedomain.com/api/v3/users/12/emails/1'): ({'status': '200 OK'}, '')
+        })
+
+        result = library.gitlab_user.create_or_update_user(self.params, False)
+
+        self.assertTrue(result)
+        self.assertEqual(('DELETE', 'http://somedomain.com/api/v3/users/12/emails/1'), self.requests[-1])
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testEmailDiffersInCaseOnly_noChange(self, send_request_mock):
+        for api_url in ('http://somedomain.com/api/v3', 'http://somedomain.com/api/v4'):
+            send_request_mock.reset_mock()
+            send_request_mock.return_value = \
+                {'status': '200 OK'}, '[{"username":"testusername","id":12,"email":"new@something.com"}]'
+
+            result = library.gitlab_user.create_or_update_user(
+                dict(self.params, email='New@Something.com', api_url=api_url), False
+            )
+
+            self.assertFalse(result)
+            self.assertEqual(1, send_request_mock.call_count)
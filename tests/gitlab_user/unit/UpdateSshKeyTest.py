@@ -11,11 +11,10 @@ class UpdateSshKeyTest(unittest.TestCase):
     def testCreateNewSshKey(self, send_request_mock):
         send_request_mock.return_value = {'status': '201 Created'}, ''
 
-        library.gitlab_user._update_ssh_key(
+        result = library.gitlab_user._add_ssh_key(
             'http://somedomain.com/api/v3',
             '576932',
             12,
-            None,
             'title',
             'hishguislg'
         )
@@ -33,52 +32,135 @@ class UpdateSshKeyTest(unittest.TestCase):
             '{"id": 12, "key": "hishguislg", "title": "title"}',
             send_request_mock.call_args_list[0][0][3]
         )
+        self.assertEquals({'title': 'title', 'key': 'hishguislg'}, result)
 
     @mock.patch('library.gitlab_user._send_request')
-    def testUpdateExistingSshKey(self, send_request_mock):
-        send_request_mock.side_effect = (
-            ({'status': '200 OK'}, ''),
-            ({'status': '201 Created'}, '')
-        )
+    def testDeleteExistingSshKey(self, send_request_mock):
+        send_request_mock.return_value = {'status': '200 OK'}, ''
 
-        library.gitlab_user._update_ssh_key(
+        library.gitlab_user._delete_ssh_key(
             'http://somedomain.com/api/v3',
             '576932',
             12,
-            1,
-            'title',
-            'hishguislg'
+            1
         )
 
         self.assertEquals('DELETE', send_request_mock.call_args_list[0][0][0])
         self.assertEquals('http://somedomain.com/api/v3/users/12/keys/1', send_request_mock.call_args_list[0][0][1])
         self.assertEquals({'PRIVATE-TOKEN': '576932'}, send_request_mock.call_args_list[0][0][2])
 
-        self.assertEquals('POST', send_request_mock.call_args_list[1][0][0])
-        self.assertEquals(
-            'http://somedomain.com/api/v3/users/12/keys',
-            send_request_mock.call_args_list[1][0][1]
-        )
-        self.assertEquals(
-            {'PRIVATE-TOKEN': '576932', 'Content-Type': 'application/json'},
-            send_request_mock.call_args_list[1][0][2]
-        )
-        self.assertEquals(
-            '{"id": 12, "key": "hishguislg", "title": "title"}',
-            send_request_mock.call_args_list[1][0][3]
-        )
-
     @mock.patch('library.gitlab_user._send_request')
     def testGitlabApiRespondsWithError(self, send_request_mock):
         send_request_mock.return_value = {'status': '500 Internal Server Error'}, 'some message'
 
         with self.assertRaises(library.gitlab_user.GitlabModuleInternalException) as ex:
-            library.gitlab_user._update_ssh_key(
+            library.gitlab_user._add_ssh_key(
                 'http://somedomain.com/api/v3',
                 '576932',
                 12,
-                None,
                 'title',
                 'hishguislg'
             )
         self.assertEquals("500 Internal Server Error\nsome message", ex.exception.message)
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testGitlabApiRespondsWithErrorOnDelete(self, send_request_mock):
+        send_request_mock.return_value = {'status': '404 Not Found'}, 'some message'
+
+        with self.assertRaises(library.gitlab_user.GitlabModuleInternalException) as ex:
+            library.gitlab_user._delete_ssh_key('http://somedomain.com/api/v3', '576932', 12, 1)
+        self.assertEquals("404 Not Found\nsome message", ex.exception.message)
+
+
+class UpdateSshKeysTest(unittest.TestCase):
+
+    existing_keys = '[{"id":1,"title":"key1","key":"aaaa"},{"id":2,"title":"key2","key":"bbbb"},' \
+                    '{"id":3,"title":"key3","key":"cccc"}]'
+
+    def setUp(self):
+        self.params = {
+            'username': 'testusername',
+            'api_url': 'http://something.com/api/v3',
+            'private_token': 'abc123',
+            'ssh_keys': [
+                {'title': 'key1', 'key': 'aaaa'},
+                {'title': 'key2', 'key': 'dddd'},
+                {'title': 'key4', 'key': 'eeee'}
+            ]
+        }
+        self.user = {'id': 12, 'username': 'testusername'}
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testDiffSshKeys_uploadMissingKeysAndReplaceKeysOfTheSameTitle(self, send_request_mock):
+        send_request_mock.return_value = {'status': '200 OK'}, self.existing_keys
+        resources = library.gitlab_user._UserResources(self.params['api_url'], self.params['private_token'], 12)
+
+        new_keys, stale_keys = library.gitlab_user._diff_ssh_keys(self.params, self.user, resources)
+
+        self.assertEqual([{'title': 'key2', 'key': 'dddd'}, {'title': 'key4', 'key': 'eeee'}], new_keys)
+        self.assertEqual([2], [ssh_key['id'] for ssh_key in stale_keys])
+        self.assertEqual(1, send_request_mock.call_count)
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testDiffSshKeys_exclusive_deleteKeysNotListed(self, send_request_mock):
+        send_request_mock.return_value = {'status': '200 OK'}, self.existing_keys
+        resources = library.gitlab_user._UserResources(self.params['api_url'], self.params['private_token'], 12)
+        self.params['ssh_keys_exclusive'] = True
+
+        new_keys, stale_keys = library.gitlab_user._diff_ssh_keys(self.params, self.user, resources)
+
+        self.assertEqual(2, len(new_keys))
+        self.assertEqual([2, 3], [ssh_key['id'] for ssh_key in stale_keys])
+
+    def testDiffSshKeys_newUser_uploadAllKeys(self):
+        new_keys, stale_keys = library.gitlab_user._diff_ssh_keys(self.params, None, None)
+
+        self.assertEqual(self.params['ssh_keys'], new_keys)
+        self.assertEqual([], stale_keys)
+
+    def testDiffSshKeys_entryWithoutKey_raiseError(self):
+        self.params['ssh_keys'].append({'title': 'key5'})
+
+        with self.assertRaises(library.gitlab_user.GitlabModuleInternalException):
+            library.gitlab_user._diff_ssh_keys(self.params, None, None)
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testCreateOrUpdateUser_sendOnlyNeededWrites(self, send_request_mock):
+        responses = {
+            ('GET', 'http://something.com/api/v3/users?username=testusername'):
+                ({'status': '200 OK'}, '[{"username":"testusername","id":12,"name":"Test"}]'),
+            ('GET', 'http://something.com/api/v3/users/12/keys?per_page=100'):
+                ({'status': '200 OK'}, self.existing_keys),
+            ('DELETE', 'http://something.com/api/v3/users/12/keys/2'): ({'status': '200 OK'}, ''),
+            ('POST', 'http://something.com/api/v3/users/12/keys'): ({'status': '201 Created'}, '')
+        }
+        send_request_mock.side_effect = \
+            lambda method, url, headers, body=None, created_check=None: responses[(method, url)]
+        report = {}
+
+        result = library.gitlab_user.create_or_update_user(self.params, False, report=report)
+
+        self.assertTrue(result)
+        self.assertEqual(
+            ['GET', 'GET', 'POST', 'POST', 'DELETE'],
+            [call[0][0] if call[0] else call[1]['method'] for call in send_request_mock.call_args_list]
+        )
+        self.assertEqual({'added': ['key2', 'key4'], 'removed': ['key2']}, report['ssh_keys'])
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testCreateOrUpdateUser_uploadFails_keepStaleKey(self, send_request_mock):
+        responses = {
+            ('GET', 'http://something.com/api/v3/users?username=testusername'):
+                ({'status': '200 OK'}, '[{"username":"testusername","id":12,"name":"Test"}]'),
+            ('GET', 'http://something.com/api/v3/users/12/keys?per_page=100'):
+                ({'status': '200 OK'}, self.existing_keys),
+            ('POST', 'http://something.com/api/v3/users/12/keys'): ({'status': '400 Bad Request'}, 'invalid key')
+        }
+        send_request_mock.side_effect = \
+            lambda method, url, headers, body=None, created_check=None: responses[(method, url)]
+
+        with self.assertRaises(library.gitlab_user.GitlabModuleInternalException):
+            library.gitlab_user.create_or_update_user(self.params, False)
+
+        self.assertNotIn('DELETE', [call[0][0] if call[0] else call[1]['method']
+                                    for call in send_request_mock.call_args_list])
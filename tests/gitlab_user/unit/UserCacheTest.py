@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+import json
+import multiprocessing
+import os
+import shutil
+import stat
+import tempfile
+import time
+import unittest
+import mock
+import library.gitlab_user
+
+
+class UserCacheTest(unittest.TestCase):
+
+    api_url = 'http://somedomain.com/api/v3'
+    users_url = 'http://somedomain.com/api/v3/users?order_by=id&sort=asc&per_page=100'
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        library.gitlab_user._close_user_cache()
+        shutil.rmtree(self.cache_dir)
+
+    def enable_cache(self, max_age):
+        library.gitlab_user._enable_user_cache(os.path.join(self.cache_dir, 'cache'), self.api_url, max_age)
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testNotModified_answerFromCacheOfPreviousRun(self, send_request_mock):
+        send_request_mock.side_effect = (
+            ({'status': '200 OK', 'etag': 'W/"abc"', 'x-total-pages': '1'},
+             '[{"id":1,"username":"user1"},{"id":2,"username":"user2"}]'),
+            ({'status': '304 Not Modified', 'etag': 'W/"abc"'}, '')
+        )
+        self.enable_cache(0)
+        first_users = library.gitlab_user._list_all_users(self.api_url, '576932')
+        self.enable_cache(0)
+
+        second_users = library.gitlab_user._list_all_users(self.api_url, '576932')
+
+        self.assertEqual(first_users, second_users)
+        self.assertEqual({'PRIVATE-TOKEN': '576932'}, send_request_mock.call_args_list[0][1]['headers'])
+        self.assertEqual(
+            {'PRIVATE-TOKEN': '576932', 'If-None-Match': 'W/"abc"'},
+            send_request_mock.call_args_list[1][1]['headers']
+        )
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testModified_replaceCachedPage(self, send_request_mock):
+        send_request_mock.side_effect = (
+            ({'status': '200 OK', 'last-modified': 'Mon, 05 Oct 2026 10:00:00 GMT'}, '[{"id":1,"username":"user1"}]'),
+            ({'status': '200 OK', 'last-modified': 'Tue, 06 Oct 2026 10:00:00 GMT'}, '[{"id":2,"username":"user2"}]'),
+            ({'status': '304 Not Modified'}, '')
+        )
+        self.enable_cache(0)
+        library.gitlab_user._list_all_users(self.api_url, '576932')
+        library.gitlab_user._list_all_users(self.api_url, '576932')
+
+        users = library.gitlab_user._list_all_users(self.api_url, '576932')
+
+        self.assertEqual([{'id': 2, 'username': 'user2'}], users)
+        self.assertEqual(
+            {'PRIVATE-TOKEN': '576932', 'If-Modified-Since': 'Tue, 06 Oct 2026 10:00:00 GMT'},
+            send_request_mock.call_args_list[2][1]['headers']
+        )
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testFreshPage_dontSendRequest(self, send_request_mock):
+        send_request_mock.side_effect = lambda method, url, headers: \
+            ({'status': '200 OK', 'x-total-pages': '2'},
+             '[{"id":2,"username":"user2"}]' if 'page=2' in url else '[{"id":1,"username":"user1"}]')
+        self.enable_cache(60)
+        library.gitlab_user._list_all_users(self.api_url, '576932')
+
+        users = library.gitlab_user._list_all_users(self.api_url, '576932')
+
+        self.assertEqual([{'id': 1, 'username': 'user1'}, {'id': 2, 'username': 'user2'}], users)
+        self.assertEqual(2, send_request_mock.call_count)
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testUserChangedByModule_updateCachedPages(self, send_request_mock):
+        send_request_mock.side_effect = (
+            ({'status': '200 OK', 'etag': 'W/"abc"'}, '[{"id":1,"username":"user1"},{"id":2,"username":"user2"}]'),
+            ({'status': '200 OK', 'etag': 'W/"def"'}, '[]')
+        )
+        self.enable_cache(60)
+        library.gitlab_user._list_all_users(self.api_url, '576932')
+        library.gitlab_user._find_user_by_name(self.api_url, '576932', 'user3')
+
+        library.gitlab_user._user_cache.store_user({'id': 1, 'username': 'user1', 'name': 'User One'})
+        library.gitlab_user._user_cache.store_user({'id': 3, 'username': 'user3'})
+        library.gitlab_user._user_cache.discard_user({'id': 2, 'username': 'user2'})
+
+        self.assertEqual(
+            [{'id': 1, 'username': 'user1', 'name': 'User One'}],
+            library.gitlab_user._list_all_users(self.api_url, '576932')
+        )
+        self.assertEqual(
+            {'id': 3, 'username': 'user3'},
+            library.gitlab_user._find_user_by_name(self.api_url, '576932', 'user3')
+        )
+        self.assertEqual(2, send_request_mock.call_count)
+
+    @mock.patch('time.sleep')
+    @mock.patch('library.gitlab_user._perform_request')
+    def testPostFailedAfterCreating_readBackPastFreshPage(self, perform_request_mock, sleep_mock):
+        perform_request_mock.side_effect = (
+            ({'status': '200 OK', 'etag': 'W/"abc"'}, '[]'),
+            library.gitlab_user.GitlabHttpError(502, 'Bad Gateway', {}, ''),
+            ({'status': '200 OK', 'etag': 'W/"def"'}, '[{"id":3,"username":"user3"}]')
+        )
+        self.enable_cache(60)
+        library.gitlab_user._enable_retries(3, 0.5, 0.0, 60.0)
+        self.addCleanup(setattr, library.gitlab_user, '_retry_policy', None)
+        self.assertIsNone(library.gitlab_user._find_user_by_name(self.api_url, '576932', 'user3'))
+
+        user = library.gitlab_user._update_user(self.api_url, '576932', None, {'username': 'user3'})
+
+        self.assertEqual({'id': 3, 'username': 'user3'}, user)
+        self.assertEqual(
+            ['GET', 'POST', 'GET'],
+            [call[0][0] for call in perform_request_mock.call_args_list]
+        )
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testKeysChangedByModule_dropCachedKeyListing(self, send_request_mock):
+        send_request_mock.return_value = {'status': '200 OK', 'etag': 'W/"abc"'}, '[]'
+        self.enable_cache(60)
+        keys_url = self.api_url + '/users/1/keys'
+        list(library.gitlab_user._iterate_pages(keys_url, '576932'))
+        list(library.gitlab_user._iterate_pages(keys_url, '576932'))
+        self.assertEqual(1, send_request_mock.call_count)
+
+        library.gitlab_user._user_cache.discard_listing(keys_url)
+        list(library.gitlab_user._iterate_pages(keys_url, '576932'))
+
+        self.assertEqual(2, send_request_mock.call_count)
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testOnlyUserAndKeyListingsAreCached(self, send_request_mock):
+        send_request_mock.return_value = {'status': '200 OK', 'etag': 'W/"abc"'}, '[]'
+        self.enable_cache(60)
+
+        list(library.gitlab_user._iterate_pages(self.api_url + '/users/1/emails', '576932'))
+        list(library.gitlab_user._iterate_pages(self.api_url + '/users/1/emails', '576932'))
+
+        self.assertEqual(2, send_request_mock.call_count)
+        self.assertEqual({'PRIVATE-TOKEN': '576932'}, send_request_mock.call_args_list[1][1]['headers'])
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testCacheFileReadableByOwnerOnly(self, send_request_mock):
+        send_request_mock.return_value = {'status': '200 OK', 'etag': 'W/"abc"'}, '[{"id":1,"username":"user1"}]'
+        self.enable_cache(60)
+        library.gitlab_user._list_all_users(self.api_url, '576932')
+
+        page_file = library.gitlab_user._user_cache._page_path(self.users_url)
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(page_file).st_mode))
+        with open(page_file) as state_file:
+            self.assertEqual([{'id': 1, 'username': 'user1'}], json.load(state_file)['records'])
+
+    def testConcurrentProcesses_onlyFirstSendsRequest(self):
+        request_log = os.path.join(self.cache_dir, 'requests.log')
+
+        def send_request(method, url, headers, body=None, created_check=None):
+            with open(request_log, 'a') as log_file:
+                log_file.write(url + '\n')
+            time.sleep(0.2)
+            return {'status': '200 OK', 'etag': 'W/"abc"'}, '[{"id":1,"username":"user1"}]'
+
+        def list_users(results):
+            self.enable_cache(60)
+            results.put(library.gitlab_user._list_all_users(self.api_url, '576932'))
+
+        results = multiprocessing.Queue()
+        with mock.patch('library.gitlab_user._send_request', side_effect=send_request):
+            processes = [multiprocessing.Process(target=list_users, args=(results,)) for _ in range(5)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+
+        self.assertEqual([[{'id': 1, 'username': 'user1'}]] * 5, [results.get() for _ in processes])
+        with open(request_log) as log_file:
+            self.assertEqual([self.users_url], log_file.read().splitlines())
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testUsernameLookups_shareLockFiles(self, send_request_mock):
+        send_request_mock.return_value = {'status': '200 OK', 'etag': 'W/"abc"'}, '[]'
+        self.enable_cache(60)
+
+        for number in range(1000):
+            library.gitlab_user._find_user_by_name(self.api_url, '576932', 'user%d' % number)
+
+        lock_files = [name for name in os.listdir(library.gitlab_user._user_cache.path) if name.startswith('lock-')]
+        self.assertTrue(0 < len(lock_files) <= 256)
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testExpiredPages_removeWhenCacheEnabled(self, send_request_mock):
+        send_request_mock.return_value = {'status': '200 OK', 'etag': 'W/"abc"'}, '[]'
+        self.enable_cache(60)
+        library.gitlab_user._find_user_by_name(self.api_url, '576932', 'old')
+        library.gitlab_user._find_user_by_name(self.api_url, '576932', 'recent')
+        cache = library.gitlab_user._user_cache
+        old_page = cache._page_path(self.api_url + '/users?username=old')
+        recent_page = cache._page_path(self.api_url + '/users?username=recent')
+        two_days_ago = time.time() - 2 * 86400
+        os.utime(old_page, (two_days_ago, two_days_ago))
+        os.utime(os.path.join(cache.path, 'expired'), (two_days_ago, two_days_ago))
+
+        self.enable_cache(60)
+
+        self.assertFalse(os.path.exists(old_page))
+        self.assertTrue(os.path.exists(recent_page))
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import mock
+import library.gitlab_user
+
+
+class UserRecordTest(unittest.TestCase):
+
+    def testReadLikeUserDict(self):
+        record = library.gitlab_user._UserRecord(
+            {'id': 3, 'username': 'someone', 'name': 'Someone', 'is_admin': False, 'avatar_url': 'http://x/a.png'}
+        )
+
+        self.assertEqual(3, record['id'])
+        self.assertTrue('is_admin' in record)
+        self.assertFalse('email' in record)
+        self.assertFalse('avatar_url' in record)
+        self.assertIsNone(record.get('email'))
+        self.assertEqual({'id': 3, 'username': 'someone', 'name': 'Someone', 'is_admin': False}, dict(record))
+        with self.assertRaises(KeyError):
+            record['bio']
+
+    def testShareRepeatedValues(self):
+        first = library.gitlab_user._UserRecord({'id': 1, 'username': 'first', 'state': u''.join([u'act', u'ive'])})
+        second = library.gitlab_user._UserRecord({'id': 2, 'username': 'second', 'state': u''.join([u'acti', u've'])})
+
+        self.assertIs(first['state'], second['state'])
+
+    def testFreeTextFields_notShared(self):
+        first = library.gitlab_user._UserRecord({'id': 1, 'username': 'first', 'bio': u''.join([u'some', u'bio'])})
+        second = library.gitlab_user._UserRecord({'id': 2, 'username': 'second', 'bio': u''.join([u'som', u'ebio'])})
+
+        self.assertEqual(first['bio'], second['bio'])
+        self.assertIsNot(first['bio'], second['bio'])
+        self.assertNotIn(u'somebio', library.gitlab_user._user_strings)
+
+    def testDiffAgainstRecord(self):
+        record = library.gitlab_user._UserRecord({'id': 3, 'username': 'someone', 'name': 'Someone', 'is_admin': False})
+
+        self.assertEqual(
+            {'name': 'Other', 'admin': True},
+            library.gitlab_user._diff_user({'username': 'someone', 'name': 'Other', 'admin': True}, record)
+        )
+
+
+class UserIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = library.gitlab_user._UserIndex([
+            {'id': 3, 'username': 'first', 'email': 'First@Something.com', 'extern_uid': 'uid=first'},
+            {'id': 4, 'username': 'second', 'email': 'second@something.com'}
+        ])
+
+    def testLookUpByEveryKey(self):
+        self.assertEqual(3, self.index.by_username('first')['id'])
+        self.assertEqual('second', self.index.by_id(4)['username'])
+        self.assertEqual('first', self.index.by_email('first@something.COM')['username'])
+        self.assertEqual('first', self.index.by_extern_uid('uid=first')['username'])
+        self.assertIsNone(self.index.by_username('missing'))
+        self.assertEqual(2, len(self.index))
+
+    def testRenamedUser_replaceRecord(self):
+        self.index.add({'id': 3, 'username': 'renamed', 'email': 'renamed@something.com'})
+
+        self.assertIsNone(self.index.by_username('first'))
+        self.assertIsNone(self.index.by_email('first@something.com'))
+        self.assertIsNone(self.index.by_extern_uid('uid=first'))
+        self.assertEqual('renamed', self.index.by_id(3)['username'])
+        self.assertEqual(['renamed', 'second'], sorted(record['username'] for record in self.index))
+
+    def testRemove(self):
+        self.index.remove('first')
+
+        self.assertIsNone(self.index.by_id(3))
+        self.assertIsNone(self.index.by_email('first@something.com'))
+        self.assertEqual(1, len(self.index))
+
+    @mock.patch('library.gitlab_user._send_request')
+    def testLoadDirectory_convertEveryPage(self, send_request_mock):
+        send_request_mock.side_effect = (
+            ({'status': '200 OK', 'X-Next-Page': '2'}, '[{"id":2,"username":"second","web_url":"http://x/second"}]'),
+            ({'status': '200 OK', 'X-Next-Page': ''}, '[{"id":1,"username":"first","web_url":"http://x/first"}]')
+        )
+
+        directory = library.gitlab_user._load_user_directory('http://somedomain.com/api/v3', '576932')
+
+        self.assertIsInstance(directory.find('first'), library.gitlab_user._UserRecord)
+        self.assertEqual({'id': 2, 'username': 'second'}, dict(directory.find('second')))
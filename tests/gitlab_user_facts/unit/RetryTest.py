@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import mock
+import library.gitlab_user_facts
+
+USERS_URL = 'http://somedomain.com/api/v3/users?per_page=100'
+
+
+def _http_error(status, reason='Service Unavailable', headers=None):
+    return library.gitlab_user_facts.GitlabHttpError(status, reason, headers or {}, 'some message')
+
+
+@mock.patch('time.sleep')
+@mock.patch('library.gitlab_user_facts._send_request_once')
+class RetryTest(unittest.TestCase):
+
+    def setUp(self):
+        library.gitlab_user_facts._enable_retries(3, 0.5, 1.0, 60.0)
+
+    @mock.patch('random.random')
+    def testTransientError_retryWithExponentialBackoff(self, random_mock, send_request_once_mock, sleep_mock):
+        random_mock.return_value = 0.0
+        send_request_once_mock.side_effect = (
+            _http_error(502, 'Bad Gateway'),
+            library.gitlab_user_facts.GitlabModuleInternalException('connection reset'),
+            ({}, '[]')
+        )
+
+        result = library.gitlab_user_facts._send_request(USERS_URL, '576932')
+
+        self.assertEqual(({}, '[]'), result)
+        self.assertEqual([mock.call(0.5), mock.call(1.0)], sleep_mock.call_args_list)
+
+    def testRetriesExhausted(self, send_request_once_mock, sleep_mock):
+        send_request_once_mock.side_effect = _http_error(503)
+
+        with self.assertRaises(library.gitlab_user_facts.GitlabHttpError) as ex:
+            library.gitlab_user_facts._send_request(USERS_URL, '576932')
+
+        self.assertEqual('503 Service Unavailable\nsome message', ex.exception.message)
+        self.assertEqual(4, send_request_once_mock.call_count)
+
+    @mock.patch('random.random')
+    @mock.patch('time.time')
+    def testDelayWouldPassDeadline_dontRetry(self, time_mock, random_mock, send_request_once_mock, sleep_mock):
+        library.gitlab_user_facts._enable_retries(3, 10.0, 1.0, 60.0)
+        time_mock.side_effect = (1000.0, 1045.0, 1045.0)
+        random_mock.side_effect = (0.75, 0.0)  # delays of 2.5 and 20 seconds
+        send_request_once_mock.side_effect = (_http_error(503), _http_error(503))
+
+        with self.assertRaises(library.gitlab_user_facts.GitlabHttpError):
+            library.gitlab_user_facts._send_request(USERS_URL, '576932')
+
+        self.assertEqual([mock.call(2.5)], sleep_mock.call_args_list)
+        self.assertEqual(2, send_request_once_mock.call_count)
+
+    def testNonTransientError_dontRetry(self, send_request_once_mock, sleep_mock):
+        send_request_once_mock.side_effect = _http_error(403, 'Forbidden')
+
+        with self.assertRaises(library.gitlab_user_facts.GitlabHttpError):
+            library.gitlab_user_facts._send_request(USERS_URL, '576932')
+
+        self.assertEqual(1, send_request_once_mock.call_count)
+
+    def testTooManyRequests_waitForRetryAfter(self, send_request_once_mock, sleep_mock):
+        send_request_once_mock.side_effect = [
+            _http_error(429, 'Too Many Requests', {'Retry-After': '7'}) for _ in range(5)
+        ] + [({}, '[]')]
+
+        result = library.gitlab_user_facts._send_request(USERS_URL, '576932')
+
+        self.assertEqual(({}, '[]'), result)
+        self.assertEqual([mock.call(7)] * 5, sleep_mock.call_args_list)
+
+    def testTooManyRequestsWithoutRetryAfter_doubleWait(self, send_request_once_mock, sleep_mock):
+        send_request_once_mock.side_effect = (
+            _http_error(429, 'Too Many Requests'),
+            _http_error(429, 'Too Many Requests'),
+            ({}, '[]')
+        )
+
+        library.gitlab_user_facts._send_request(USERS_URL, '576932')
+
+        self.assertEqual([mock.call(2), mock.call(4)], sleep_mock.call_args_list)
+
+    def testTooManyRequestsPersisting_giveUp(self, send_request_once_mock, sleep_mock):
+        send_request_once_mock.side_effect = _http_error(429, 'Too Many Requests', {'Retry-After': '1'})
+
+        with self.assertRaises(library.gitlab_user_facts.GitlabHttpError):
+            library.gitlab_user_facts._send_request(USERS_URL, '576932')
+
+        self.assertEqual(library.gitlab_user_facts.max_rate_limited_attempts, send_request_once_mock.call_count)
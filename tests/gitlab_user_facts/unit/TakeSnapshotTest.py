@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+import mock
+import library.gitlab_user
+import library.gitlab_user_facts
+
+RSA_KEY = 'ssh-rsa AAAAB3NzaC1yc2EAAAADAQABAAAAgQC9 someone@somehost'
+
+
+class TakeSnapshotTest(unittest.TestCase):
+
+    responses = {
+        'http://somedomain.com/api/v3/users?order_by=id&sort=asc&per_page=100': (
+            {'X-Total-Pages': '2'},
+            '[{"id":2,"username":"user2","name":"User Two","email":"two@something.com","private_token":"secret"}]'
+        ),
+        'http://somedomain.com/api/v3/users?order_by=id&sort=asc&per_page=100&page=2': (
+            {},
+            '[{"id":1,"username":"user1","name":"User One","email":"one@something.com","is_admin":true}]'
+        ),
+        'http://somedomain.com/api/v3/users/1/emails?per_page=100': ({}, '[{"id":5,"email":"one@else.com"}]'),
+        'http://somedomain.com/api/v3/users/2/emails?per_page=100': ({}, '[]'),
+        'http://somedomain.com/api/v3/users/1/keys?per_page=100': (
+            {}, '[{"id":7,"title":"laptop","key":"%s","created_at":"2016-01-01"}]' % RSA_KEY
+        ),
+        'http://somedomain.com/api/v3/users/2/keys?per_page=100': ({}, '[]')
+    }
+
+    @mock.patch('library.gitlab_user_facts._send_request')
+    def testSnapshotOfUsersEmailsAndKeyFingerprints(self, send_request_mock):
+        send_request_mock.side_effect = lambda url, private_token: self.responses[url]
+
+        snapshot = library.gitlab_user_facts.take_snapshot(
+            'http://somedomain.com/api/v3', '576932', ['emails', 'ssh_keys']
+        )
+
+        self.assertEqual('http://somedomain.com/api/v3', snapshot['api_url'])
+        self.assertEqual([
+            {
+                'id': 1, 'username': 'user1', 'name': 'User One', 'email': 'one@something.com', 'is_admin': True,
+                'emails': [{'id': 5, 'email': 'one@else.com'}],
+                'ssh_keys': [{'id': 7, 'title': 'laptop', 'fingerprint': library.gitlab_user._ssh_key_fingerprint(RSA_KEY)}]
+            },
+            {
+                'id': 2, 'username': 'user2', 'name': 'User Two', 'email': 'two@something.com',
+                'emails': [],
+                'ssh_keys': []
+            }
+        ], snapshot['users'])
+
+    @mock.patch('library.gitlab_user_facts._send_request')
+    def testOnlyIncludedListingsAreFetched(self, send_request_mock):
+        send_request_mock.side_effect = lambda url, private_token: self.responses[url]
+
+        snapshot = library.gitlab_user_facts.take_snapshot('http://somedomain.com/api/v3', '576932', [])
+
+        self.assertNotIn('emails', snapshot['users'][0])
+        self.assertNotIn('ssh_keys', snapshot['users'][0])
+        self.assertEqual(2, send_request_mock.call_count)
+
+    def testFingerprintMatchesGitlabUser(self):
+        for ssh_key in (RSA_KEY, 'ssh-rsa abc', 'nvireqvtgzoufigru'):
+            self.assertEqual(
+                library.gitlab_user._ssh_key_fingerprint(ssh_key),
+                library.gitlab_user_facts._ssh_key_fingerprint(ssh_key)
+            )
+
+    @mock.patch('library.gitlab_user_facts._send_request')
+    def testUserShiftedToNextPageDuringSweep_snapshotOnce(self, send_request_mock):
+        responses = dict(self.responses)
+        responses['http://somedomain.com/api/v3/users?order_by=id&sort=asc&per_page=100&page=2'] = (
+            {}, '[{"id":2,"username":"user2"},{"id":1,"username":"user1"}]'
+        )
+        send_request_mock.side_effect = lambda url, private_token: responses[url]
+
+        snapshot = library.gitlab_user_facts.take_snapshot('http://somedomain.com/api/v3', '576932', [])
+
+        self.assertEqual([1, 2], [user['id'] for user in snapshot['users']])
+
+    def testErrorMessageMatchesGitlabUser(self):
+        self.assertEqual(
+            library.gitlab_user.GitlabHttpError(502, 'Bad Gateway', {}, 'some message').message,
+            library.gitlab_user_facts.GitlabHttpError(502, 'Bad Gateway', {}, 'some message').message
+        )
+
+    def testRetryDelayMatchesGitlabUser(self):
+        with mock.patch('random.random', return_value=0.25):
+            for attempt in range(8):
+                self.assertEqual(
+                    library.gitlab_user._RetryPolicy(3, 0.5, 0.5, 60.0).delay(attempt),
+                    library.gitlab_user_facts._RetryPolicy(3, 0.5, 0.5, 60.0).delay(attempt)
+                )
+
+    def testWriteSnapshotReadableByOwnerOnly(self):
+        snapshot_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(snapshot_dir, 'snapshots', 'users.json')
+            library.gitlab_user_facts.write_snapshot(path, {'api_url': 'http://somedomain.com/api/v3', 'users': []})
+
+            self.assertEqual(0o600, stat.S_IMODE(os.stat(path).st_mode))
+            with open(path) as snapshot_file:
+                self.assertEqual({'api_url': 'http://somedomain.com/api/v3', 'users': []}, json.load(snapshot_file))
+        finally:
+            shutil.rmtree(snapshot_dir)
+
+    @mock.patch('library.gitlab_user_facts.write_snapshot')
+    @mock.patch('library.gitlab_user_facts._send_request')
+    @mock.patch('library.gitlab_user_facts.AnsibleModule')
+    def testCheckMode_dontWriteDest(self, ansible_module_mock, send_request_mock, write_snapshot_mock):
+        send_request_mock.side_effect = lambda url, private_token: self.responses[url]
+        ansible_module = ansible_module_mock.return_value
+        ansible_module.params = {'api_url': 'http://somedomain.com/api/v3', 'private_token': '576932',
+                                 'dest': '/tmp/gitlab_users.json', 'include': [], 'max_workers': 4,
+                                 'retries': 3, 'retry_backoff': 0.5, 'retry_jitter': 1.0, 'retry_deadline': 60.0}
+        ansible_module.check_mode = True
+        ansible_module.exit_json.side_effect = SystemExit
+
+        with self.assertRaises(SystemExit):
+            library.gitlab_user_facts.main()
+
+        self.assertEqual(0, write_snapshot_mock.call_count)
+        ansible_module.exit_json.assert_called_once_with(changed=False, dest='/tmp/gitlab_users.json', users=2)